@@ -66,8 +66,9 @@ TEMPLATES = [
     },
 ]
 
-# 🔥 WSGI
+# 🔥 WSGI / ASGI (το /rentals/api/ είναι async — τρέξε με uvicorn/daphne config.asgi:application)
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
 
 # 🗃️ Βάση Δεδομένων (SQLite)
 DATABASES = {
@@ -114,6 +115,53 @@ EMAIL_HOST_PASSWORD = 'footplpwnwgyigtn'  # app password
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 EMAIL_FAIL_SILENTLY = True
 
+# 🤖 AI μοντέλα: versioned artifacts ανά εταιρεία (company_{id}/v{n}/ + manifest.json)
+# και πόσες εκδόσεις κρατιούνται για rollback (0 = όλες)
+RECOMMENDATION_MODEL_DIR = os.environ.get("RECOMMENDATION_MODEL_DIR", "models")
+RECOMMENDATION_MODEL_KEEP_VERSIONS = int(os.environ.get("RECOMMENDATION_MODEL_KEEP_VERSIONS", "5"))
+# Πόσα μοντέλα κρατάει στη μνήμη κάθε worker (LRU, 0 = χωρίς όριο)
+RECOMMENDATION_MODEL_CACHE_SIZE = int(os.environ.get("RECOMMENDATION_MODEL_CACHE_SIZE", "32"))
+RECOMMENDATION_MODEL_CACHE_BYTES = int(os.environ.get("RECOMMENDATION_MODEL_CACHE_BYTES", "0"))
+# Προϋπολογισμένος πίνακας κατάταξης: μέγιστα buckets ανά feature (days/total_price).
+# Μοντέλο με περισσότερα thresholds δίνει approximate πίνακα, που δεν χρησιμοποιείται
+# (η κατάταξη γίνεται με το FlatForest).
+RECOMMENDATION_TABLE_MAX_EDGES = int(os.environ.get("RECOMMENDATION_TABLE_MAX_EDGES", "32"))
+# Φόρτωση artifacts με mmap ώστε τα numpy arrays να μοιράζονται μεταξύ workers
+RECOMMENDATION_MMAP_ARTIFACTS = os.environ.get("RECOMMENDATION_MMAP_ARTIFACTS", "1") != "0"
+# Threads για ORM + scoring του async JSON endpoint (/rentals/api/recommendations/)
+RECOMMENDATION_API_WORKERS = int(os.environ.get("RECOMMENDATION_API_WORKERS", "8"))
+# Cache κατατάξεων ανά worker (LRU entries)· ακυρώνεται από αλλαγές στόλου και retrain
+RECOMMENDATION_RANKING_CACHE_SIZE = int(os.environ.get("RECOMMENDATION_RANKING_CACHE_SIZE", "1024"))
+# Incremental training (safe_retrain_all / train_model --incremental): νέα δέντρα ανά
+# update, μέγιστο μέγεθος δάσους, πλήρες training κάθε Ν ημέρες ή όταν το drift
+# (λάθος top-1 στις νέες αποφάσεις) ξεπερνά το όριο.
+RECOMMENDATION_INCREMENTAL_TREES = int(os.environ.get("RECOMMENDATION_INCREMENTAL_TREES", "5"))
+RECOMMENDATION_MAX_ESTIMATORS = int(os.environ.get("RECOMMENDATION_MAX_ESTIMATORS", "30"))
+RECOMMENDATION_FULL_RETRAIN_DAYS = int(os.environ.get("RECOMMENDATION_FULL_RETRAIN_DAYS", "7"))
+RECOMMENDATION_DRIFT_THRESHOLD = float(os.environ.get("RECOMMENDATION_DRIFT_THRESHOLD", "0.75"))
+# Γραμμές ανά chunk στο streaming του training dataset (values_list().iterator)
+RECOMMENDATION_DATASET_CHUNK_SIZE = int(os.environ.get("RECOMMENDATION_DATASET_CHUNK_SIZE", "5000"))
+# Feature store του training ανά εταιρεία (append-only log + συμπαγές snapshot,
+# σχετικά με το cwd όπως και το RECOMMENDATION_MODEL_DIR).
+# Compaction στο background όταν το log ξεπεράσει τα COMPACT_BYTES.
+RECOMMENDATION_FEATURE_STORE = os.environ.get("RECOMMENDATION_FEATURE_STORE", "1") != "0"
+RECOMMENDATION_FEATURE_STORE_DIR = os.environ.get("RECOMMENDATION_FEATURE_STORE_DIR", "feature_store")
+RECOMMENDATION_FEATURE_STORE_COMPACT_BYTES = int(
+    os.environ.get("RECOMMENDATION_FEATURE_STORE_COMPACT_BYTES", str(1024 * 1024))
+)
+# Παράλληλα processes του safe_retrain_all (0 = όσοι οι πυρήνες)
+RECOMMENDATION_RETRAIN_WORKERS = int(os.environ.get("RECOMMENDATION_RETRAIN_WORKERS", "0"))
+# Αυτόματο retrain από τις αποφάσεις του choose_car: μετά από THRESHOLD νέες αποφάσεις
+# ή όταν η παλαιότερη είναι πάνω από MAX_AGE δευτ., με DEBOUNCE δευτ. αναμονή για όσες
+# ακολουθούν, το πολύ CONCURRENCY ταυτόχρονα (όλα τα processes)· ένα claim παλαιότερο
+# από TIMEOUT δευτ. θεωρείται χαμένο.
+RECOMMENDATION_AUTO_RETRAIN = os.environ.get("RECOMMENDATION_AUTO_RETRAIN", "1") != "0"
+RECOMMENDATION_RETRAIN_THRESHOLD = int(os.environ.get("RECOMMENDATION_RETRAIN_THRESHOLD", "50"))
+RECOMMENDATION_RETRAIN_MAX_AGE = int(os.environ.get("RECOMMENDATION_RETRAIN_MAX_AGE", "3600"))
+RECOMMENDATION_RETRAIN_DEBOUNCE = float(os.environ.get("RECOMMENDATION_RETRAIN_DEBOUNCE", "30"))
+RECOMMENDATION_RETRAIN_CONCURRENCY = int(os.environ.get("RECOMMENDATION_RETRAIN_CONCURRENCY", "1"))
+RECOMMENDATION_RETRAIN_TIMEOUT = int(os.environ.get("RECOMMENDATION_RETRAIN_TIMEOUT", "3600"))
+
 # 🗝️ Default primary key
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -0,0 +1,239 @@
+"""
+Versioned αποθήκη των αρχείων (artifacts) που παράγει το training ανά εταιρεία.
+
+Δομή κάτω από το RECOMMENDATION_MODEL_DIR:
+  company_{id}/manifest.json          {"current": n, "versions": [...]}
+  company_{id}/v{n}/model.joblib      (model, category_encoder)
+  company_{id}/v{n}/table.joblib      RankingTable
+  company_{id}/v{n}/forest.joblib     FlatForest (αν πέρασε τον έλεγχο)
+
+Μια νέα έκδοση γράφεται ολόκληρη σε προσωρινό φάκελο, γίνεται rename σε
+v{n} και μετά το manifest αντικαθίσταται ατομικά (os.replace). Τα workers
+βλέπουν πάντα είτε την παλιά είτε τη νέα πλήρη έκδοση, χωρίς restart ή
+locks στο διάβασμα. Κρατιούνται οι τελευταίες RECOMMENDATION_MODEL_KEEP_VERSIONS
+εκδόσεις για άμεσο rollback.
+
+Όσο δεν υπάρχει manifest διαβάζονται τα παλιά model_company_{id}*.joblib
+του cwd, ώστε τα ήδη εκπαιδευμένα μοντέλα να δουλεύουν μέχρι το επόμενο training.
+
+Κρατιέται χωρίς imports από sklearn/pandas ώστε να το χρησιμοποιούν
+και τα web workers (rank_cars) χωρίς επιπλέον κόστος.
+"""
+import copy
+import fcntl
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import timezone
+
+DEFAULT_KEEP_VERSIONS = 5
+
+FILENAMES = {
+    "model": "model.joblib",
+    "table": "table.joblib",
+    "forest": "forest.joblib",
+}
+LEGACY_FILENAMES = {
+    "model": "model_company_{}.joblib",
+    "table": "model_company_{}.table.joblib",
+    "forest": "model_company_{}.forest.joblib",
+}
+COMPANY_DIR_RE = re.compile(r"^company_(\d+)$")
+VERSION_DIR_RE = re.compile(r"^v(\d+)$")
+
+# company_id -> ((inode, mtime_ns, size) του manifest, περιεχόμενο)
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def model_dir() -> str:
+    return getattr(settings, "RECOMMENDATION_MODEL_DIR", "models")
+
+
+def company_dir(company_id) -> str:
+    return os.path.join(model_dir(), f"company_{company_id}")
+
+
+def manifest_path(company_id) -> str:
+    return os.path.join(company_dir(company_id), "manifest.json")
+
+
+def version_dir(company_id, version) -> str:
+    return os.path.join(company_dir(company_id), f"v{version}")
+
+
+def company_ids():
+    """Εταιρείες με αποθηκευμένα μοντέλα."""
+    try:
+        names = os.listdir(model_dir())
+    except OSError:
+        return []
+    return sorted(int(m.group(1)) for name in names if (m := COMPANY_DIR_RE.match(name)))
+
+
+def read_manifest(company_id):
+    """Το manifest (cached όσο δεν αλλάζει το αρχείο) ή None."""
+    path = manifest_path(company_id)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    stamp = (st.st_ino, st.st_mtime_ns, st.st_size)  # νέο inode σε κάθε os.replace
+    with _manifests_lock:
+        cached = _manifests.get(company_id)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+    with open(path) as f:
+        manifest = json.load(f)
+    with _manifests_lock:
+        _manifests[company_id] = (stamp, manifest)
+    return manifest
+
+
+def current_version(company_id):
+    manifest = read_manifest(company_id)
+    return manifest["current"] if manifest else None
+
+
+def artifact_path(company_id, kind, version=None) -> str:
+    """
+    Διαδρομή ενός artifact (kind: model/table/forest) της τρέχουσας έκδοσης
+    (ή της version). Το αρχείο μπορεί να μην υπάρχει (π.χ. forest).
+    """
+    if version is None:
+        version = current_version(company_id)
+    if version is None:
+        return LEGACY_FILENAMES[kind].format(company_id)
+    return os.path.join(version_dir(company_id, version), FILENAMES[kind])
+
+
+def model_path(company_id) -> str:
+    """Αρχείο με το ζεύγος (model, category_encoder) της εταιρείας."""
+    return artifact_path(company_id, "model")
+
+
+def table_path(company_id) -> str:
+    """Προϋπολογισμένος πίνακας κατάταξης (RankingTable) της εταιρείας."""
+    return artifact_path(company_id, "table")
+
+
+def forest_path(company_id) -> str:
+    """Το RandomForest σε επίπεδους πίνακες (FlatForest) για inference χωρίς sklearn."""
+    return artifact_path(company_id, "forest")
+
+
+@contextmanager
+def _locked(company_id):
+    """Σειριοποιεί τους writers μίας εταιρείας (όχι τους readers)."""
+    os.makedirs(company_dir(company_id), exist_ok=True)
+    with open(os.path.join(company_dir(company_id), ".lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write_manifest(company_id, manifest):
+    path = manifest_path(company_id)
+    fd, tmp = tempfile.mkstemp(dir=company_dir(company_id), prefix=".manifest-")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class PendingVersion:
+    """Ο προσωρινός φάκελος (path) μιας νέας έκδοσης· version = ο αριθμός της μετά το publish."""
+
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+
+
+@contextmanager
+def new_version(company_id, keep=None):
+    """
+    Context manager για μια νέα έκδοση: δίνει ένα PendingVersion, στον φάκελο
+    του οποίου γράφονται τα αρχεία (FILENAMES), και στο τέλος τον δημοσιεύει
+    ατομικά. Σε exception ο φάκελος σβήνεται και η τρέχουσα έκδοση μένει ως έχει.
+    """
+    os.makedirs(company_dir(company_id), exist_ok=True)
+    pending = PendingVersion(tempfile.mkdtemp(dir=company_dir(company_id), prefix=".tmp-"))
+    try:
+        yield pending
+        pending.version = publish(company_id, pending.path, keep=keep)
+    finally:
+        shutil.rmtree(pending.path, ignore_errors=True)
+
+
+def _version_dirs(company_id):
+    """Οι αριθμοί των φακέλων v{n} που υπάρχουν στον δίσκο."""
+    return [int(m.group(1)) for name in os.listdir(company_dir(company_id)) if (m := VERSION_DIR_RE.match(name))]
+
+
+def publish(company_id, directory, keep=None) -> int:
+    """Κάνει τον φάκελο directory νέα τρέχουσα έκδοση. Επιστρέφει τον αριθμό της."""
+    with _locked(company_id):
+        # Αντίγραφο: το cached manifest το βλέπουν και άλλα threads.
+        manifest = copy.deepcopy(read_manifest(company_id)) or {"current": None, "versions": []}
+        listed = {v["version"] for v in manifest["versions"]}
+        on_disk = _version_dirs(company_id)
+        # Φάκελοι εκτός manifest έμειναν από publish που έπεσε πριν γράψει το manifest.
+        for orphan in set(on_disk) - listed:
+            shutil.rmtree(version_dir(company_id, orphan), ignore_errors=True)
+        version = max([*listed, *on_disk], default=0) + 1
+        os.rename(directory, version_dir(company_id, version))
+        manifest["versions"].append({"version": version, "created": timezone.now().isoformat()})
+        manifest["current"] = version
+        old = _expired(manifest, keep)
+        manifest["versions"] = [v for v in manifest["versions"] if v not in old]
+        _write_manifest(company_id, manifest)
+        # Τα workers που έχουν ήδη mmapped παλιά αρχεία τα κρατούν μέχρι να τα αφήσουν.
+        for v in old:
+            shutil.rmtree(version_dir(company_id, v["version"]), ignore_errors=True)
+    return version
+
+
+def _expired(manifest, keep):
+    """Οι εκδόσεις πέρα από τις τελευταίες keep — ποτέ η τρέχουσα (π.χ. μετά από rollback)."""
+    if keep is None:
+        keep = getattr(settings, "RECOMMENDATION_MODEL_KEEP_VERSIONS", DEFAULT_KEEP_VERSIONS)
+    if not keep:
+        return []
+    return [v for v in manifest["versions"][:-keep] if v["version"] != manifest["current"]]
+
+
+def versions(company_id):
+    """[{"version", "created"}] από την παλαιότερη στη νεότερη."""
+    manifest = read_manifest(company_id)
+    return list(manifest["versions"]) if manifest else []
+
+
+def rollback(company_id, version=None) -> int:
+    """
+    Κάνει τρέχουσα μια προηγούμενη έκδοση (default: την αμέσως παλαιότερη
+    από την τρέχουσα). Επιστρέφει τον αριθμό της. ValueError αν δεν υπάρχει.
+    """
+    with _locked(company_id):
+        manifest = copy.deepcopy(read_manifest(company_id))
+        if not manifest:
+            raise ValueError(f"Δεν υπάρχουν εκδόσεις μοντέλου για την εταιρεία {company_id}.")
+        available = [v["version"] for v in manifest["versions"]]
+        if version is None:
+            older = [v for v in available if v < manifest["current"]]
+            if not older:
+                raise ValueError("Δεν υπάρχει παλαιότερη έκδοση για rollback.")
+            version = older[-1]
+        if version not in available:
+            raise ValueError(f"Η έκδοση v{version} δεν υπάρχει (διαθέσιμες: {available}).")
+        manifest["current"] = version
+        _write_manifest(company_id, manifest)
+    return version
@@ -0,0 +1,130 @@
+"""
+Streaming, columnar κατασκευή του training dataset.
+
+Αντί για ORM objects (select_related) και λίστα από dicts, οι γραμμές
+έρχονται ως tuples από values_list().iterator(chunk_size) και γράφονται
+ανά chunk κατευθείαν σε προδεσμευμένους NumPy πίνακες, μία στήλη ανά feature.
+Η κατηγορία κρατιέται ως κωδικός (int16) + λίστα κατηγοριών, ώστε η μνήμη
+ανά γραμμή να είναι σταθερή και μικρή.
+"""
+import time
+import tracemalloc
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from .models import RentalDecision
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Στήλη → dtype. Το requested_category είναι κωδικός στο DecisionColumns.categories.
+DTYPES = {
+    "decision_id": np.int64,
+    "days": np.int32,
+    "total_price": np.float64,
+    "extra_insurance": np.int8,
+    "requested_category": np.int16,
+    "car_id": np.int64,
+}
+
+
+class DecisionColumns:
+    """Οι στήλες του dataset + στατιστικά κατασκευής (seconds, peak_bytes)."""
+
+    def __init__(self, arrays, categories, seconds=0.0, peak_bytes=None):
+        self.arrays = arrays
+        self.categories = categories
+        self.seconds = seconds
+        self.peak_bytes = peak_bytes
+
+    def __len__(self):
+        return len(self.arrays["car_id"])
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame με το ίδιο σχήμα που περιμένει το train_model (χωρίς αντίγραφα στηλών)."""
+        data = dict(self.arrays)
+        # Object array με αναφορές στα ίδια λίγα strings, όχι ένα string ανά γραμμή.
+        data["requested_category"] = np.asarray(self.categories, dtype=object)[
+            self.arrays["requested_category"]
+        ]
+        return pd.DataFrame(data, copy=False)
+
+
+def decision_rows(company, since=None, decided_at=False):
+    """
+    values_list των αποφάσεων με chosen_car, στη σειρά των στηλών του DTYPES
+    (και, με decided_at=True, το decided_at στο τέλος). Το since συγκρίνεται με
+    τη στιγμή της επιλογής: μια απόφαση σε παλιό αίτημα μετράει ως νέα.
+    """
+    decisions = RentalDecision.objects.filter(request__company=company, chosen_car__isnull=False)
+    if since is not None:
+        decisions = decisions.filter(decided_at__gt=since)
+    # Cast σε float στη βάση: χωρίς ένα Decimal object ανά γραμμή.
+    fields = [
+        "id",
+        "request__days",
+        Cast("request__total_price", FloatField()),
+        "request__extra_insurance",
+        "request__requested_category",
+        "chosen_car_id",
+    ]
+    if decided_at:
+        fields.append("decided_at")
+    return decisions.order_by("id").values_list(*fields)
+
+
+def _grow(arrays, size):
+    return {name: np.resize(array, size) for name, array in arrays.items()}
+
+
+def stream_decision_columns(company, since=None, chunk_size=None, trace_memory=False,
+                            decided_at=False) -> DecisionColumns:
+    """
+    Χτίζει τις στήλες με ένα count() για την προδέσμευση και ένα streaming
+    query. Με trace_memory μετράει και την αιχμή μνήμης (tracemalloc, πιο αργό).
+    Με decided_at προστίθεται η στήλη "decided_at" (epoch της επιλογής, για το feature store).
+    """
+    if chunk_size is None:
+        chunk_size = getattr(settings, "RECOMMENDATION_DATASET_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+
+    rows = decision_rows(company, since, decided_at)
+    capacity = rows.count()
+    dtypes = dict(DTYPES, decided_at=np.float64) if decided_at else DTYPES
+    arrays = {name: np.empty(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+    ids, days, price, insurance, category, car, *decided = arrays.values()
+    codes = {}
+
+    n = 0
+    stream = rows.iterator(chunk_size=chunk_size)
+    while chunk := list(islice(stream, chunk_size)):
+        end = n + len(chunk)
+        if end > capacity:  # γράφτηκαν αποφάσεις ανάμεσα στο count και στο query
+            capacity = max(2 * capacity, end)
+            arrays = _grow(arrays, capacity)
+            ids, days, price, insurance, category, car, *decided = arrays.values()
+        decision_id, d, p, ins, cat, car_id, *when = zip(*chunk)
+        ids[n:end] = decision_id
+        days[n:end] = d
+        price[n:end] = p
+        insurance[n:end] = ins
+        category[n:end] = [codes.setdefault(c, len(codes)) for c in cat]
+        car[n:end] = car_id
+        if decided:
+            # Χωρίς decided_at (π.χ. queryset.update): 0, όπως και στο since της βάσης.
+            decided[0][n:end] = [c.timestamp() if c is not None else 0.0 for c in when[0]]
+        n = end
+    if n != capacity:
+        arrays = {name: array[:n] for name, array in arrays.items()}
+
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return DecisionColumns(arrays, list(codes), time.perf_counter() - started, peak)
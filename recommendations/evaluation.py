@@ -0,0 +1,113 @@
+"""
+Αξιολόγηση ενός μοντέλου σε ιστορικές αποφάσεις, vectorised: ένας πίνακας
+features, μία κλήση predict_proba και top-k με NumPy.
+"""
+import numpy as np
+
+from .ml_training import FEATURES
+
+DEFAULT_TOP_K = (1, 3, 5)
+
+
+def feature_matrix(df, category_encoder):
+    """(X, known): X μόνο για τις γραμμές με κατηγορία που ξέρει ο encoder."""
+    known = df["requested_category"].isin(category_encoder.classes_).to_numpy()
+    X = df.loc[known, ["days", "total_price", "extra_insurance"]].copy()
+    X["requested_category_enc"] = category_encoder.transform(df.loc[known, "requested_category"])
+    return X[FEATURES], known
+
+
+def true_class_rank(probas, classes, y_true):
+    """
+    Θέση (0 = πρώτη) του πραγματικού οχήματος στην κατάταξη κάθε γραμμής:
+    πόσα οχήματα προηγούνται (μεγαλύτερη πιθανότητα ή ισοπαλία με μικρότερο
+    index, όπως το argmax). Οχήματα που δεν ξέρει το μοντέλο παίρνουν
+    len(classes) (εκτός κάθε top-k).
+    """
+    y_true = np.asarray(y_true)
+    index = np.searchsorted(classes, y_true).clip(max=len(classes) - 1)
+    known = classes[index] == y_true
+    p_true = probas[np.arange(len(probas)), index]
+    p_true = p_true[:, None]
+    ahead = (probas > p_true) | ((probas == p_true) & (np.arange(len(classes)) < index[:, None]))
+    rank = ahead.sum(axis=1)
+    return np.where(known, rank, len(classes))
+
+
+def evaluate(model, category_encoder, df, ks=DEFAULT_TOP_K) -> dict:
+    """
+    Επιστρέφει dict με:
+      rows: DataFrame των αξιολογημένων γραμμών (+ predicted_car_id, rank)
+      skipped: γραμμές με άγνωστη κατηγορία (δεν μετράνε, όπως πριν)
+      top_k: {k: ποσοστό επιτυχίας}
+    """
+    X, known = feature_matrix(df, category_encoder)
+    rows = df.loc[known].copy()
+    if not len(rows):
+        return {"rows": rows, "skipped": int((~known).sum()), "top_k": {}}
+
+    probas = model.predict_proba(X)
+    classes = model.classes_
+    rows["predicted_car_id"] = classes[probas.argmax(axis=1)]
+    rows["rank"] = true_class_rank(probas, classes, rows["car_id"].to_numpy())
+    return {
+        "rows": rows,
+        "skipped": int((~known).sum()),
+        "top_k": {k: float((rows["rank"] < k).mean()) for k in ks},
+    }
+
+
+def parse_top_k(value):
+    """Από "1,3,5" σε (1, 3, 5)."""
+    return tuple(sorted({int(k) for k in str(value).split(",") if k.strip()}))
+
+
+
+def fleet_rank(scorer, categories, chosen_ids, probas=None, class_ids=None, has_probas=None, chunk_size=4096):
+    """
+    Θέση (0 = πρώτη) του επιλεγμένου οχήματος στην κατάταξη που θα έβλεπε ο
+    χρήστης (FleetScorer.rank) για κάθε αίτημα, χωρίς να ταξινομηθεί ο στόλος
+    ανά αίτημα. probas: (αιτήματα × class_ids)· γραμμές με has_probas=False
+    (ή χωρίς probas) κατατάσσονται όπως το default_ranking. Οχήματα εκτός
+    στόλου παίρνουν len(scorer).
+    """
+    n, size = len(chosen_ids), len(scorer)
+    ranks = np.full(n, size, dtype=np.int64)
+    if not n or not size:
+        return ranks
+
+    order = np.argsort(scorer.ids, kind="stable")
+    pos = np.searchsorted(scorer.ids[order], chosen_ids).clip(max=size - 1)
+    chosen_col = np.where(scorer.ids[order[pos]] == chosen_ids, order[pos], -1)
+    codes = np.array([scorer.category_code(c) for c in categories], dtype=np.int32)
+
+    if probas is not None:
+        # Στήλη κάθε οχήματος του στόλου στο probas (όπως το FleetScorer.scores).
+        class_ids = np.asarray(class_ids, dtype=np.int64)
+        class_order = np.argsort(class_ids, kind="stable")
+        class_pos = np.searchsorted(class_ids[class_order], scorer.ids).clip(max=len(class_ids) - 1)
+        fleet_known = class_ids[class_order[class_pos]] == scorer.ids
+        fleet_cols = class_order[class_pos[fleet_known]]
+        if has_probas is None:
+            has_probas = np.ones(n, dtype=bool)
+
+    columns = np.arange(size)
+    for start in range(0, n, chunk_size):
+        block = slice(start, start + chunk_size)
+        rows = np.arange(len(codes[block]))
+        target = scorer.category_codes[None, :] == codes[block, None]
+        key = np.broadcast_to(scorer.alpha_rank, target.shape)
+        if probas is not None:
+            scores = np.zeros(target.shape)
+            scores[:, fleet_known] = probas[block][:, fleet_cols]
+            key = np.where(target & has_probas[block, None], -scores, key)
+
+        col = chosen_col[block].clip(min=0)
+        chosen_target = target[rows, col]
+        chosen_key = key[rows, col]
+        # lexsort((key, ~target)): πρώτα η κατηγορία, μετά το key, ισοπαλίες με τη σειρά εισόδου.
+        same_group = target == chosen_target[:, None]
+        before = (key < chosen_key[:, None]) | ((key == chosen_key[:, None]) & (columns < col[:, None]))
+        ahead = (same_group & before).sum(axis=1) + np.where(chosen_target, 0, target.sum(axis=1))
+        ranks[block] = np.where(chosen_col[block] >= 0, ahead, size)
+    return ranks
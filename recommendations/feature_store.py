@@ -0,0 +1,250 @@
+"""
+Append-only feature store του training ανά εταιρεία, σε τοπικό δίσκο.
+
+Ανά εταιρεία, στον φάκελο RECOMMENDATION_FEATURE_STORE_DIR:
+  company_{id}.npy   συμπαγές snapshot (structured array, ταξινομημένο κατά decision_id)
+  company_{id}.log   append-only εγγραφές με το ίδιο dtype, μετά το snapshot
+  company_{id}.lock  flock για append / compaction / rebuild
+
+Κάθε απόφαση με chosen_car γράφεται στο log (βλ. signals.py)· μια αλλαγή
+της ίδιας απόφασης γράφει νέα εγγραφή και στο διάβασμα κερδίζει η
+τελευταία. car_id == REMOVED σημαίνει ότι η απόφαση δεν μετράει πια.
+Όταν το log μεγαλώσει, ένα background thread το συγχωνεύει στο snapshot.
+
+Το store θεωρείται έγκυρο μόνο αν υπάρχει το snapshot (με το τρέχον dtype)· αλλιώς το training
+το ξαναχτίζει μία φορά από τη βάση (rebuild). Μια αλλαγή σε RentalRequest
+(days/τιμή/κατηγορία) κάνει invalidate() μέσω signal. Ό,τι δεν περνάει από
+signals (bulk_create, queryset.update, SET_NULL από διαγραφή οχήματος)
+καλύπτεται με invalidate() ή με την εντολή rebuild_feature_store.
+"""
+import fcntl
+import os
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+from .dataset import DEFAULT_CHUNK_SIZE, DTYPES, DecisionColumns, stream_decision_columns
+
+REMOVED = -1
+DEFAULT_COMPACT_BYTES = 1024 * 1024
+
+RECORD_DTYPE = np.dtype([
+    ("decision_id", "<i8"),
+    ("decided_at", "<f8"),  # RentalDecision.decided_at (epoch) — για το since του incremental
+    ("days", "<i4"),
+    ("total_price", "<f8"),
+    ("extra_insurance", "i1"),
+    ("requested_category", "<U20"),  # RentalRequest.requested_category: max_length=20
+    ("car_id", "<i8"),
+])
+
+_compacting = set()
+_compacting_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return getattr(settings, "RECOMMENDATION_FEATURE_STORE", True)
+
+
+def _path(company_id, suffix) -> str:
+    directory = getattr(settings, "RECOMMENDATION_FEATURE_STORE_DIR", "feature_store")
+    return os.path.join(directory, f"company_{company_id}.{suffix}")
+
+
+def snapshot_path(company_id) -> str:
+    return _path(company_id, "npy")
+
+
+def log_path(company_id) -> str:
+    return _path(company_id, "log")
+
+
+@contextmanager
+def _locked(company_id, shared=False):
+    path = _path(company_id, "lock")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def exists(company_id) -> bool:
+    """Υπάρχει snapshot με το τρέχον RECORD_DTYPE (ένα παλιότερο σχήμα ξαναχτίζεται)."""
+    path = snapshot_path(company_id)
+    # Με mmap διαβάζεται μόνο το header.
+    return os.path.exists(path) and np.load(path, mmap_mode="r").dtype == RECORD_DTYPE
+
+
+def record(decision_id, decided_at, days, total_price, extra_insurance, requested_category, car_id):
+    """Μία εγγραφή (1 στοιχείο structured array)."""
+    if car_id is None:
+        return tombstone(decision_id)
+    return np.array(
+        [(decision_id, decided_at.timestamp(), days, float(total_price), int(extra_insurance),
+          requested_category, car_id)],
+        dtype=RECORD_DTYPE,
+    )
+
+
+def tombstone(decision_id):
+    """Εγγραφή που αφαιρεί μια απόφαση (διαγραφή ή chosen_car = None)."""
+    removed = np.zeros(1, dtype=RECORD_DTYPE)
+    removed["decision_id"] = decision_id
+    removed["car_id"] = REMOVED
+    return removed
+
+
+def append(company_id, records):
+    """
+    Προσθέτει εγγραφές στο log· ξεκινά compaction στο background αν χρειάζεται.
+    Χωρίς snapshot δεν γράφει τίποτα: το rebuild θα τις διαβάσει από τη βάση.
+    """
+    with _locked(company_id):
+        if not exists(company_id):
+            return
+        with open(log_path(company_id), "ab") as f:
+            np.asarray(records, dtype=RECORD_DTYPE).tofile(f)
+            size = f.tell()
+    if size >= getattr(settings, "RECOMMENDATION_FEATURE_STORE_COMPACT_BYTES", DEFAULT_COMPACT_BYTES):
+        compact_in_background(company_id)
+
+
+def _read_log(company_id):
+    path = log_path(company_id)
+    if not os.path.exists(path):
+        return np.empty(0, dtype=RECORD_DTYPE)
+    # Μισογραμμένη τελευταία εγγραφή (crash στη μέση ενός append) αγνοείται.
+    count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+    return np.fromfile(path, dtype=RECORD_DTYPE, count=count)
+
+
+def _merge(*parts):
+    """Μία εγγραφή ανά decision_id (η τελευταία), ταξινομημένες κατά decision_id."""
+    records = np.concatenate(parts)
+    if not len(records):
+        return records
+    reversed_ids = records["decision_id"][::-1]
+    _, first = np.unique(reversed_ids, return_index=True)
+    return records[len(records) - 1 - first]
+
+
+def read_records(company_id):
+    """Όλες οι ενεργές εγγραφές (snapshot + log) ή None αν το store δεν είναι έγκυρο."""
+    # Shared lock: το snapshot και το log να είναι από την ίδια στιγμή (όχι μέσα σε compaction).
+    with _locked(company_id, shared=True):
+        if not exists(company_id):
+            return None
+        records = _merge(np.load(snapshot_path(company_id), mmap_mode="r"), _read_log(company_id))
+    return records[records["car_id"] != REMOVED]
+
+
+def to_columns(records) -> DecisionColumns:
+    """Οι εγγραφές στο σχήμα του dataset.stream_decision_columns."""
+    categories, codes = np.unique(records["requested_category"], return_inverse=True)
+    arrays = {name: records[name].astype(dtype) for name, dtype in DTYPES.items() if name != "requested_category"}
+    arrays["requested_category"] = codes.astype(DTYPES["requested_category"])
+    arrays = {name: arrays[name] for name in DTYPES}
+    return DecisionColumns(arrays, categories.tolist())
+
+
+def load_columns(company, since=None, trace_memory=False) -> DecisionColumns:
+    """Οι στήλες του training από το store (rebuild από τη βάση την πρώτη φορά)."""
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+
+    records = read_records(company.id)
+    if records is None:
+        rebuild(company)
+        records = read_records(company.id)
+    if since is not None:
+        records = records[records["decided_at"] > since.timestamp()]
+    columns = to_columns(records)
+
+    columns.seconds = time.perf_counter() - started
+    if trace_memory:
+        columns.peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return columns
+
+
+def _write_snapshot(company_id, records):
+    path = snapshot_path(company_id)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, records)
+    os.replace(tmp, path)
+
+
+def compact(company_id) -> int:
+    """Συγχωνεύει το log στο snapshot. Επιστρέφει το πλήθος εγγραφών του snapshot."""
+    with _locked(company_id):
+        if not exists(company_id):
+            return 0
+        records = _merge(np.load(snapshot_path(company_id)), _read_log(company_id))
+        records = records[records["car_id"] != REMOVED]
+        _write_snapshot(company_id, records)
+        open(log_path(company_id), "wb").close()
+    return len(records)
+
+
+def compact_in_background(company_id):
+    with _compacting_lock:
+        if company_id in _compacting:
+            return
+        _compacting.add(company_id)
+
+    def run():
+        try:
+            compact(company_id)
+        except Exception:  # non critical, το log μένει
+            print(f"feature store compaction error (company {company_id}):", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+        finally:
+            with _compacting_lock:
+                _compacting.discard(company_id)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _decision_records(company, chunk_size):
+    """Οι αποφάσεις της βάσης ως εγγραφές, από το κοινό dataset.stream_decision_columns."""
+    columns = stream_decision_columns(company, chunk_size=chunk_size, decided_at=True)
+    records = np.empty(len(columns), dtype=RECORD_DTYPE)
+    for name in RECORD_DTYPE.names:
+        if name == "requested_category":
+            records[name] = np.asarray(columns.categories, dtype=RECORD_DTYPE[name])[columns.arrays[name]]
+        else:
+            records[name] = columns.arrays[name]
+    return records
+
+
+def rebuild(company, chunk_size=None) -> int:
+    """Ξαναχτίζει το snapshot από τη βάση. Επιστρέφει το πλήθος εγγραφών."""
+    if chunk_size is None:
+        chunk_size = getattr(settings, "RECOMMENDATION_DATASET_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+    # Όλο υπό το lock των append/compact: ό,τι μπήκε στο log πριν το scan υπάρχει
+    # ήδη στη βάση, και όσα appends έρθουν μετά περιμένουν και γράφονται στο νέο
+    # (άδειο) log. Μια απόφαση που είναι και στα δύο μετράει μία φορά (_merge).
+    with _locked(company.id):
+        records = _decision_records(company, chunk_size)
+        _write_snapshot(company.id, records)
+        open(log_path(company.id), "wb").close()
+    return len(records)
+
+
+def invalidate(company_id):
+    """Σβήνει το store· το επόμενο training το ξαναχτίζει από τη βάση."""
+    with _locked(company_id):
+        for path in (snapshot_path(company_id), log_path(company_id)):
+            if os.path.exists(path):
+                os.remove(path)
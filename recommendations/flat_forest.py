@@ -0,0 +1,87 @@
+"""
+Το RandomForest σε επίπεδους (contiguous) πίνακες + evaluator σε NumPy.
+
+Το export γίνεται στο training (ml_training.export_flat_forest). Όλα τα
+δέντρα μπαίνουν σε κοινούς πίνακες κόμβων:
+  feature[n], threshold[n], left[n], right[n]  (left == -1 → φύλλο)
+  value[φύλλα, κλάσεις]                        (κανονικοποιημένη κατανομή φύλλου)
+  roots[δέντρα]                                (ρίζα κάθε δέντρου)
+Στα φύλλα το right δείχνει τη γραμμή του φύλλου στο value, ώστε να μην
+κρατάμε κατανομές για τους εσωτερικούς κόμβους.
+Έτσι το rank_cars βγάζει πιθανότητες χωρίς sklearn, χωρίς input validation
+και χωρίς joblib dispatch, και οι πίνακες φορτώνονται με mmap.
+"""
+import numpy as np
+
+LEAF = -1
+
+
+class FlatForest:
+    def __init__(self, data: dict):
+        self.feature = np.asarray(data["feature"])
+        self.threshold = np.asarray(data["threshold"])
+        self.left = np.asarray(data["left"])
+        self.right = np.asarray(data["right"])
+        self.value = np.asarray(data["value"])
+        self.roots = np.asarray(data["roots"])
+        self.max_depth = int(data["max_depth"])
+        self.classes = np.asarray(data["classes"])
+        self.categories = [str(c) for c in data["categories"]]
+        self._category_index = {c: i for i, c in enumerate(self.categories)}
+        # Για το single-row path: το indexing σε memoryview δίνει Python scalars
+        # πολύ πιο γρήγορα από ένα ndarray, χωρίς αντίγραφο των (mmapped) πινάκων.
+        self._feature = memoryview(np.ascontiguousarray(self.feature))
+        self._threshold = memoryview(np.ascontiguousarray(self.threshold))
+        self._left = memoryview(np.ascontiguousarray(self.left))
+        self._right = memoryview(np.ascontiguousarray(self.right))
+        self._roots = self.roots.tolist()
+
+    def encode_category(self, category):
+        """Όπως το category_encoder.transform — None για άγνωστη κατηγορία."""
+        return self._category_index.get(category)
+
+    def _leaves_one(self, row):
+        feature, threshold, left, right = self._feature, self._threshold, self._left, self._right
+        leaves = []
+        for node in self._roots:
+            child = left[node]
+            while child != LEAF:
+                node = child if row[feature[node]] <= threshold[node] else right[node]
+                child = left[node]
+            leaves.append(right[node])
+        return leaves
+
+    def predict_proba_one(self, row) -> np.ndarray:
+        """Πιθανότητες για ένα αίτημα [days, total_price, extra_insurance, category_enc]."""
+        # Τα δέντρα του sklearn συγκρίνουν σε float32.
+        row = np.asarray(row, dtype=np.float32).tolist()
+        return self.value[self._leaves_one(row)].mean(axis=0)
+
+    def predict_proba(self, X) -> np.ndarray:
+        """Vectorised για πολλά αιτήματα: ένα βήμα ανά επίπεδο βάθους για όλα τα δέντρα."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            left = self.left[nodes]
+            internal = left != LEAF
+            if not internal.any():
+                break
+            go_left = X[rows, self.feature[nodes].clip(min=0)] <= self.threshold[nodes]
+            nodes = np.where(internal, np.where(go_left, left, self.right[nodes]), nodes)
+        return self.value[self.right[nodes]].mean(axis=1)
+
+    def to_dict(self) -> dict:
+        return {
+            "feature": self.feature,
+            "threshold": self.threshold,
+            "left": self.left,
+            "right": self.right,
+            "value": self.value,
+            "roots": self.roots,
+            "max_depth": self.max_depth,
+            "classes": self.classes,
+            "categories": np.asarray(self.categories),
+        }
@@ -0,0 +1,193 @@
+import contextlib
+import io
+import os
+import tempfile
+import time
+from ast import literal_eval
+
+import joblib
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from recommendations.evaluation import DEFAULT_TOP_K, feature_matrix, fleet_rank, parse_top_k
+from recommendations.fleet_scorer import FleetScorer, VALUES_FIELDS
+from recommendations.ml_training import (
+    build_ranking_table,
+    company_dataset,
+    export_flat_forest,
+    get_company,
+    train_model,
+)
+from rentals.models import Car
+
+# όνομα -> παράμετροι RandomForest (πάνω από τα MODEL_PARAMS)· None = default_ranking χωρίς μοντέλο
+DEFAULT_CANDIDATES = {
+    "alphabetical": None,
+    "rf10": {},
+    "rf30": {"n_estimators": 30},
+    "rf10_depth8": {"max_depth": 8},
+    "rf5_leaf5": {"n_estimators": 5, "min_samples_leaf": 5},
+}
+LATENCY_SAMPLES = 200
+
+
+def parse_candidate(value):
+    """Από "rf50:n_estimators=50,max_depth=12" σε ("rf50", {"n_estimators": 50, "max_depth": 12})."""
+    name, _, spec = value.partition(":")
+    params = {}
+    for item in filter(None, spec.split(",")):
+        key, _, raw = item.partition("=")
+        try:
+            params[key.strip()] = literal_eval(raw.strip())
+        except (ValueError, SyntaxError):
+            params[key.strip()] = raw.strip()
+    return name.strip(), params
+
+
+def _artifact_bytes(model, category_encoder):
+    """Μέγεθος στο δίσκο όσων γράφει το save_model (model, πίνακας, flat forest)."""
+    table = build_ranking_table(model, category_encoder)
+    forest = export_flat_forest(model, category_encoder)
+    total = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, obj in (("model", (model, category_encoder)), ("table", table.to_dict()),
+                          ("forest", forest.to_dict())):
+            path = os.path.join(tmp, f"{name}.joblib")
+            joblib.dump(obj, path, compress=0)
+            total += os.path.getsize(path)
+    return total, forest
+
+
+class Command(BaseCommand):
+    help = (
+        "Backtesting: ξαναπαίζει τις αποφάσεις μιας εταιρείας με χρονική σειρά, εκπαιδεύει σε "
+        "κυλιόμενο πρόθεμα και συγκρίνει υποψήφια μοντέλα σε top-k, χρόνο training, latency "
+        "ενός αιτήματος (flat forest + κατάταξη στόλου) και μέγεθος artifacts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", type=str, help="Το username της εταιρείας.")
+        parser.add_argument("--folds", type=int, default=5, help="Πόσα διαδοχικά κομμάτια αξιολόγησης.")
+        parser.add_argument("--min-train", type=float, default=0.5,
+                            help="Ποσοστό του ιστορικού πριν το πρώτο κομμάτι αξιολόγησης.")
+        parser.add_argument("--window", type=int, default=None,
+                            help="Εκπαίδευση μόνο στις τελευταίες N αποφάσεις πριν από κάθε κομμάτι "
+                                 "(sliding)· χωρίς αυτό όλο το πρόθεμα (expanding).")
+        parser.add_argument("--candidate", action="append", type=parse_candidate, dest="candidates",
+                            help='Υποψήφιο "όνομα:param=τιμή,..." (επαναλαμβανόμενο)· '
+                                 "χωρίς αυτό τα προεπιλεγμένα.")
+        parser.add_argument("--top-k", type=parse_top_k, default=DEFAULT_TOP_K, help="π.χ. 1,3,5")
+        parser.add_argument("--tolerance", type=float, default=0.01,
+                            help="Πόσο χαμηλότερο top-1 από το καλύτερο θεωρείται «αρκετά καλό».")
+
+    def handle(self, *args, **options):
+        try:
+            company = get_company(options["username"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = company_dataset(company)
+        # Τα decision ids είναι αυξανόμενα: η σειρά τους είναι η χρονική σειρά των αποφάσεων.
+        df = df.sort_values("decision_id", kind="stable").reset_index(drop=True)
+        scorer = FleetScorer.from_values(Car.objects.filter(company=company).values(*VALUES_FIELDS))
+
+        folds = self._folds(len(df), options["folds"], options["min_train"], options["window"])
+        if not folds or not len(scorer):
+            raise CommandError("Δεν υπάρχουν αρκετές αποφάσεις ή οχήματα για backtesting.")
+
+        candidates = dict(options["candidates"] or DEFAULT_CANDIDATES)
+        ks = options["top_k"]
+        self.stdout.write(
+            f"📊 {company.name}: {len(df)} αποφάσεις, {len(scorer)} οχήματα, {len(folds)} κομμάτια "
+            f"({'sliding ' + str(options['window']) if options['window'] else 'expanding'})"
+        )
+
+        report = {name: self._backtest(df, scorer, folds, params, ks) for name, params in candidates.items()}
+        self._print(report, ks, options["tolerance"])
+
+    @staticmethod
+    def _folds(n, count, min_train, window):
+        """[(train slice, test slice)] με τα test κομμάτια διαδοχικά μετά το min_train."""
+        start = max(int(n * min_train), 1)
+        edges = np.linspace(start, n, count + 1).astype(int)
+        folds = []
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            if hi > lo:
+                folds.append((slice(max(lo - window, 0) if window else 0, lo), slice(lo, hi)))
+        return folds
+
+    def _backtest(self, df, scorer, folds, params, ks):
+        ranks, fit_seconds, latencies, sizes = [], [], [], []
+        for train, test in folds:
+            test_df = df.iloc[test]
+            chosen = test_df["car_id"].to_numpy()
+            categories = test_df["requested_category"].tolist()
+
+            if params is None:
+                ranks.append(fleet_rank(scorer, categories, chosen))
+                latencies.extend(self._latency(lambda i: scorer.rank(categories[i]), len(test_df)))
+                continue
+
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                model, category_encoder = train_model(df.iloc[train].copy(), params)
+            fit_seconds.append(time.perf_counter() - started)
+
+            # Άγνωστη κατηγορία → default_ranking, όπως στο rank_cars.
+            X, known = feature_matrix(test_df, category_encoder)
+            probas = np.zeros((len(test_df), len(model.classes_)))
+            if known.any():
+                probas[known] = model.predict_proba(X)
+            ranks.append(fleet_rank(scorer, categories, chosen, probas, model.classes_, known))
+
+            size, forest = _artifact_bytes(model, category_encoder)
+            sizes.append(size)
+            rows = np.zeros((len(test_df), 4))
+            rows[known] = X.to_numpy()
+
+            def serve(i):
+                if known[i]:
+                    return scorer.rank(categories[i], forest.predict_proba_one(rows[i]), forest.classes)
+                return scorer.rank(categories[i])
+
+            latencies.extend(self._latency(serve, len(test_df)))
+
+        ranks = np.concatenate(ranks)
+        return {
+            "top_k": {k: float((ranks < k).mean()) for k in ks},
+            "fit": float(np.mean(fit_seconds)) if fit_seconds else 0.0,
+            "p50": float(np.percentile(latencies, 50)),
+            "p99": float(np.percentile(latencies, 99)),
+            "size": int(np.mean(sizes)) if sizes else 0,
+        }
+
+    @staticmethod
+    def _latency(serve, n):
+        """Χρόνοι (µs) ενός αιτήματος για δείγμα γραμμών του κομματιού."""
+        sample = np.linspace(0, n - 1, min(n, LATENCY_SAMPLES)).astype(int)
+        timings = []
+        for i in sample:
+            started = time.perf_counter()
+            serve(i)
+            timings.append((time.perf_counter() - started) * 1e6)
+        return timings
+
+    def _print(self, report, ks, tolerance):
+        header = f"{'candidate':<16}" + "".join(f"{f'top-{k}':>8}" for k in ks)
+        self.stdout.write(header + f"{'fit s':>8}{'p50 µs':>9}{'p99 µs':>9}{'size KiB':>10}")
+        for name, r in report.items():
+            self.stdout.write(
+                f"{name:<16}" + "".join(f"{r['top_k'][k]:>8.1%}" for k in ks)
+                + f"{r['fit']:>8.2f}{r['p50']:>9.0f}{r['p99']:>9.0f}{r['size'] / 1024:>10.0f}"
+            )
+
+        # Το φθηνότερο (μέγεθος, μετά p99) με top-1 μέσα στο tolerance από το καλύτερο.
+        first = ks[0]
+        best = max(r["top_k"][first] for r in report.values())
+        good = [name for name, r in report.items() if r["top_k"][first] >= best - tolerance]
+        cheapest = min(good, key=lambda name: (report[name]["size"], report[name]["p99"]))
+        self.stdout.write(self.style.SUCCESS(
+            f"👉 Φθηνότερο αρκετά καλό: {cheapest} (top-{first} {report[cheapest]['top_k'][first]:.1%}, "
+            f"καλύτερο {best:.1%})"
+        ))
@@ -0,0 +1,97 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from recommendations.fleet_scorer import FleetScorer
+
+CATEGORIES = ["small", "medium", "compact"]
+
+
+class _Car:
+    """Ελαφρύ υποκατάστατο του Car (hashable όπως τα model instances)."""
+    __slots__ = ("id", "category", "brand", "model")
+
+    def __init__(self, id, category, brand, model):
+        self.id = id
+        self.category = category
+        self.brand = brand
+        self.model = model
+
+
+def legacy_order(all_cars, wanted_category, probas, class_ids):
+    """Η παλιά υλοποίηση του rank_cars (per-car loops) — μόνο για σύγκριση."""
+    class_ids = list(class_ids)
+    target_cars = [c for c in all_cars if c.category.lower() == wanted_category]
+    other_cars = [c for c in all_cars if c not in target_cars]
+
+    scores = {}
+    for car in target_cars:
+        prob = probas[class_ids.index(car.id)] if car.id in class_ids else 0.0
+        scores[car] = prob
+
+    sorted_target = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    sorted_target = [car for car, _ in sorted_target]
+    sorted_others = sorted(other_cars, key=lambda c: (c.brand.lower(), c.model.lower()))
+    return sorted_target + sorted_others
+
+
+def synthetic_fleet(size, seed=0):
+    rng = np.random.default_rng(seed)
+    cars = [
+        _Car(
+            id=i + 1,
+            category=CATEGORIES[int(rng.integers(len(CATEGORIES)))],
+            brand=f"Brand{int(rng.integers(50))}",
+            model=f"Model{int(rng.integers(1000))}",
+        )
+        for i in range(size)
+    ]
+    class_ids = np.arange(1, size + 1)
+    probas = rng.dirichlet(np.ones(size))
+    return cars, probas, class_ids
+
+
+def _best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+class Command(BaseCommand):
+    help = "Benchmark της κατάταξης στόλου: παλιά per-car loops vs FleetScorer (NumPy)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="100,500,1000,2000,5000",
+                            help="Μεγέθη στόλου χωρισμένα με κόμμα.")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--skip-legacy-above", type=int, default=5000,
+                            help="Πάνω από αυτό το μέγεθος δεν τρέχει η παλιά (τετραγωνική) υλοποίηση.")
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options["sizes"].split(",") if s.strip()]
+        repeat = options["repeat"]
+
+        self.stdout.write(f"{'cars':>8} {'legacy (ms)':>12} {'scorer (ms)':>12} {'build (ms)':>11} {'speedup':>8}")
+        for size in sizes:
+            cars, probas, class_ids = synthetic_fleet(size)
+
+            build = _best_of(lambda: FleetScorer.from_cars(cars), repeat)
+            scorer = FleetScorer.from_cars(cars)
+            fast = _best_of(lambda: scorer.ranked_items("small", probas, class_ids), repeat)
+
+            if size <= options["skip_legacy_above"]:
+                legacy = _best_of(lambda: legacy_order(cars, "small", probas, class_ids), repeat)
+                assert legacy_order(cars, "small", probas, class_ids) == \
+                    scorer.ranked_items("small", probas, class_ids)
+                legacy_s = f"{legacy * 1000:12.2f}"
+                speedup = f"{legacy / (build + fast):7.1f}x"
+            else:
+                legacy_s, speedup = f"{'—':>12}", f"{'—':>8}"
+
+            self.stdout.write(f"{size:>8} {legacy_s} {fast * 1000:12.2f} {build * 1000:11.2f} {speedup}")
+
+        self.stdout.write(self.style.SUCCESS("✅ Τέλος benchmark."))
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from rentals.models import Company
+from recommendations import feature_store
 from recommendations.models import RentalRequest, RentalDecision
 
 class Command(BaseCommand):
@@ -26,6 +27,7 @@ class Command(BaseCommand):
         request_ids = RentalRequest.objects.filter(company=company).values_list("id", flat=True)
         num_decisions = RentalDecision.objects.filter(request_id__in=request_ids).delete()
         num_requests = RentalRequest.objects.filter(id__in=request_ids).delete()
+        feature_store.invalidate(company.id)
 
         self.stdout.write(self.style.SUCCESS(
             f"✅ Καθαρίστηκαν τα training δεδομένα για την εταιρεία \"{company.name}\" ({username})."
@@ -0,0 +1,135 @@
+import glob
+import os
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recommendations import artifacts
+from recommendations.ranking_table import RankingTable
+from recommendations.registry import ARTIFACTS, ModelRegistry
+
+# company_{id}/v{n}/*.joblib ή (παλιά) model_company_{id}*.joblib
+COMPANY_RE = re.compile(r"company_(\d+)[./]")
+FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared",
+    "Shared_Dirty": "shared",
+    "Private_Clean": "private",
+    "Private_Dirty": "private",
+}
+
+
+def smaps_usage(pid="self"):
+    """
+    Μνήμη (kB) ανά αρχείο που είναι mmapped στη διεργασία, από /proc/<pid>/smaps.
+    Επιστρέφει {path: {"rss", "pss", "shared", "private"}}.
+    """
+    usage = {}
+    current = None
+    with open(f"/proc/{pid}/smaps") as f:
+        for line in f:
+            head = line.split(None, 5)
+            if "-" in head[0] and len(head) >= 5 and not head[0].endswith(":"):
+                path = head[5].strip() if len(head) == 6 else ""
+                current = usage.setdefault(path, dict.fromkeys(("rss", "pss", "shared", "private"), 0)) \
+                    if path else None
+                continue
+            if current is not None and head[0].rstrip(":") in FIELDS:
+                current[FIELDS[head[0].rstrip(":")]] += int(head[1])
+    return usage
+
+
+def _rss_kb():
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Αναφορά μνήμης των AI μοντέλων: resident vs shared (mmap) ανά artifact. "
+        "Με --pid διαβάζει ένα τρέχον web worker, αλλιώς φορτώνει τα artifacts εδώ."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pid", type=int, default=None, help="PID ενός worker (gunicorn/uvicorn).")
+        parser.add_argument("--company-id", type=int, action="append", dest="company_ids",
+                            help="Μόνο αυτές οι εταιρείες (επαναλαμβανόμενο).")
+
+    def handle(self, *args, **options):
+        if not os.path.exists("/proc/self/smaps"):
+            raise CommandError("Χρειάζεται Linux (/proc/<pid>/smaps).")
+
+        if options["pid"]:
+            self._report_pid(options["pid"])
+        else:
+            self._report_local(options["company_ids"])
+
+    def _header(self):
+        self.stdout.write(
+            f"{'artifact':<40} {'file kB':>9} {'rss kB':>8} {'shared kB':>10} {'private kB':>11} {'heap kB':>8}"
+        )
+
+    def _row(self, path, file_kb, mapped, heap_kb="—"):
+        # company_1/v3/table.joblib: σχετικά με το RECOMMENDATION_MODEL_DIR.
+        root = os.path.abspath(artifacts.model_dir())
+        name = os.path.relpath(path, root) if path.startswith(root + os.sep) else os.path.basename(path)
+        self.stdout.write(
+            f"{name:<40} {file_kb:>9} {mapped['rss']:>8} "
+            f"{mapped['shared']:>10} {mapped['private']:>11} {heap_kb:>8}"
+        )
+
+    def _report_pid(self, pid):
+        try:
+            usage = smaps_usage(pid)
+        except OSError as e:
+            raise CommandError(f"Δεν διαβάζεται το /proc/{pid}/smaps: {e}")
+        rows = {p: u for p, u in usage.items() if p.endswith(".joblib") and COMPANY_RE.search(p)}
+        if not rows:
+            self.stdout.write(self.style.WARNING(f"⚠️ Κανένα mmapped artifact στη διεργασία {pid}."))
+            return
+        self.stdout.write(f"📊 Artifacts στη διεργασία {pid}:")
+        self._header()
+        for path, mapped in sorted(rows.items()):
+            file_kb = os.path.getsize(path) // 1024 if os.path.exists(path) else "?"
+            self._row(path, file_kb, mapped)
+
+    def _report_local(self, company_ids):
+        if not company_ids:
+            legacy = glob.glob(artifacts.LEGACY_FILENAMES["model"].format("*"))
+            company_ids = sorted(set(artifacts.company_ids()) | {
+                int(m.group(1)) for p in legacy if (m := COMPANY_RE.search(p))
+            })
+        if not company_ids:
+            self.stdout.write(self.style.WARNING("⚠️ Δεν βρέθηκαν αποθηκευμένα μοντέλα."))
+            return
+
+        # Τα imports του sklearn να μη μετρηθούν στο πρώτο μοντέλο.
+        import sklearn.ensemble  # noqa: F401
+        import sklearn.preprocessing  # noqa: F401
+
+        registry = ModelRegistry()
+        self._header()
+        for company_id in company_ids:
+            for kind, (path_for, _) in ARTIFACTS.items():
+                before = _rss_kb()
+                try:
+                    value = registry.get(company_id, kind)
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f"❌ {company_id}/{kind}: {e}"))
+                    continue
+                if value is None:
+                    continue
+                if isinstance(value, RankingTable):
+                    value.probas.sum()  # όπως μετά από αρκετά requests: όλες οι σελίδες resident
+                # Heap = ό,τι δεν ήρθε από mmap (π.χ. τα δέντρα του sklearn).
+                heap_kb = max(_rss_kb() - before, 0)
+                path = os.path.abspath(path_for(company_id))
+                mapped = smaps_usage().get(path, dict.fromkeys(("rss", "shared", "private"), 0))
+                self._row(path, os.path.getsize(path) // 1024, mapped, max(heap_kb - mapped["rss"], 0))
+
+        self.stdout.write(
+            "ℹ️ shared = σελίδες στο page cache που μοιράζονται με άλλα workers· "
+            "heap = ιδιωτική μνήμη ανά worker."
+        )
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recommendations import artifacts
+from recommendations.ml_training import get_company
+
+
+class Command(BaseCommand):
+    help = (
+        "Εκδόσεις του AI μοντέλου μιας εταιρείας. Με --rollback η τρέχουσα γίνεται "
+        "η προηγούμενη (ή η --to)· τα web workers την παίρνουν χωρίς restart."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", type=str, help="Το username της εταιρείας.")
+        parser.add_argument("--rollback", action="store_true", help="Επαναφορά σε παλαιότερη έκδοση.")
+        parser.add_argument("--to", type=int, default=None, dest="to_version", help="Η έκδοση για το --rollback.")
+
+    def handle(self, *args, **options):
+        try:
+            company = get_company(options["username"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options["rollback"]:
+            try:
+                version = artifacts.rollback(company.id, options["to_version"])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(f"⏪ Τρέχουσα έκδοση: v{version}"))
+
+        current = artifacts.current_version(company.id)
+        versions = artifacts.versions(company.id)
+        if not versions:
+            self.stdout.write(self.style.WARNING("⚠️ Δεν υπάρχουν αποθηκευμένες εκδόσεις."))
+            return
+        for v in versions:
+            mark = "👉" if v["version"] == current else "  "
+            self.stdout.write(f"{mark} v{v['version']}  {v['created']}")
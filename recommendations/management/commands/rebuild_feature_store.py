@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recommendations import feature_store
+from rentals.models import Company
+
+
+class Command(BaseCommand):
+    help = (
+        "Ξαναχτίζει από τη βάση το feature store του training (όλες ή συγκεκριμένες εταιρείες). "
+        "Με --compact συγχωνεύει μόνο το log στο snapshot."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("usernames", nargs="*", help="Usernames εταιρειών (κενό = όλες).")
+        parser.add_argument("--compact", action="store_true", help="Μόνο compaction, χωρίς ανάγνωση της βάσης.")
+
+    def handle(self, *args, **options):
+        companies = Company.objects.select_related("user").order_by("id")
+        if options["usernames"]:
+            companies = companies.filter(user__username__in=options["usernames"])
+
+        for company in companies:
+            started = time.perf_counter()
+            if options["compact"]:
+                if not feature_store.exists(company.id):
+                    self.stdout.write(f"⏭️ Skip: {company.user.username} (δεν υπάρχει store)")
+                    continue
+                count = feature_store.compact(company.id)
+            else:
+                count = feature_store.rebuild(company)
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ {company.user.username}: {count} εγγραφές σε {time.perf_counter() - started:.2f}s "
+                f"({feature_store.snapshot_path(company.id)})"
+            ))
@@ -1,11 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from sklearn.metrics import accuracy_score
 from rentals.models import Company, Car
-from recommendations.models import RentalRequest, RentalDecision
-import pandas as pd
-import joblib
-import os
+from recommendations.evaluation import DEFAULT_TOP_K, evaluate, parse_top_k
+from recommendations.ml_training import company_dataset, load_model
 
 
 class Command(BaseCommand):
@@ -13,6 +10,9 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("username", type=str, help="Το username της εταιρείας")
+        parser.add_argument("--top-k", type=parse_top_k, default=DEFAULT_TOP_K,
+                            help="Top-k για τα οποία μετράται η επιτυχία, π.χ. 1,3,5.")
+        parser.add_argument("--summary", action="store_true", help="Μόνο η σύνοψη, χωρίς γραμμή ανά απόφαση.")
 
     def handle(self, *args, **options):
         username = options["username"]
@@ -24,80 +24,51 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR(f"❌ Δεν βρέθηκε εταιρεία με username '{username}'"))
             return
 
-        model_path = f"model_company_{company.id}.joblib"
-        if not os.path.exists(model_path):
-            self.stdout.write(self.style.ERROR(f"❌ Δεν βρέθηκε μοντέλο για την εταιρεία '{company.name}'"))
-            return
-
         try:
-            model, category_encoder = joblib.load(model_path)
+            loaded = load_model(company.id)
         except:
             self.stdout.write(self.style.ERROR("❌ Σφάλμα κατά το φόρτωμα του μοντέλου."))
             return
+        if loaded is None:
+            self.stdout.write(self.style.ERROR(f"❌ Δεν βρέθηκε μοντέλο για την εταιρεία '{company.name}'"))
+            return
+        model, category_encoder = loaded
 
-        decisions = RentalDecision.objects.select_related("request", "chosen_car")\
-            .filter(request__company=company, chosen_car__isnull=False)
-
-        y_true, y_pred = [], []
-        correct = 0
+        # Τα δεδομένα από το feature store (όχι join στη βάση), τα ονόματα οχημάτων με ένα query.
+        df = company_dataset(company)
+        car_names = {
+            car_id: f"{brand} {model}"
+            for car_id, brand, model in Car.objects.filter(company=company).values_list("id", "brand", "model")
+        }
 
         self.stdout.write(f"\n📊 Τεστ προβλέψεων για εταιρεία: {company.name} (username: {username})")
         self.stdout.write("------------------------------------------------------")
 
-        for i, decision in enumerate(decisions):
-            req = decision.request
-            car = decision.chosen_car
-
-            if req.requested_category not in category_encoder.classes_:
-                continue
-
-            try:
-                cat_encoded = category_encoder.transform([req.requested_category])[0]
-            except:
-                continue
-
-            features = [
-                req.days,
-                float(req.total_price),
-                int(req.extra_insurance),
-                cat_encoded,
-            ]
-
-            # ✅ Δημιουργία DataFrame με ονόματα στηλών
-            feature_names = [
-                "days",
-                "total_price",
-                "extra_insurance",
-                "requested_category_enc",
-            ]
-            input_df = pd.DataFrame([features], columns=feature_names)
-
-            try:
-                probas = model.predict_proba(input_df)[0]
-                predicted_car_id = model.classes_[probas.argmax()]
-            except:
-                continue
-
-            is_correct = predicted_car_id == car.id
-            y_true.append(car.id)
-            y_pred.append(predicted_car_id)
-            correct += 1 if is_correct else 0
-
-            predicted_car = Car.objects.filter(id=predicted_car_id).first()
-            predicted_str = f"{predicted_car.brand} {predicted_car.model}" if predicted_car else f"ID {predicted_car_id}"
-
-            result = "✅" if is_correct else "❌"
-            self.stdout.write(
-                f"{result} Request #{decision.id}: Επέλεξε {car.brand} {car.model} | AI πρότεινε {predicted_str}"
-            )
-
-        if not y_true:
+        # Ένας πίνακας features και μία κλήση predict_proba για όλες τις αποφάσεις.
+        result = evaluate(model, category_encoder, df, ks=options["top_k"])
+        rows = result["rows"]
+        if not len(rows):
             self.stdout.write(self.style.WARNING("⚠️ Δεν υπάρχουν επαρκή δεδομένα για αξιολόγηση του μοντέλου."))
             return
 
-        accuracy = accuracy_score(y_true, y_pred)
+        if not options["summary"]:
+            lines = []
+            for decision_id, chosen, predicted in zip(rows["decision_id"], rows["car_id"], rows["predicted_car_id"]):
+                result_mark = "✅" if chosen == predicted else "❌"
+                lines.append(
+                    f"{result_mark} Request #{decision_id}: Επέλεξε {car_names.get(chosen, f'ID {chosen}')} | "
+                    f"AI πρότεινε {car_names.get(predicted, f'ID {predicted}')}"
+                )
+            self.stdout.write("\n".join(lines))
+
+        correct = int((rows["car_id"] == rows["predicted_car_id"]).sum())
+        accuracy = correct / len(rows)
 
         self.stdout.write("\n📈 Συνοπτικά:")
         self.stdout.write(self.style.SUCCESS(
-            f"🎯 Τελική ακρίβεια: {accuracy:.2%} ({correct} σωστά από {len(y_true)} προβλέψεις)"
+            f"🎯 Τελική ακρίβεια: {accuracy:.2%} ({correct} σωστά από {len(rows)} προβλέψεις)"
         ))
+        for k, rate in result["top_k"].items():
+            self.stdout.write(f"🥇 Top-{k}: {rate:.2%}")
+        if result["skipped"]:
+            self.stdout.write(f"⏭️ {result['skipped']} αποφάσεις με κατηγορία που δεν ξέρει το μοντέλο.")
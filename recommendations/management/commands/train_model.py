@@ -1,5 +1,20 @@
-from django.core.management.base import BaseCommand
-from recommendations.ml_training import build_training_dataset, train_model, save_model
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from recommendations.artifacts import artifact_path
+from recommendations.ml_training import (
+    build_training_dataset,
+    get_company,
+    load_model,
+    model_drift,
+    save_model,
+    train_model,
+    update_model,
+)
+
 
 class Command(BaseCommand):
     help = "Εκπαίδευση του μοντέλου AI για συγκεκριμένη εταιρεία"
@@ -10,27 +25,111 @@ class Command(BaseCommand):
             type=str,
             help="Το username της εταιρείας για την οποία θα εκπαιδευτεί το AI μοντέλο."
         )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help="Εκπαίδευση μόνο στις αποφάσεις (επιλογές οχήματος) μετά το last_trained (νέα δέντρα στο υπάρχον μοντέλο). "
+                 "Γίνεται πλήρες training αν δεν υπάρχει μοντέλο, αν ήρθε η ώρα του προγραμματισμένου "
+                 "πλήρους ή αν το drift ξεπερνά το όριο.",
+        )
+        parser.add_argument(
+            '--drift-threshold',
+            type=float,
+            default=getattr(settings, "RECOMMENDATION_DRIFT_THRESHOLD", 0.75),
+            help="Ποσοστό λάθος προβλέψεων (top-1) στα νέα δεδομένα πάνω από το οποίο γίνεται πλήρες training.",
+        )
+        parser.add_argument(
+            '--trace-memory',
+            action='store_true',
+            help="Μέτρηση της αιχμής μνήμης (tracemalloc) κατά τη δημιουργία του dataset.",
+        )
 
     def handle(self, *args, **options):
         username = options['username']
+        started = timezone.now()
+        self.trace_memory = options['trace_memory']
+
+        if options['incremental']:
+            try:
+                done = self._incremental(username, options['drift_threshold'], started)
+            except ValueError as e:
+                raise CommandError(e)
+            if done:
+                return
+
         self.stdout.write(f"📊 Δημιουργία dataset για: {username}...")
 
         try:
-            df, company = build_training_dataset(username)
+            df, company = build_training_dataset(username, trace_memory=self.trace_memory)
         except ValueError as e:
-            self.stdout.write(self.style.ERROR(f"❌ {e}"))
-            return
+            raise CommandError(e)
 
+        # Αποτυχίες ως CommandError: όποιος καλεί με call_command (retrain_company) τις βλέπει.
         if df.empty:
-            self.stdout.write(self.style.WARNING("⚠️  Δεν υπάρχουν αρκετά δεδομένα για training."))
-            return
+            raise CommandError("Δεν υπάρχουν αρκετά δεδομένα για training.")
 
         self.stdout.write("🧠 Εκπαίδευση μοντέλου...")
         model, category_encoder = train_model(df)
 
         self.stdout.write("💾 Αποθήκευση μοντέλου...")
-        save_model(model, category_encoder, company.id)
+        version = save_model(model, category_encoder, company.id)
+
+        company.last_trained = started
+        company.last_full_trained = started
+        company.save(update_fields=["last_trained", "last_full_trained"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Το μοντέλο εκπαιδεύτηκε και αποθηκεύτηκε ως v{version} "
+            f"({artifact_path(company.id, 'model', version)})"
+        ))
+
+    def _full_rebuild_reason(self, company):
+        """Γιατί πρέπει να γίνει πλήρες training (ή None για incremental)."""
+        if not company.last_trained or not company.last_full_trained:
+            return "δεν υπάρχει προηγούμενο πλήρες training"
+        every = timedelta(days=getattr(settings, "RECOMMENDATION_FULL_RETRAIN_DAYS", 7))
+        if timezone.now() - company.last_full_trained >= every:
+            return f"προγραμματισμένο πλήρες training (κάθε {every.days} ημέρες)"
+        return None
+
+    def _incremental(self, username, drift_threshold, started):
+        """True αν ολοκληρώθηκε incremental· False → πλήρες training."""
+        company = get_company(username)
+        reason = self._full_rebuild_reason(company)
+        loaded = None if reason else load_model(company.id)
+        if not reason and loaded is None:
+            reason = "δεν βρέθηκε αποθηκευμένο μοντέλο"
+        if reason:
+            self.stdout.write(f"🔁 Πλήρες training: {reason}.")
+            return False
+
+        self.stdout.write(f"📊 Νέες αποφάσεις για: {username} (μετά τις {company.last_trained:%Y-%m-%d %H:%M})...")
+        df, company = build_training_dataset(
+            username, since=company.last_trained, trace_memory=self.trace_memory
+        )
+        if df.empty:
+            self.stdout.write("⏭️ Δεν υπάρχουν νέα δεδομένα.")
+            return True
+
+        model, category_encoder = loaded
+        drift = model_drift(model, category_encoder, df)
+        if drift > drift_threshold:
+            self.stdout.write(f"🔁 Πλήρες training: drift {drift:.0%} > {drift_threshold:.0%}.")
+            return False
+
+        updated = update_model(model, category_encoder, df)
+        if updated is None:
+            self.stdout.write("🔁 Πλήρες training: νέα κατηγορία ή όχημα που δεν ξέρει το μοντέλο (ή μοντέλο παλιότερης έκδοσης).")
+            return False
+
+        self.stdout.write("💾 Αποθήκευση μοντέλου...")
+        version = save_model(*updated, company.id)
+
+        company.last_trained = started
+        company.save(update_fields=["last_trained"])
 
         self.stdout.write(self.style.SUCCESS(
-            f"✅ Το μοντέλο εκπαιδεύτηκε και αποθηκεύτηκε ως model_company_{company.id}.joblib"
+            f"✅ Incremental training σε {len(df)} νέα δείγματα (drift {drift:.0%}) — "
+            f"v{version} ({artifact_path(company.id, 'model', version)})"
         ))
+        return True
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.23
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_decided_at(apps, schema_editor):
+    # Για τις παλιές αποφάσεις δεν ξέρουμε πότε επιλέχθηκε το όχημα: η πιο
+    # κοντινή εκτίμηση είναι η ώρα του αιτήματος (ό,τι χρησιμοποιούσε ως τώρα το since).
+    RentalDecision = apps.get_model("recommendations", "RentalDecision")
+    RentalRequest = apps.get_model("recommendations", "RentalRequest")
+    RentalDecision.objects.filter(chosen_car__isnull=False, decided_at__isnull=True).update(
+        decided_at=Subquery(RentalRequest.objects.filter(id=OuterRef("request_id")).values("created_at")[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recommendations", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="rentaldecision",
+            name="decided_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_decided_at, migrations.RunPython.noop),
+    ]
@@ -1,66 +1,279 @@
+import os
+
+import numpy as np
 import pandas as pd
 import joblib
+from django.conf import settings
 from django.contrib.auth.models import User
 from rentals.models import Company
-from recommendations.models import RentalRequest, RentalDecision
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import LabelEncoder
 
+from . import artifacts, feature_store
+from .artifacts import model_path
+from .dataset import stream_decision_columns
+from .flat_forest import LEAF, FlatForest
+from .ranking_table import RankingTable, cell_values
+
+FEATURES = [
+    "days",
+    "total_price",
+    "extra_insurance",
+    "requested_category_enc",
+]
+
+MODEL_PARAMS = {"n_estimators": 10, "random_state": 42}  # ⚡ πιο γρήγορο για δοκιμές
+
 
-def build_training_dataset(company_username):
+def get_company(company_username):
     try:
         user = User.objects.get(username=company_username)
-        company = Company.objects.get(user=user)
+        return Company.objects.get(user=user)
     except (User.DoesNotExist, Company.DoesNotExist):
         raise ValueError(f"Η εταιρεία με username '{company_username}' δεν βρέθηκε.")
 
-    decisions = RentalDecision.objects.select_related("request", "chosen_car")\
-        .filter(request__company=company, chosen_car__isnull=False)
 
-    rows = []
-    for decision in decisions:
-        req = decision.request
-        car = decision.chosen_car
-        rows.append({
-            "days": req.days,
-            "total_price": float(req.total_price),
-            "extra_insurance": int(req.extra_insurance),
-            "requested_category": req.requested_category,
-            "car_id": car.id,
-        })
+def build_training_dataset(company_username, since=None, trace_memory=False):
+    """
+    since: μόνο αποφάσεις με request μετά από αυτή τη στιγμή (incremental training).
+    Επιστρέφει (df, company).
+    """
+    company = get_company(company_username)
+    return company_dataset(company, since=since, trace_memory=trace_memory), company
 
-    df = pd.DataFrame(rows)
-    print(f"📊 Loaded {len(df)} training samples for company '{company.name}'")
+
+def company_dataset(company, since=None, trace_memory=False):
+    """
+    Το DataFrame του training για μια εταιρεία. Διαβάζει από το feature store
+    (βλ. feature_store.py) ή, αν είναι απενεργοποιημένο, streaming από τη
+    βάση σε NumPy στήλες (dataset.py).
+    """
+    if feature_store.enabled():
+        columns = feature_store.load_columns(company, since=since, trace_memory=trace_memory)
+    else:
+        columns = stream_decision_columns(company, since=since, trace_memory=trace_memory)
+    df = columns.to_frame()
+    peak = f", peak {columns.peak_bytes / 1024:.0f} KiB" if columns.peak_bytes is not None else ""
+    print(f"📊 Loaded {len(df)} training samples for company '{company.name}' ({columns.seconds:.2f}s{peak})")
 
     # Αν θες να περιορίσεις τις εγγραφές για τεστ:
     # df = df[:100]
 
-    return df, company
+    return df
 
 
-def train_model(df):
+def train_model(df, params=None):
+    """params: παράμετροι του RandomForestClassifier πάνω από τα MODEL_PARAMS."""
     category_encoder = LabelEncoder()
     df["requested_category_enc"] = category_encoder.fit_transform(
         df["requested_category"]
     )
 
-    X = df[[
-        "days",
-        "total_price",
-        "extra_insurance",
-        "requested_category_enc",
-    ]]
+    X = df[FEATURES]
     y = df["car_id"]
 
     print("🧠 Training model... (this may take a few seconds)")
-    model = RandomForestClassifier(n_estimators=10, random_state=42)  # ⚡ πιο γρήγορο για δοκιμές
+    model = RandomForestClassifier(**{**MODEL_PARAMS, **(params or {})})
     model.fit(X, y)
+    # Τα δέντρα του πλήρους training μένουν πάντα στο μοντέλο (βλ. update_model).
+    model.n_full_estimators_ = len(model.estimators_)
     print("✅ Training complete.")
 
     return model, category_encoder
 
 
+def load_model(company_id):
+    """Το αποθηκευμένο (model, category_encoder) ή None."""
+    filename = model_path(company_id)
+    if not os.path.exists(filename):
+        return None
+    return joblib.load(filename)
+
+
+def model_drift(model, category_encoder, df) -> float:
+    """
+    Ποσοστό νέων αποφάσεων που το τρέχον μοντέλο ΔΕΝ προβλέπει σωστά (top-1).
+    Άγνωστες κατηγορίες/οχήματα μετράνε ως λάθος.
+    """
+    if df.empty:
+        return 0.0
+    known = df["requested_category"].isin(category_encoder.classes_)
+    if not known.any():
+        return 1.0
+    X = df.loc[known, ["days", "total_price", "extra_insurance"]].copy()
+    X["requested_category_enc"] = category_encoder.transform(df.loc[known, "requested_category"])
+    predicted = model.classes_[model.predict_proba(X[FEATURES]).argmax(axis=1)]
+    hits = int((predicted == df.loc[known, "car_id"].to_numpy()).sum())
+    return 1.0 - hits / len(df)
+
+
+def update_model(model, category_encoder, df, n_new_trees=None, max_estimators=None):
+    """
+    Incremental training: προσθέτει n_new_trees δέντρα (warm start) που
+    εκπαιδεύονται ΜΟΝΟ στις νέες αποφάσεις. Τα δέντρα του πλήρους training
+    (n_full_estimators_) μένουν· πάνω από max_estimators πετιούνται τα
+    παλαιότερα incremental. Επιστρέφει None όταν χρειάζεται πλήρες training
+    (νέα κατηγορία ή όχημα που δεν ξέρει το μοντέλο, ή μοντέλο χωρίς
+    n_full_estimators_ από παλιότερη έκδοση).
+    """
+    if n_new_trees is None:
+        n_new_trees = getattr(settings, "RECOMMENDATION_INCREMENTAL_TREES", 5)
+    if max_estimators is None:
+        max_estimators = getattr(settings, "RECOMMENDATION_MAX_ESTIMATORS", 30)
+
+    n_full = getattr(model, "n_full_estimators_", None)
+    if n_full is None:
+        return None
+    if not df["requested_category"].isin(category_encoder.classes_).all():
+        return None
+    if not df["car_id"].isin(model.classes_).all():
+        return None
+
+    X = df[["days", "total_price", "extra_insurance"]].copy()
+    X["requested_category_enc"] = category_encoder.transform(df["requested_category"])
+
+    # Μία γραμμή με βάρος 0 για κάθε γνωστό όχημα: τα νέα δέντρα βλέπουν
+    # ακριβώς τα ίδια classes_ με τα παλιά, χωρίς να επηρεάζεται το fit.
+    anchors = pd.DataFrame({
+        "days": 1,
+        "total_price": 0.0,
+        "extra_insurance": 0,
+        "requested_category_enc": 0,
+    }, index=range(len(model.classes_)))
+    X = pd.concat([X[FEATURES], anchors[FEATURES]], ignore_index=True)
+    y = np.concatenate([df["car_id"].to_numpy(), model.classes_])
+    sample_weight = np.concatenate([np.ones(len(df)), np.zeros(len(model.classes_))])
+
+    print(f"🧠 Incremental training on {len(df)} new samples (+{n_new_trees} trees)...")
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + n_new_trees)
+    model.fit(X, y, sample_weight=sample_weight)
+    # Τουλάχιστον τα νέα δέντρα μένουν, ακόμα κι αν τα πλήρη φτάνουν ήδη το όριο.
+    keep = max(max_estimators - n_full, n_new_trees)
+    model.estimators_ = model.estimators_[:n_full] + model.estimators_[n_full:][-keep:]
+    model.set_params(warm_start=False, n_estimators=len(model.estimators_))
+    print(f"✅ Incremental training complete ({len(model.estimators_)} trees).")
+
+    return model, category_encoder
+
+
+def _split_edges(model, feature, max_edges):
+    """Τα thresholds όλων των δέντρων για ένα feature (ταξινομημένα, μοναδικά)."""
+    thresholds = [
+        est.tree_.threshold[est.tree_.feature == feature]
+        for est in model.estimators_
+    ]
+    edges = np.unique(np.concatenate(thresholds)) if thresholds else np.array([])
+    if len(edges) <= max_edges:
+        return edges, True
+    picks = np.linspace(0, len(edges) - 1, max_edges).round().astype(int)
+    return edges[np.unique(picks)], False
+
+
+def build_ranking_table(model, category_encoder, max_edges=None):
+    """
+    Υπολογίζει με ένα predict_proba τις πιθανότητες για κάθε κελί
+    (κατηγορία, days bucket, price bucket, insurance) — βλ. ranking_table.
+    """
+    if max_edges is None:
+        max_edges = getattr(settings, "RECOMMENDATION_TABLE_MAX_EDGES", 32)
+    days_edges, days_exact = _split_edges(model, FEATURES.index("days"), max_edges)
+    price_edges, price_exact = _split_edges(model, FEATURES.index("total_price"), max_edges)
+
+    categories = np.arange(len(category_encoder.classes_))
+    grid = np.meshgrid(
+        categories, cell_values(days_edges), cell_values(price_edges), [0, 1],
+        indexing="ij",
+    )
+    X = pd.DataFrame({
+        "days": grid[1].ravel(),
+        "total_price": grid[2].ravel(),
+        "extra_insurance": grid[3].ravel(),
+        "requested_category_enc": grid[0].ravel(),
+    })[FEATURES]
+    probas = model.predict_proba(X).astype(np.float32)
+    probas = probas.reshape(grid[0].shape + (len(model.classes_),))
+
+    return RankingTable({
+        "categories": np.asarray(category_encoder.classes_, dtype=str),
+        "days_edges": days_edges,
+        "price_edges": price_edges,
+        "probas": probas,
+        "classes": np.asarray(model.classes_),
+        "exact": days_exact and price_exact,
+    })
+
+
+def export_flat_forest(model, category_encoder):
+    """Μετατρέπει το RandomForestClassifier σε FlatForest (βλ. flat_forest)."""
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    leaf_offset = 0
+    max_depth = 0
+    for est in model.estimators_:
+        tree = est.tree_
+        is_leaf = tree.children_left == -1
+        roots.append(offset)
+        features.append(np.where(is_leaf, LEAF, tree.feature).astype(np.int32))
+        thresholds.append(tree.threshold.astype(np.float64))
+        lefts.append(np.where(is_leaf, LEAF, tree.children_left + offset).astype(np.int32))
+        # Στα φύλλα το right δείχνει τη γραμμή τους στο value.
+        leaf_rows = np.cumsum(is_leaf) - 1 + leaf_offset
+        rights.append(np.where(is_leaf, leaf_rows, tree.children_right + offset).astype(np.int32))
+
+        # Όπως το DecisionTreeClassifier.predict_proba: κανονικοποίηση ανά φύλλο.
+        value = tree.value[is_leaf, 0, :].astype(np.float64)
+        normalizer = value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0] = 1.0
+        values.append(value / normalizer)
+        leaf_offset += int(is_leaf.sum())
+
+        max_depth = max(max_depth, tree.max_depth)
+        offset += tree.node_count
+
+    return FlatForest({
+        "feature": np.concatenate(features),
+        "threshold": np.concatenate(thresholds),
+        "left": np.concatenate(lefts),
+        "right": np.concatenate(rights),
+        "value": np.concatenate(values),
+        "roots": np.asarray(roots, dtype=np.int32),
+        "max_depth": max_depth,
+        "classes": np.asarray(model.classes_),
+        "categories": np.asarray(category_encoder.classes_, dtype=str),
+    })
+
+
 def save_model(model, category_encoder, company_id):
-    filename = f"model_company_{company_id}.joblib"
-    joblib.dump((model, category_encoder), filename)
-    print(f"💾 Model saved to {filename}")
+    """
+    Γράφει μια νέα έκδοση (model, πίνακας κατάταξης, flat forest) και τη
+    δημοσιεύει ατομικά (βλ. artifacts.py). Επιστρέφει τον αριθμό έκδοσης.
+    """
+    table = build_ranking_table(model, category_encoder)
+    forest = export_flat_forest(model, category_encoder)
+    # Έλεγχος ισοδυναμίας με το sklearn πάνω στο πλέγμα του πίνακα κατάταξης.
+    grid = np.stack(np.meshgrid(
+        cell_values(table.days_edges), cell_values(table.price_edges), [0, 1],
+        np.arange(len(table.categories)), indexing="ij",
+    ), axis=-1).reshape(-1, len(FEATURES))
+    expected = model.predict_proba(pd.DataFrame(grid, columns=FEATURES))
+    forest_ok = np.allclose(forest.predict_proba(grid), expected, atol=1e-9)
+
+    # Χωρίς compression: τα numpy arrays γράφονται aligned ώστε τα workers να
+    # τα φορτώνουν με mmap_mode="r" (κοινόχρηστα μέσω page cache).
+    with artifacts.new_version(company_id) as release:
+        joblib.dump((model, category_encoder), os.path.join(release.path, artifacts.FILENAMES["model"]), compress=0)
+        joblib.dump(table.to_dict(), os.path.join(release.path, artifacts.FILENAMES["table"]), compress=0)
+        if forest_ok:
+            joblib.dump(forest.to_dict(), os.path.join(release.path, artifacts.FILENAMES["forest"]), compress=0)
+    # Η έκδοση που δημοσιεύσαμε, όχι η τρέχουσα (μπορεί να την πέρασε ήδη άλλο publish).
+    version = release.version
+
+    print(f"💾 Model saved to {artifacts.artifact_path(company_id, 'model', version)} (v{version})")
+    print(f"💾 Ranking table saved to {artifacts.artifact_path(company_id, 'table', version)} "
+          f"({table.probas.shape[1]}x{table.probas.shape[2]} buckets, exact={table.exact})")
+    if forest_ok:
+        print(f"💾 Flat forest saved to {artifacts.artifact_path(company_id, 'forest', version)} "
+              f"({len(forest.feature)} nodes)")
+    else:
+        print("⚠️ Το flat forest δεν συμφωνεί με το sklearn — δεν αποθηκεύτηκε.")
+    return version
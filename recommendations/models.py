@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from rentals.models import Company, Car
 
 class RentalRequest(models.Model):
@@ -17,6 +18,16 @@ class RentalDecision(models.Model):
     request = models.OneToOneField(RentalRequest, on_delete=models.CASCADE)
     chosen_car = models.ForeignKey(Car, null=True, blank=True, on_delete=models.SET_NULL)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Η στιγμή της επιλογής οχήματος (όχι του αιτήματος): το since του incremental training.
+    decided_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def save(self, *args, **kwargs):
+        if self.chosen_car_id is not None and self.decided_at is None:
+            self.decided_at = timezone.now()
+            update_fields = kwargs.get("update_fields")
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "decided_at"}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Decision for Request #{self.request.id}"
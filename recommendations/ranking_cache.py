@@ -0,0 +1,87 @@
+"""
+Cache αποτελεσμάτων κατάταξης μπροστά από το rank_cars.
+
+Key: (είδος, εταιρεία, κατηγορία, days/price bucket, insurance,
+      έκδοση μοντέλου, έκδοση στόλου).
+- Έκδοση μοντέλου: τα stamps (mtime/size) των artifacts — ένα retrain αλλάζει
+  αυτόματα το key.
+- Έκδοση στόλου: Company.fleet_version, που ανεβαίνει σε κάθε save/delete
+  ενός Car (βλ. rentals.signals). Είναι στη βάση ώστε μια αλλαγή σε ένα
+  worker να ακυρώνει τα entries όλων.
+
+Τα ίδια τα αποτελέσματα μένουν σε LRU μνήμη του worker, με όριο μεγέθους
+και μετρητές hits/misses. Κρατιούνται μόνο car ids (και scores), όχι Car
+instances· σε hit η διαθεσιμότητα ξαναδιαβάζεται από τη βάση.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import F
+
+from rentals.models import Company
+
+DEFAULT_MAX_ENTRIES = 1024
+
+
+def fleet_version(company_id) -> int:
+    version = Company.objects.filter(pk=company_id).values_list("fleet_version", flat=True).first()
+    return version or 0
+
+
+def bump_fleet_version(company_id):
+    Company.objects.filter(pk=company_id).update(fleet_version=F("fleet_version") + 1)
+    ranking_cache.invalidate(company_id)  # τα άλλα workers τα ακυρώνει το νέο fleet_version
+
+
+class RankingCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Η τιμή ή None (miss)."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, company_id=None):
+        """Σβήνει τα entries μιας εταιρείας (ή όλα). Το key[1] είναι το company_id."""
+        with self._lock:
+            if company_id is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[1] == company_id]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+ranking_cache = RankingCache(
+    max_entries=getattr(settings, "RECOMMENDATION_RANKING_CACHE_SIZE", DEFAULT_MAX_ENTRIES),
+)
@@ -0,0 +1,113 @@
+"""
+Προϋπολογισμένος πίνακας κατάταξης (ranking table) ανά εταιρεία.
+
+Το μοντέλο βλέπει μόνο 4 features (days, total_price, extra_insurance,
+requested_category_enc). Ένα RandomForest είναι σταθερό ανάμεσα σε δύο
+διαδοχικά thresholds των splits του, άρα αν χωρίσουμε days/total_price στα
+thresholds του δάσους, κάθε κελί (κατηγορία, days bucket, price bucket,
+insurance) έχει μία και μοναδική πρόβλεψη. Τις πιθανότητες αυτές τις
+υπολογίζει το save_model στο training και εδώ απλώς τις διαβάζουμε —
+χωρίς sklearn στο request path.
+
+Αν τα thresholds είναι πάρα πολλά, ο πίνακας κρατάει υποσύνολό τους
+(exact=False) και η κατάταξη του δεν ταυτίζεται με του μοντέλου· τέτοιος
+πίνακας δεν χρησιμοποιείται (βλ. rentals.utils._exact_table).
+"""
+import numpy as np
+
+
+def value_cell(edges, value) -> int:
+    """
+    Σε ποιο κελί πέφτει η τιμή. Τα δέντρα του sklearn συγκρίνουν σε float32
+    με κανόνα ``x <= threshold``, οπότε κάνουμε το ίδιο εδώ.
+    """
+    x = float(np.float32(value))
+    return int(np.searchsorted(edges, x, side="left"))
+
+
+def cell_values(edges) -> np.ndarray:
+    """
+    Μία αντιπροσωπευτική float32 τιμή για κάθε κελί (len(edges) + 1 κελιά).
+    Κελί i = (edges[i-1], edges[i]].
+    """
+    inf = np.float32(np.inf)
+    reps = []
+    for i in range(len(edges) + 1):
+        if i < len(edges):
+            # η μεγαλύτερη float32 τιμή <= edges[i]
+            v = np.float32(edges[i])
+            if float(v) > edges[i]:
+                v = np.nextafter(v, -inf)
+        else:
+            # οτιδήποτε πάνω από το τελευταίο threshold
+            v = np.float32(edges[-1]) if len(edges) else np.float32(0)
+            if len(edges) and float(v) <= edges[-1]:
+                v = np.nextafter(v, inf)
+        reps.append(v)
+    return np.asarray(reps, dtype=np.float32)
+
+
+class RankingTable:
+    """
+    Πίνακας πιθανοτήτων σχήματος
+    (κατηγορίες, len(days_edges)+1, len(price_edges)+1, 2, κλάσεις).
+    """
+
+    def __init__(self, data: dict):
+        self.categories = [str(c) for c in data["categories"]]
+        self.days_edges = np.asarray(data["days_edges"], dtype=np.float64)
+        self.price_edges = np.asarray(data["price_edges"], dtype=np.float64)
+        self.probas = data["probas"]
+        self.classes = np.asarray(data["classes"])
+        self.exact = bool(data["exact"])
+        self._category_index = {c: i for i, c in enumerate(self.categories)}
+
+    def has_category(self, category) -> bool:
+        return category in self._category_index
+
+    def cell_key(self, days, total_price):
+        """(days bucket, price bucket): ίδιο κελί → ίδια πρόβλεψη."""
+        return value_cell(self.days_edges, days), value_cell(self.price_edges, total_price)
+
+    def lookup(self, category, days, total_price, extra_insurance):
+        """Πιθανότητες ανά κλάση (σειρά self.classes) ή None για άγνωστη κατηγορία."""
+        cat = self._category_index.get(category)
+        if cat is None:
+            return None
+        d = value_cell(self.days_edges, days)
+        p = value_cell(self.price_edges, total_price)
+        return self.probas[cat, d, p, 1 if extra_insurance else 0]
+
+    def lookup_many(self, categories, days, total_prices, extra_insurance) -> np.ndarray:
+        """
+        Vectorised lookup για πολλά αιτήματα. Οι κατηγορίες πρέπει να είναι
+        γνωστές (βλ. has_category). Επιστρέφει πίνακα (αιτήματα, κλάσεις).
+        """
+        cat = np.array([self._category_index[c] for c in categories], dtype=np.intp)
+        d = np.searchsorted(
+            self.days_edges, np.asarray(days, dtype=np.float32).astype(np.float64), side="left"
+        )
+        p = np.searchsorted(
+            self.price_edges, np.asarray(total_prices, dtype=np.float32).astype(np.float64), side="left"
+        )
+        ins = (np.asarray(extra_insurance) != 0).astype(np.intp)
+        return self.probas[cat, d, p, ins]
+
+    def ranked_ids(self, category, days, total_price, extra_insurance) -> list:
+        """Car ids με πιθανότητα > 0, από την πιο πιθανή προς τη λιγότερο πιθανή."""
+        probas = self.lookup(category, days, total_price, extra_insurance)
+        if probas is None:
+            return []
+        order = np.argsort(-probas, kind="stable")
+        order = order[probas[order] > 0]
+        return self.classes[order].tolist()
+
+    def to_dict(self) -> dict:
+        return {
+            "categories": np.asarray(self.categories),
+            "days_edges": self.days_edges,
+            "price_edges": self.price_edges,
+            "probas": self.probas,
+            "classes": self.classes,
+            "exact": self.exact,
+        }
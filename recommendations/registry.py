@@ -0,0 +1,170 @@
+"""
+Process-wide registry με τα φορτωμένα artifacts ανά εταιρεία:
+το (model, category_encoder), ο προϋπολογισμένος RankingTable και το
+FlatForest για inference χωρίς sklearn.
+
+Το rank_cars καλείται σε κάθε αναζήτηση του select_car· αντί να κάνουμε
+joblib.load σε κάθε request, κρατάμε τα μοντέλα στη μνήμη του worker και
+τα ξαναφορτώνουμε μόνο όταν αλλάξει το αρχείο στο δίσκο. Η διαδρομή βγαίνει
+από το manifest της εταιρείας (artifacts.py): μια νέα έκδοση ή ένα rollback
+αλλάζει το αρχείο, οπότε τα workers την παίρνουν στο επόμενο request.
+Όταν ξεπεραστεί το όριο (πλήθος ή bytes) πετάμε το λιγότερο πρόσφατα
+χρησιμοποιημένο (LRU).
+
+Τα artifacts φορτώνονται με ``mmap_mode="r"``: τα numpy arrays (π.χ. ο
+RankingTable) δεν αντιγράφονται στη μνήμη κάθε worker αλλά διαβάζονται από
+το page cache, μία φορά ανά μηχάνημα. Προσοχή: τα δέντρα του sklearn
+αντιγράφουν τους πίνακές τους κατά το unpickle, οπότε το ίδιο το
+RandomForest παραμένει ιδιωτικό ανά worker.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import joblib
+from django.conf import settings
+
+from .artifacts import forest_path, model_path, table_path
+from .flat_forest import FlatForest
+from .ranking_table import RankingTable
+
+DEFAULT_MAX_MODELS = 32
+
+
+
+def load_artifact(path):
+    mmap_mode = "r" if getattr(settings, "RECOMMENDATION_MMAP_ARTIFACTS", True) else None
+    return joblib.load(path, mmap_mode=mmap_mode)
+
+
+# kind -> (διαδρομή αρχείου, loader)
+ARTIFACTS = {
+    "model": (model_path, load_artifact),
+    "table": (table_path, lambda path: RankingTable(load_artifact(path))),
+    "forest": (forest_path, lambda path: FlatForest(load_artifact(path))),
+}
+
+
+class _Entry:
+    __slots__ = ("value", "stamp", "size")
+
+    def __init__(self, value, stamp, size):
+        self.value = value
+        self.stamp = stamp
+        self.size = size
+
+
+class ModelRegistry:
+    """
+    LRU cache artifacts ανά (εταιρεία, kind).
+
+    max_models: μέγιστο πλήθος φορτωμένων artifacts (None/0 = χωρίς όριο).
+    max_bytes: όριο μνήμης, με εκτίμηση από το μέγεθος του αρχείου στο δίσκο
+               (None/0 = χωρίς όριο). Το πιο πρόσφατο μοντέλο μένει πάντα.
+    """
+
+    def __init__(self, max_models=None, max_bytes=None):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def stamp(self, company_id, kind="model"):
+        """Έκδοση του αρχείου στο δίσκο (mtime_ns, size, inode) ή None αν δεν υπάρχει."""
+        path_for, _ = ARTIFACTS[kind]
+        return self._stat(path_for(company_id))
+
+    def get(self, company_id, kind="model"):
+        """
+        kind="model": επιστρέφει (model, category_encoder).
+        kind="table": επιστρέφει RankingTable.
+        kind="forest": επιστρέφει FlatForest.
+        None αν δεν υπάρχει το αρχείο. Σφάλματα φόρτωσης περνάνε στον caller
+        (το rank_cars κάνει fallback).
+        """
+        path_for, loader = ARTIFACTS[kind]
+        path = path_for(company_id)
+        key = (company_id, kind)
+        stamp = self._stat(path)
+        if stamp is None:
+            with self._lock:
+                self._entries.pop(key, None)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.stamp == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.value
+            self.misses += 1
+
+        # Φόρτωση έξω από το lock ώστε να μην περιμένουν οι άλλες εταιρείες.
+        value = loader(path)
+
+        with self._lock:
+            self._entries[key] = _Entry(value, stamp, stamp[1])
+            self._entries.move_to_end(key)
+            self._evict()
+        return value
+
+    def _evict(self):
+        while len(self._entries) > 1:
+            over_count = self.max_models and len(self._entries) > self.max_models
+            over_bytes = self.max_bytes and self.total_bytes() > self.max_bytes
+            if not (over_count or over_bytes):
+                break
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def total_bytes(self) -> int:
+        return sum(e.size for e in self._entries.values())
+
+    def invalidate(self, company_id=None):
+        """Πετάει τα artifacts μιας εταιρείας (ή όλα αν company_id=None)."""
+        with self._lock:
+            if company_id is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == company_id]:
+                del self._entries[key]
+
+    def __contains__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, "model")
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def loaded(self):
+        """[(company_id, kind, path)] για όσα artifacts είναι φορτωμένα."""
+        with self._lock:
+            keys = list(self._entries)
+        return [(company_id, kind, ARTIFACTS[kind][0](company_id)) for company_id, kind in keys]
+
+    def stats(self) -> dict:
+        return {
+            "models": len(self._entries),
+            "bytes": self.total_bytes(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+model_registry = ModelRegistry(
+    max_models=getattr(settings, "RECOMMENDATION_MODEL_CACHE_SIZE", DEFAULT_MAX_MODELS),
+    max_bytes=getattr(settings, "RECOMMENDATION_MODEL_CACHE_BYTES", None),
+)
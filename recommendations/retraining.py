@@ -0,0 +1,310 @@
+"""
+Retraining πολλών εταιρειών: ποιες χρειάζονται training (ένα query για όλες)
+και εκτέλεση του train_model σε worker processes.
+
+Το RetrainScheduler κάνει το ίδιο αυτόματα από τις αποφάσεις του choose_car:
+μετρητής pending_samples ανά εταιρεία και debounced retrain στο background
+όταν περάσει το όριο ή η ηλικία, με το πολύ ένα ανά εταιρεία και συνολικό
+όριο ταυτόχρονων (claim στη βάση, άρα ισχύει και ανάμεσα σε web processes).
+
+Οι συναρτήσεις των workers είναι σε επίπεδο module ώστε να γίνονται pickle
+για το ProcessPoolExecutor (spawn context: κάθε worker κάνει δικό του
+django.setup() και ανοίγει δική του σύνδεση στη βάση).
+"""
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from multiprocessing import get_context
+
+
+def companies_with_new_samples():
+    """
+    Όλες οι εταιρείες με annotation new_samples: αποφάσεις με chosen_car μετά
+    το last_trained (ή όλες αν δεν έχουν εκπαιδευτεί ποτέ). Ένα grouped query
+    αντί για ένα count() ανά εταιρεία.
+    """
+    from django.db.models import Count, F, Q
+
+    from rentals.models import Company
+
+    new_decision = Q(rentalrequest__rentaldecision__chosen_car__isnull=False) & (
+        Q(last_trained__isnull=True) | Q(rentalrequest__rentaldecision__decided_at__gt=F("last_trained"))
+    )
+    return (
+        Company.objects.select_related("user")
+        .annotate(new_samples=Count("rentalrequest__rentaldecision", filter=new_decision))
+        .order_by("id")
+    )
+
+
+def init_worker():
+    """Initializer του process pool."""
+    # Τα workers δεν πρέπει να ξεκινήσουν δικό τους email importer.
+    os.environ["DISABLE_EMAIL_AUTO_IMPORT"] = "1"
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    import django
+
+    django.setup()
+
+
+def retrain_company(username, incremental=True):
+    """
+    Τρέχει το train_model για μία εταιρεία. Δεν πετάει exceptions·
+    επιστρέφει dict με username, ok, seconds, output, error.
+    """
+    from django.core.management import call_command
+    from django.db import close_old_connections
+
+    out = StringIO()
+    started = time.perf_counter()
+    try:
+        call_command("train_model", username, incremental=incremental, stdout=out)
+        ok, error = True, ""
+    except Exception as e:
+        ok, error = False, f"{e}\n{traceback.format_exc()}"
+    finally:
+        close_old_connections()
+    return {
+        "username": username,
+        "ok": ok,
+        "seconds": time.perf_counter() - started,
+        "output": out.getvalue(),
+        "error": error,
+    }
+
+
+def _setting(name, default):
+    from django.conf import settings
+
+    return getattr(settings, name, default)
+
+
+def claim_retrain(company_id, limit=None):
+    """
+    Claim του retrain μιας εταιρείας με ένα conditional UPDATE (ελεύθερο ή
+    παλαιότερο από το RECOMMENDATION_RETRAIN_TIMEOUT), άρα ένα μόνο process το
+    παίρνει. Με limit: αν μετά το claim τρέχουν περισσότερα από limit retrains,
+    το claim αφήνεται. Επιστρέφει την ώρα του claim ή None.
+    """
+    from django.db.models import Q
+    from django.utils import timezone
+
+    from rentals.models import Company
+
+    now = timezone.now()
+    stale = now - timedelta(seconds=_setting("RECOMMENDATION_RETRAIN_TIMEOUT", 3600))
+    free = Q(retrain_started_at__isnull=True) | Q(retrain_started_at__lte=stale)
+    if not Company.objects.filter(free, id=company_id).update(retrain_started_at=now):
+        return None
+    # Claim πρώτα, μέτρηση μετά: δύο ταυτόχρονα claims βλέπουν και τα δύο το ένα
+    # το άλλο, οπότε το όριο δεν ξεπερνιέται ποτέ (στη χειρότερη αφήνουν και τα δύο).
+    if limit is not None and Company.objects.filter(retrain_started_at__gt=stale).count() > limit:
+        release_retrain(company_id, now)
+        return None
+    return now
+
+
+def release_retrain(company_id, claimed_at, **updates):
+    """Αφήνει το claim, μόνο αν είναι ακόμα αυτό (όχι αν το πήρε άλλος μετά από timeout)."""
+    from rentals.models import Company
+
+    Company.objects.filter(id=company_id, retrain_started_at=claimed_at).update(
+        retrain_started_at=None, **updates
+    )
+
+
+class RetrainScheduler:
+    """
+    Debounced retrain στο background. Το web request κάνει μόνο ένα UPDATE
+    του μετρητή (note_decision)· το training τρέχει σε process pool.
+
+    job / executor_factory αλλάζουν μόνο στα tests (π.χ. ThreadPoolExecutor).
+    """
+
+    def __init__(self, job=retrain_company, executor_factory=None):
+        self.job = job
+        self.executor_factory = executor_factory or self._process_pool
+        self._lock = threading.Lock()
+        self._timers = {}  # company_id -> Timer που περιμένει το debounce
+        self._running = set()  # company_ids με retrain σε εξέλιξη από αυτό το process
+        self._executor = None
+        self._sweeper = None
+
+    @property
+    def enabled(self):
+        return _setting("RECOMMENDATION_AUTO_RETRAIN", True)
+
+    @staticmethod
+    def _process_pool():
+        workers = _setting("RECOMMENDATION_RETRAIN_CONCURRENCY", 1)
+        return ProcessPoolExecutor(max_workers=max(workers, 1), mp_context=get_context("spawn"),
+                                   initializer=init_worker)
+
+    # ---------- μετρητής ----------
+
+    def note_decision(self, company_id):
+        """Μία νέα απόφαση της εταιρείας· προγραμματίζει retrain αν έφτασε το όριο."""
+        if not self.enabled:
+            return
+        from django.db.models import F, Value
+        from django.db.models.functions import Coalesce
+        from django.utils import timezone
+
+        from rentals.models import Company
+
+        Company.objects.filter(id=company_id).update(
+            pending_samples=F("pending_samples") + 1,
+            pending_since=Coalesce("pending_since", Value(timezone.now())),
+        )
+        if self.is_due(company_id):
+            self.schedule(company_id)
+        self._start_sweeper()
+
+    @staticmethod
+    def due_companies():
+        """Εταιρείες με αρκετά ή αρκετά παλιά pending samples."""
+        from django.db.models import Q
+        from django.utils import timezone
+
+        from rentals.models import Company
+
+        oldest = timezone.now() - timedelta(seconds=_setting("RECOMMENDATION_RETRAIN_MAX_AGE", 3600))
+        return Company.objects.filter(pending_samples__gt=0).filter(
+            Q(pending_samples__gte=_setting("RECOMMENDATION_RETRAIN_THRESHOLD", 50))
+            | Q(pending_since__lte=oldest)
+        )
+
+    def is_due(self, company_id):
+        return self.due_companies().filter(id=company_id).exists()
+
+    # ---------- προγραμματισμός ----------
+
+    def schedule(self, company_id, delay=None):
+        """Debounce: ένας timer ανά εταιρεία· όσες αποφάσεις έρθουν μέχρι να λήξει μπαίνουν στο ίδιο retrain."""
+        with self._lock:
+            if company_id not in self._timers and company_id not in self._running:
+                self._arm(company_id, delay)
+
+    def _arm(self, company_id, delay=None):
+        # Καλείται με το self._lock.
+        if delay is None:
+            delay = _setting("RECOMMENDATION_RETRAIN_DEBOUNCE", 30)
+        timer = threading.Timer(delay, self._fire, args=(company_id,))
+        timer.daemon = True
+        self._timers[company_id] = timer
+        timer.start()
+
+    def sweep(self):
+        """Προγραμματίζει όσες εταιρείες έφτασαν το όριο ηλικίας χωρίς νέα απόφαση."""
+        for company_id in self.due_companies().values_list("id", flat=True):
+            self.schedule(company_id)
+
+    def _start_sweeper(self):
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_forever, name="retrain-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def _sweep_forever(self):
+        from django.db import close_old_connections
+
+        interval = max(_setting("RECOMMENDATION_RETRAIN_MAX_AGE", 3600) / 4, 1)
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception:
+                traceback.print_exc()
+            finally:
+                close_old_connections()
+
+    # ---------- εκτέλεση ----------
+
+    def _fire(self, company_id):
+        from django.db import close_old_connections
+
+        retry = False
+        try:
+            retry = self.is_due(company_id) and not self._start(company_id)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            close_old_connections()
+        with self._lock:
+            # Ο timer φεύγει μόνο τώρα, ώστε να μη μπει δεύτερος όσο γίνεται το claim
+            # (αν δεν τον αντικατέστησε ήδη το _finished ενός πολύ σύντομου retrain).
+            if self._timers.get(company_id) is threading.current_thread():
+                del self._timers[company_id]
+            if retry:
+                # Όριο ταυτόχρονων ή τρέχει ήδη (ίσως σε άλλο process): ξαναδοκιμάζει αργότερα.
+                self._arm(company_id)
+
+    def _start(self, company_id):
+        """Claim και υποβολή στο pool· False αν δεν πήρε claim."""
+        from rentals.models import Company
+
+        now = claim_retrain(company_id, limit=_setting("RECOMMENDATION_RETRAIN_CONCURRENCY", 1))
+        if now is None:
+            return False
+
+        company = Company.objects.select_related("user").get(id=company_id)
+        with self._lock:
+            self._running.add(company_id)
+            if self._executor is None:
+                self._executor = self.executor_factory()
+            future = self._executor.submit(self.job, company.user.username, True)
+        future.add_done_callback(lambda f: self._finished(company_id, company.pending_samples, now, f))
+        return True
+
+    def _finished(self, company_id, snapshot, claimed_at, future):
+        """Απελευθερώνει το claim· μετά από επιτυχία αφαιρεί από τον μετρητή όσα είδε το training."""
+        from django.db import close_old_connections
+        from django.db.models import Case, F, Value, When
+        from django.db.models.functions import Greatest
+
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {"ok": False, "error": str(e)}
+        try:
+            updates = {}
+            if result["ok"]:
+                # pending_since πρώτο: στο MySQL το SET βλέπει τις τιμές που άλλαξαν ήδη.
+                updates = {
+                    "pending_since": Case(When(pending_samples__gt=snapshot, then=Value(claimed_at)), default=None),
+                    "pending_samples": Greatest(F("pending_samples") - snapshot, 0),
+                }
+            else:
+                print(f"❌ Αυτόματο retrain εταιρείας {company_id}: {result['error']}")
+            release_retrain(company_id, claimed_at, **updates)
+            again = result["ok"] and self.is_due(company_id)
+        except Exception:
+            traceback.print_exc()
+            again = False
+        finally:
+            close_old_connections()
+        with self._lock:
+            self._running.discard(company_id)
+            if again and company_id not in self._timers:
+                self._arm(company_id)
+
+    def shutdown(self):
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+retrain_scheduler = RetrainScheduler()
+
+
+def note_decision(company_id):
+    retrain_scheduler.note_decision(company_id)
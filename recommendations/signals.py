@@ -0,0 +1,59 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from rentals.models import Car
+
+from . import feature_store
+from .models import RentalDecision, RentalRequest
+
+REQUEST_FEATURE_FIELDS = {
+    "company", "company_id", "days", "total_price", "extra_insurance", "requested_category", "created_at",
+}
+
+
+@receiver(post_save, sender=RentalDecision)
+def decision_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Κάθε επιλογή οχήματος γράφεται στο feature store (μετά το commit).
+    if not feature_store.enabled():
+        return
+    if created and instance.chosen_car_id is None:
+        return  # κενή απόφαση (νέο αίτημα)
+    if update_fields is not None and "chosen_car" not in update_fields:
+        return
+    req = instance.request
+    record = feature_store.record(
+        instance.id, instance.decided_at, req.days, req.total_price,
+        req.extra_insurance, req.requested_category, instance.chosen_car_id,
+    )
+    transaction.on_commit(lambda: feature_store.append(req.company_id, record))
+
+
+@receiver(post_save, sender=RentalRequest)
+def request_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Ένα νέο αίτημα δεν έχει ακόμα απόφαση· μια αλλαγή σε υπάρχον αλλάζει τα
+    # features των εγγραφών του στο store: ξαναχτίζεται από τη βάση.
+    if created or not feature_store.enabled():
+        return
+    if update_fields is not None and not set(update_fields) & REQUEST_FEATURE_FIELDS:
+        return
+    company_id = instance.company_id
+    transaction.on_commit(lambda: feature_store.invalidate(company_id))
+
+
+@receiver(pre_delete, sender=RentalDecision)
+def decision_deleted(sender, instance, **kwargs):
+    if not feature_store.enabled() or instance.chosen_car_id is None:
+        return
+    company_id = RentalRequest.objects.filter(id=instance.request_id).values_list("company_id", flat=True).first()
+    if company_id is not None:
+        record = feature_store.tombstone(instance.id)
+        transaction.on_commit(lambda: feature_store.append(company_id, record))
+
+
+@receiver(post_delete, sender=Car)
+def car_deleted(sender, instance, **kwargs):
+    # Το SET_NULL στο chosen_car γίνεται με update χωρίς signals: το store
+    # της εταιρείας ξαναχτίζεται από τη βάση στο επόμενο training.
+    if feature_store.enabled():
+        transaction.on_commit(lambda: feature_store.invalidate(instance.company_id))
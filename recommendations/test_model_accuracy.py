@@ -1,11 +1,12 @@
 import joblib
-from sklearn.metrics import accuracy_score
 from django.contrib.auth.models import User
-from rentals.models import Company, Car
-from recommendations.models import RentalRequest, RentalDecision
+from rentals.models import Company
+from recommendations.artifacts import model_path
+from recommendations.evaluation import DEFAULT_TOP_K, evaluate
+from recommendations.ml_training import company_dataset
 
 
-def test_model_accuracy(company_username):
+def test_model_accuracy(company_username, ks=DEFAULT_TOP_K):
     try:
         user = User.objects.get(username=company_username)
         company = Company.objects.get(user=user)
@@ -13,49 +14,20 @@ def test_model_accuracy(company_username):
         print(f"❌ Η εταιρεία με username '{company_username}' δεν βρέθηκε.")
         return
 
-    model_path = f"model_company_{company.id}.joblib"
     try:
-        model, category_encoder = joblib.load(model_path)
+        model, category_encoder = joblib.load(model_path(company.id))
     except:
         print(f"❌ Δεν βρέθηκε ή δεν φορτώθηκε το μοντέλο για την εταιρεία '{company.name}'.")
         return
 
-    decisions = RentalDecision.objects.select_related("request", "chosen_car")\
-        .filter(request__company=company, chosen_car__isnull=False)
-
-    y_true, y_pred = [], []
-
-    for decision in decisions:
-        req = decision.request
-        car = decision.chosen_car
-
-        if req.requested_category not in category_encoder.classes_:
-            continue
-
-        try:
-            cat_encoded = category_encoder.transform([req.requested_category])[0]
-        except:
-            continue
-
-        features = [
-            req.days,
-            float(req.total_price),
-            int(req.extra_insurance),
-            cat_encoded,
-        ]
-
-        try:
-            probas = model.predict_proba([features])[0]
-            predicted_car_id = model.classes_[probas.argmax()]
-        except:
-            continue
-
-        y_true.append(car.id)
-        y_pred.append(predicted_car_id)
-
-    if not y_true:
+    # Όλες οι αποφάσεις σε έναν πίνακα και μία κλήση predict_proba.
+    df = company_dataset(company)
+    result = evaluate(model, category_encoder, df, ks=ks)
+    if not len(result["rows"]):
         print("⚠️ Δεν υπάρχουν επαρκή δεδομένα για αξιολόγηση του μοντέλου.")
         return
 
-    accuracy = accuracy_score(y_true, y_pred)
+    accuracy = float((result["rows"]["rank"] == 0).mean())
     print(f"✅ Ποσοστό επιτυχίας του AI μοντέλου για '{company.name}': {accuracy:.2%}")
+    print("   " + " | ".join(f"top-{k}: {rate:.2%}" for k, rate in result["top_k"].items()))
+    return result
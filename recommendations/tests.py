@@ -1,3 +1,801 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from rentals.models import Car, Company
+from rentals.utils import (
+    _predict_many,
+    rank_available_car_ids,
+    rank_available_cars,
+    rank_cars,
+    rank_cars_batch,
+    suggest_cars,
+)
+
+from . import artifacts
+from .artifacts import forest_path, model_path, table_path
+from . import feature_store
+from .dataset import stream_decision_columns
+from .evaluation import evaluate, fleet_rank, true_class_rank
+from .fleet_scorer import FleetScorer
+from .management.commands.benchmark_ranking import legacy_order, synthetic_fleet
+from .ml_training import (
+    FEATURES,
+    build_ranking_table,
+    export_flat_forest,
+    load_model,
+    save_model,
+    train_model,
+    update_model,
+)
+from .models import RentalDecision, RentalRequest
+from .ranking_cache import ranking_cache
+from .registry import ModelRegistry, model_registry
+from .retraining import (
+    RetrainScheduler,
+    claim_retrain,
+    companies_with_new_samples,
+    release_retrain,
+    retrain_company,
+)
+
+
+def _sample_df():
+    rows = []
+    for i in range(40):
+        rows.append({
+            "days": 1 + i % 7,
+            "total_price": 30.0 + 10 * (i % 5),
+            "extra_insurance": i % 2,
+            "requested_category": ["small", "medium", "compact"][i % 3],
+            "car_id": 1 + i % 4,
+        })
+    return pd.DataFrame(rows)
+
+
+class TmpCwdMixin:
+    """Τα artifacts γράφονται στο cwd — κάθε test τρέχει σε δικό του φάκελο."""
+
+    def setUp(self):
+        super().setUp()
+        self._old_cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        model_registry.invalidate()
+
+    def tearDown(self):
+        os.chdir(self._old_cwd)
+        self._tmp.cleanup()
+        super().tearDown()
+
+
+class ModelRegistryTests(TmpCwdMixin, SimpleTestCase):
+    def test_loads_once_and_reloads_on_change(self):
+        model, encoder = train_model(_sample_df())
+        save_model(model, encoder, 1)
+
+        registry = ModelRegistry()
+        first = registry.get(1)
+        self.assertIs(registry.get(1), first)
+        self.assertEqual(registry.misses, 1)
+        self.assertEqual(registry.hits, 1)
+
+        path = model_path(1)
+        save_model(model, encoder, 1)
+        self.assertNotEqual(model_path(1), path)  # νέα έκδοση
+        self.assertIsNot(registry.get(1), first)
+        self.assertEqual(registry.misses, 2)
+
+    def test_table_is_memory_mapped(self):
+        model, encoder = train_model(_sample_df())
+        save_model(model, encoder, 1)
+        table = ModelRegistry().get(1, "table")
+        self.assertIsInstance(table.probas, np.memmap)
+
+    def test_missing_model_returns_none(self):
+        self.assertIsNone(ModelRegistry().get(99))
+
+    def test_lru_eviction(self):
+        model, encoder = train_model(_sample_df())
+        for company_id in (1, 2, 3):
+            save_model(model, encoder, company_id)
+
+        registry = ModelRegistry(max_models=2)
+        registry.get(1)
+        registry.get(2)
+        registry.get(1)
+        registry.get(3)
+        self.assertIn(1, registry)
+        self.assertNotIn(2, registry)
+        self.assertEqual(registry.evictions, 1)
+
+
+class ArtifactStoreTests(TmpCwdMixin, SimpleTestCase):
+    def test_versions_retention_and_rollback(self):
+        model, encoder = train_model(_sample_df())
+        with self.settings(RECOMMENDATION_MODEL_KEEP_VERSIONS=2):
+            for _ in range(3):
+                save_model(model, encoder, 1)
+        self.assertEqual([v["version"] for v in artifacts.versions(1)], [2, 3])
+        self.assertFalse(os.path.exists(artifacts.version_dir(1, 1)))
+        self.assertTrue(model_path(1).endswith(os.path.join("company_1", "v3", "model.joblib")))
+
+        registry = ModelRegistry()
+        registry.get(1, "table")
+        self.assertEqual(artifacts.rollback(1), 2)
+        self.assertEqual(registry.stamp(1, "table")[2], os.stat(table_path(1)).st_ino)
+        self.assertTrue(table_path(1).startswith(artifacts.version_dir(1, 2)))
+        registry.get(1, "table")
+        self.assertEqual(registry.misses, 2)
+        with self.assertRaises(ValueError):
+            artifacts.rollback(1)
+
+    def test_orphan_version_dir_does_not_block_publish(self):
+        model, encoder = train_model(_sample_df())
+        save_model(model, encoder, 1)
+        # publish που έπεσε μετά το rename και πριν γράψει το manifest
+        os.makedirs(artifacts.version_dir(1, 2))
+        self.assertEqual(save_model(model, encoder, 1), 3)
+        self.assertEqual(artifacts.current_version(1), 3)
+        self.assertFalse(os.path.exists(artifacts.version_dir(1, 2)))
+        self.assertEqual([v["version"] for v in artifacts.versions(1)], [1, 3])
+
+    def test_save_model_returns_its_own_version(self):
+        model, encoder = train_model(_sample_df())
+        publish = artifacts.publish
+
+        def publish_then_another(company_id, directory, keep=None):
+            # Άλλο publish αμέσως μετά: το save_model δεν διαβάζει το current_version.
+            version = publish(company_id, directory, keep)
+            other = os.path.join(artifacts.company_dir(company_id), ".other")
+            os.makedirs(other)
+            publish(company_id, other, keep)
+            return version
+
+        with mock.patch("recommendations.artifacts.publish", publish_then_another):
+            self.assertEqual(save_model(model, encoder, 1), 1)
+        self.assertEqual(artifacts.current_version(1), 2)
+
+    def test_failed_write_keeps_current_version(self):
+        model, encoder = train_model(_sample_df())
+        save_model(model, encoder, 1)
+        with mock.patch("recommendations.ml_training.joblib.dump", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                save_model(model, encoder, 1)
+        self.assertEqual(artifacts.current_version(1), 1)
+        self.assertEqual(
+            sorted(n for n in os.listdir(artifacts.company_dir(1)) if n != ".lock"),
+            ["manifest.json", "v1"],
+        )
+        self.assertIsNotNone(load_model(1))
+
+
+class RankingTableTests(SimpleTestCase):
+    def test_exact_table_matches_model(self):
+        model, encoder = train_model(_sample_df())
+        table = build_ranking_table(model, encoder)
+        self.assertTrue(table.exact)
+
+        rng = np.random.default_rng(0)
+        for _ in range(50):
+            days = int(rng.integers(1, 15))
+            price = float(rng.uniform(0, 120))
+            insurance = int(rng.integers(0, 2))
+            category = str(rng.choice(encoder.classes_))
+            X = pd.DataFrame(
+                [[days, price, insurance, encoder.transform([category])[0]]],
+                columns=FEATURES,
+            )
+            expected = model.predict_proba(X)[0]
+            np.testing.assert_allclose(
+                table.lookup(category, days, price, insurance), expected, atol=1e-6
+            )
+
+    def test_approximate_table(self):
+        model, encoder = train_model(_sample_df())
+        table = build_ranking_table(model, encoder, max_edges=2)
+        self.assertFalse(table.exact)
+        self.assertLessEqual(len(table.price_edges), 2)
+        self.assertIsNone(table.lookup("luxury", 1, 50.0, 0))
+
+
+class FlatForestTests(SimpleTestCase):
+    def test_matches_sklearn_probabilities(self):
+        model, encoder = train_model(_sample_df())
+        forest = export_flat_forest(model, encoder)
+
+        rng = np.random.default_rng(0)
+        X = np.column_stack([
+            rng.integers(1, 15, 100),
+            rng.uniform(0, 120, 100),
+            rng.integers(0, 2, 100),
+            rng.integers(0, len(encoder.classes_), 100),
+        ])
+        expected = model.predict_proba(pd.DataFrame(X, columns=FEATURES))
+        np.testing.assert_allclose(forest.predict_proba(X), expected)
+        for row, probas in zip(X, expected):
+            np.testing.assert_allclose(forest.predict_proba_one(row), probas)
+        self.assertEqual(forest.encode_category("medium"), encoder.transform(["medium"])[0])
+        self.assertIsNone(forest.encode_category("luxury"))
+
+class FleetScorerTests(SimpleTestCase):
+    def test_matches_legacy_order(self):
+        cars, probas, class_ids = synthetic_fleet(500)
+        scorer = FleetScorer.from_cars(cars)
+        for category in ("small", "compact", "luxury"):
+            self.assertEqual(
+                [c.id for c in scorer.ranked_items(category, probas, class_ids)],
+                [c.id for c in legacy_order(cars, category, probas, class_ids)],
+            )
+
+    def test_from_values_matches_from_cars(self):
+        cars, probas, class_ids = synthetic_fleet(200, seed=1)
+        rows = [{"id": c.id, "category": c.category, "brand": c.brand, "model": c.model} for c in cars]
+        self.assertEqual(
+            FleetScorer.from_values(rows).ranked_ids("medium", probas, class_ids),
+            FleetScorer.from_cars(cars).ranked_ids("medium", probas, class_ids),
+        )
+
+
+class FleetFixtureMixin(TmpCwdMixin):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user(username="acme", password="pass123")
+        self.company = Company.objects.create(user=user, name="Acme", email="acme@example.com")
+        for i in range(1, 7):
+            Car.objects.create(
+                id=i, company=self.company, brand=f"Brand{i % 3}", model=f"M{i}",
+                category=["small", "medium", "compact"][i % 3],
+            )
+        model, encoder = train_model(_sample_df())
+        save_model(model, encoder, self.company.id)
+        self.requests = [
+            {"category": "small", "days": 3, "total_price": 40, "extra_insurance": True},
+            {"category": "medium", "days": 30, "total_price": 900, "extra_insurance": False},
+            {"category": "luxury", "days": 2, "total_price": 50},
+        ]
+
+
+class RankCarsBatchTests(FleetFixtureMixin, TestCase):
+    def test_batch_matches_single(self):
+        cars = Car.objects.filter(company=self.company)
+        batch = rank_cars_batch(self.company.id, self.requests, cars)
+        for request_filters, ranking in zip(self.requests, batch):
+            self.assertEqual(ranking, rank_cars(request_filters, cars, self.company.id))
+
+    def test_single_model_call_for_live_inference(self):
+        # Χωρίς πίνακα όλα τα αιτήματα πάνε σε live inference — με μία κλήση.
+        os.remove(table_path(self.company.id))
+        forest = model_registry.get(self.company.id, "forest")
+        with mock.patch.object(forest, "predict_proba", wraps=forest.predict_proba) as predict:
+            rankings = rank_cars_batch(
+                self.company.id, self.requests, Car.objects.filter(company=self.company)
+            )
+        self.assertEqual(predict.call_count, 1)
+        self.assertEqual(len(predict.call_args[0][0]), 2)
+        self.assertEqual(len(rankings), 3)
+
+    def _bookings(self):
+        from rentals.models import Booking
+
+        return [
+            Booking.objects.create(
+                company=self.company, requested_category=r["category"], total_price=r["total_price"],
+                start_date=date(2025, 7, 1 + i),
+            )
+            for i, r in enumerate(self.requests)
+        ]
+
+    def test_suggest_cars_ranks_in_one_batch(self):
+        bookings = self._bookings()
+        with mock.patch("rentals.utils.rank_cars_batch", wraps=rank_cars_batch) as batch:
+            suggestions = suggest_cars(bookings)
+        self.assertEqual(batch.call_count, 1)
+        self.assertEqual(len(batch.call_args[0][1]), 3)
+        # Κάθε κράτηση παίρνει διαφορετικό όχημα· καμία δεν αλλάζει.
+        self.assertEqual([b for b, _ in suggestions], bookings)
+        self.assertEqual(len({car.id for _, car in suggestions}), 3)
+        self.assertTrue(all(b.chosen_car_id is None for b in bookings))
+
+    def test_booking_conversion_does_not_assign_cars(self):
+        from rentals.models import Booking
+
+        converted = Booking.to_rental_requests(self._bookings())
+        self.assertEqual(RentalRequest.objects.filter(company=self.company).count(), 3)
+        self.assertTrue(all(dec.chosen_car_id is None for _, dec in converted))
+        self.assertFalse(Booking.objects.filter(chosen_car__isnull=False).exists())
+
+    def test_bookings_list_suggests_distinct_cars(self):
+        bookings = self._bookings() + self._bookings()
+        self.client.force_login(self.company.user)
+        response = self.client.get("/rentals/bookings/")
+        suggested = [b.suggested_car.id for b in response.context["bookings"] if getattr(b, "suggested_car", None)]
+        self.assertEqual(len(suggested), len(bookings))
+        self.assertEqual(len(set(suggested)), len(suggested))
+
+    def test_rankings_match_model_on_dense_price_grid(self):
+        # Συνεχείς τιμές: πολύ περισσότερα thresholds από το RECOMMENDATION_TABLE_MAX_EDGES.
+        rng = np.random.default_rng(1)
+        df = pd.DataFrame({
+            "days": rng.integers(1, 30, 400),
+            "total_price": rng.uniform(20, 900, 400).round(2),
+            "extra_insurance": rng.integers(0, 2, 400),
+            "requested_category": rng.choice(["small", "medium", "compact"], 400),
+            "car_id": rng.integers(1, 7, 400),
+        })
+        model, encoder = train_model(df)
+        save_model(model, encoder, self.company.id)
+        model_registry.invalidate()
+        self.assertFalse(model_registry.get(self.company.id, "table").exact)
+
+        prices = np.linspace(0, 1000, 501)
+        features = [
+            (category, days, float(price), insurance)
+            for category in encoder.classes_ for days in (1, 7, 20) for price in prices for insurance in (0, 1)
+        ]
+        X = pd.DataFrame(
+            [[d, p, i, encoder.transform([c])[0]] for c, d, p, i in features], columns=FEATURES,
+        )
+        expected = model.predict_proba(X)
+        for (probas, class_ids), row in zip(_predict_many(self.company.id, features), expected):
+            np.testing.assert_array_equal(class_ids, model.classes_)
+            np.testing.assert_allclose(probas, row, atol=1e-9)
+
+    def test_sklearn_fallback_for_old_artifacts(self):
+        cars = Car.objects.filter(company=self.company)
+        expected = rank_cars_batch(self.company.id, self.requests, cars)
+        os.remove(table_path(self.company.id))
+        os.remove(forest_path(self.company.id))
+        self.assertEqual(rank_cars_batch(self.company.id, self.requests, cars), expected)
+
+
+class RankingCacheTests(FleetFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        ranking_cache.invalidate()
+
+    def test_hit_skips_inference(self):
+        request_filters = self.requests[0]
+        first = rank_available_cars(request_filters, self.company.id)
+        hits = ranking_cache.hits
+        # fleet_version και διαθέσιμα οχήματα· χωρίς μοντέλο.
+        with self.assertNumQueries(2), mock.patch("rentals.utils._predict_many") as predict:
+            self.assertEqual(rank_available_cars(request_filters, self.company.id), first)
+        predict.assert_not_called()
+        self.assertEqual(ranking_cache.hits, hits + 1)
+
+    def test_changes_from_other_workers_are_seen(self):
+        request_filters = self.requests[0]
+        first = rank_available_cars(request_filters, self.company.id)
+        car_ids, _ = rank_available_car_ids(request_filters, self.company.id)
+
+        # Ενοικίαση σε άλλο worker: το δικό μας LRU δεν ακυρώθηκε, αλλά σε hit
+        # η διαθεσιμότητα ξαναδιαβάζεται.
+        Car.objects.filter(id=first[0].id).update(is_rented=True)
+        hits = ranking_cache.hits
+        self.assertEqual(rank_available_cars(request_filters, self.company.id), first[1:])
+        self.assertNotIn(first[0].id, rank_available_car_ids(request_filters, self.company.id)[0])
+        self.assertEqual(ranking_cache.hits, hits + 2)
+
+        # Νέο όχημα σε άλλο worker (εκεί το signal ανέβασε το fleet_version,
+        # εδώ το LRU δεν ακυρώθηκε): το fleet_version της βάσης αλλάζει το key.
+        Car.objects.bulk_create([Car(id=7, company=self.company, brand="Brand9", model="M7", category="small")])
+        Company.objects.filter(pk=self.company.pk).update(fleet_version=F("fleet_version") + 1)
+        self.assertIn(7, [c.id for c in rank_available_cars(request_filters, self.company.id)])
+        self.assertEqual(ranking_cache.hits, hits + 2)
+
+    def test_fleet_change_and_retrain_invalidate(self):
+        request_filters = self.requests[0]
+        rank_available_cars(request_filters, self.company.id)
+
+        car = Car.objects.get(id=1)
+        car.is_rented = True
+        car.save(update_fields=["is_rented"])
+        self.assertNotIn(car, rank_available_cars(request_filters, self.company.id))
+
+        misses = ranking_cache.misses
+        model, encoder = train_model(_sample_df())
+        save_model(model, encoder, self.company.id)
+        os.utime(table_path(self.company.id), ns=(0, 0))
+        rank_available_cars(request_filters, self.company.id)
+        self.assertEqual(ranking_cache.misses, misses + 1)
+
+
+class IncrementalTrainingTests(FleetFixtureMixin, TestCase):
+    def _decide(self, n, offset=0):
+        # execute=True: τα on_commit appends του feature store τρέχουν και μέσα σε TestCase.
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(offset, offset + n):
+                request = RentalRequest.objects.create(
+                    company=self.company,
+                    days=1 + i % 7,
+                    total_price=30 + 10 * (i % 5),
+                    extra_insurance=bool(i % 2),
+                    requested_category=["small", "medium", "compact"][i % 3],
+                )
+                RentalDecision.objects.create(request=request, chosen_car_id=1 + i % 4)
+
+    def test_update_model_adds_trees_on_same_classes(self):
+        model, encoder = train_model(_sample_df())
+        new = _sample_df().head(6)
+        full = list(model.estimators_)
+        updated, _ = update_model(model, encoder, new, n_new_trees=4, max_estimators=16)
+        self.assertEqual(len(updated.estimators_), 14)
+        self.assertEqual(updated.classes_.tolist(), [1, 2, 3, 4])
+
+        # Πάνω από το όριο φεύγουν μόνο incremental δέντρα· τα 10 του πλήρους μένουν.
+        second = update_model(updated, encoder, new, n_new_trees=4, max_estimators=16)[0]
+        self.assertEqual(len(second.estimators_), 16)
+        self.assertEqual(second.estimators_[:10], full)
+        third = update_model(second, encoder, new, n_new_trees=4, max_estimators=8)[0]
+        self.assertEqual(len(third.estimators_), 14)
+        self.assertEqual(third.estimators_[:10], full)
+
+        del third.n_full_estimators_  # μοντέλο παλιότερης έκδοσης: πλήρες training
+        self.assertIsNone(update_model(third, encoder, new))
+
+        unknown_car = new.assign(car_id=99)
+        self.assertIsNone(update_model(updated, encoder, unknown_car))
+
+    def test_incremental_command_trains_only_new_decisions(self):
+        self._decide(30)
+        call_command("train_model", "acme", incremental=True, stdout=StringIO())
+        self.company.refresh_from_db()
+        self.assertIsNotNone(self.company.last_full_trained)
+        self.assertEqual(len(load_model(self.company.id)[0].estimators_), 10)
+
+        self._decide(6, offset=30)
+        out = StringIO()
+        call_command("train_model", "acme", incremental=True, drift_threshold=1.0, stdout=out)
+        self.assertIn("Incremental training σε 6", out.getvalue())
+        self.assertEqual(len(load_model(self.company.id)[0].estimators_), 15)
+
+    def test_incremental_includes_new_decisions_on_old_requests(self):
+        self._decide(30)
+        call_command("train_model", "acme", incremental=True, stdout=StringIO())
+        self.company.refresh_from_db()
+
+        # Αιτήματα που υπήρχαν πριν το training και αποφασίστηκαν μετά.
+        with self.captureOnCommitCallbacks(execute=True):
+            old_requests = [
+                RentalRequest.objects.create(company=self.company, days=2, total_price=40, requested_category="small")
+                for _ in range(3)
+            ]
+            RentalRequest.objects.filter(id__in=[r.id for r in old_requests]).update(
+                created_at=self.company.last_trained - timedelta(days=1)
+            )
+            for request in old_requests:
+                RentalDecision.objects.create(request=request, chosen_car_id=1)
+        self.assertEqual(companies_with_new_samples().get(id=self.company.id).new_samples, 3)
+
+        out = StringIO()
+        call_command("train_model", "acme", incremental=True, drift_threshold=1.0, stdout=out)
+        self.assertIn("Incremental training σε 3", out.getvalue())
+
+    def test_safe_retrain_all_single_eligibility_query(self):
+        other = Company.objects.create(
+            user=User.objects.create_user(username="idle", password="pass123"), name="Idle", email="i@example.com",
+        )
+        self._decide(30)
+        with self.assertNumQueries(1):
+            counts = {c.id: c.new_samples for c in companies_with_new_samples()}
+        self.assertEqual(counts, {self.company.id: 30, other.id: 0})
+
+        out = StringIO()
+        call_command("safe_retrain_all", workers=1, stdout=out)
+        self.assertIn("⏭️ Skip: idle", out.getvalue())
+        self.assertIn("✅ acme:", out.getvalue())
+        self.company.refresh_from_db()
+        self.assertIsNotNone(self.company.last_trained)
+        self.assertIsNone(self.company.retrain_started_at)
+        self.assertEqual(companies_with_new_samples().get(id=self.company.id).new_samples, 0)
+
+    def test_safe_retrain_all_skips_claimed_company(self):
+        self._decide(30)
+        claimed_at = claim_retrain(self.company.id)
+        out = StringIO()
+        call_command("safe_retrain_all", workers=1, stdout=out)
+        self.assertIn("⏭️ Skip: acme (retrain σε εξέλιξη)", out.getvalue())
+        self.company.refresh_from_db()
+        self.assertIsNone(self.company.last_trained)
+        self.assertEqual(self.company.retrain_started_at, claimed_at)
+
+    def test_retrain_company_reports_failed_training(self):
+        result = retrain_company("acme", incremental=False)
+        self.assertFalse(result["ok"])
+        self.assertIn("Δεν υπάρχουν αρκετά δεδομένα", result["error"])
+
+        self.assertFalse(retrain_company("nobody")["ok"])
+
+    def test_claim_respects_concurrency_limit(self):
+        other = Company.objects.create(
+            user=User.objects.create_user(username="other", password="pass123"), name="Other", email="o@example.com",
+        )
+        claimed_at = claim_retrain(self.company.id, limit=1)
+        self.assertIsNotNone(claimed_at)
+        self.assertIsNone(claim_retrain(self.company.id, limit=1))
+        self.assertIsNone(claim_retrain(other.id, limit=1))
+        other.refresh_from_db()
+        self.assertIsNone(other.retrain_started_at)
+
+        release_retrain(self.company.id, claimed_at)
+        self.assertIsNotNone(claim_retrain(other.id, limit=1))
+
+
+@override_settings(
+    RECOMMENDATION_AUTO_RETRAIN=True,
+    RECOMMENDATION_RETRAIN_THRESHOLD=3,
+    RECOMMENDATION_RETRAIN_DEBOUNCE=0.5,
+    RECOMMENDATION_RETRAIN_CONCURRENCY=1,
+)
+class RetrainSchedulerTests(FleetFixtureMixin, TransactionTestCase):
+    """Threads βλέπουν τη βάση μόνο μετά από commit, άρα TransactionTestCase."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.company.user)
+        self.calls = []
+        self.scheduler = RetrainScheduler(job=self._job, executor_factory=lambda: ThreadPoolExecutor(1))
+        patcher = mock.patch("rentals.views.note_decision", self.scheduler.note_decision)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        # Πριν επιστρέψει το cwd: ένα retrain που τρέχει ακόμα γράφει artifacts σχετικά με αυτό.
+        self.scheduler.shutdown()
+        super().tearDown()
+
+    def _job(self, username, incremental):
+        self.calls.append(username)
+        return retrain_company(username, incremental)
+
+    def _choose(self, n):
+        for i in range(n):
+            request = RentalRequest.objects.create(
+                company=self.company, days=2, total_price=40, extra_insurance=False, requested_category="small",
+            )
+            decision = RentalDecision.objects.create(request=request)
+            car = Car.objects.filter(company=self.company, is_rented=False).first()
+            response = self.client.get(f"/rentals/choose-car/{request.id}/{car.id}/")
+            self.assertEqual(response.status_code, 302)
+            Car.objects.filter(id=car.id).update(is_rented=False)
+            decision.refresh_from_db()
+            self.assertEqual(decision.chosen_car_id, car.id)
+
+    def _wait_idle(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while self.scheduler._timers or self.scheduler._running:
+            self.assertLess(time.monotonic(), deadline, "το retrain δεν τελείωσε")
+            time.sleep(0.02)
+
+    def test_threshold_triggers_one_debounced_retrain(self):
+        self._choose(2)
+        time.sleep(0.2)
+        self.company.refresh_from_db()
+        self.assertEqual(self.company.pending_samples, 2)
+        self.assertEqual(self.calls, [])
+
+        self._choose(3)
+        self._wait_idle()
+        self.assertEqual(self.calls, ["acme"])
+        self.company.refresh_from_db()
+        self.assertEqual(self.company.pending_samples, 0)
+        self.assertIsNone(self.company.pending_since)
+        self.assertIsNone(self.company.retrain_started_at)
+        self.assertIsNotNone(self.company.last_trained)
+
+    def test_claim_and_concurrency_cap(self):
+        other = Company.objects.create(
+            user=User.objects.create_user(username="busy", password="pass123"), name="Busy", email="b@example.com",
+        )
+        # Άλλο process κάνει ήδη retrain: το όριο του 1 έχει καλυφθεί.
+        Company.objects.filter(id=other.id).update(retrain_started_at=timezone.now())
+        self._choose(3)
+        time.sleep(0.3)
+        self.assertEqual(self.calls, [])
+
+        # Claim παλαιότερο από το timeout μετράει ως χαμένο.
+        with override_settings(RECOMMENDATION_RETRAIN_TIMEOUT=0):
+            self._wait_idle()
+        self.assertEqual(self.calls, ["acme"])
+
+
+class StreamingDatasetTests(FleetFixtureMixin, TestCase):
+    def test_columns_match_orm_rows(self):
+        IncrementalTrainingTests._decide(self, 23)
+        columns = stream_decision_columns(self.company, chunk_size=5, trace_memory=True)
+        self.assertEqual(len(columns), 23)
+        self.assertGreater(columns.peak_bytes, 0)
+
+        df = columns.to_frame()
+        expected = [
+            (d.request.days, float(d.request.total_price), int(d.request.extra_insurance),
+             d.request.requested_category, d.chosen_car_id)
+            for d in RentalDecision.objects.select_related("request").order_by("id")
+        ]
+        self.assertEqual(
+            list(df[["days", "total_price", "extra_insurance", "requested_category", "car_id"]]
+                 .itertuples(index=False, name=None)),
+            expected,
+        )
+        model, encoder = train_model(df)
+        self.assertEqual(sorted(encoder.classes_), ["compact", "medium", "small"])
+
+
+class FeatureStoreTests(FleetFixtureMixin, TestCase):
+    def _assert_matches_db(self):
+        stored = feature_store.load_columns(self.company).to_frame()
+        expected = stream_decision_columns(self.company).to_frame()
+        pd.testing.assert_frame_equal(stored, expected)
+
+    def test_appends_overrides_and_compaction(self):
+        IncrementalTrainingTests._decide(self, 5)
+        # Πρώτο διάβασμα: rebuild από τη βάση.
+        self.assertFalse(feature_store.exists(self.company.id))
+        self._assert_matches_db()
+        self.assertTrue(feature_store.exists(self.company.id))
+
+        IncrementalTrainingTests._decide(self, 4, offset=5)
+        decision = RentalDecision.objects.order_by("id").first()
+        with self.captureOnCommitCallbacks(execute=True):
+            decision.chosen_car_id = 6
+            decision.save(update_fields=["chosen_car"])
+            RentalDecision.objects.order_by("id").last().delete()
+        self.assertGreater(os.path.getsize(feature_store.log_path(self.company.id)), 0)
+        # Το store υπάρχει: το διάβασμα δεν αγγίζει τη βάση.
+        with self.assertNumQueries(0):
+            feature_store.load_columns(self.company)
+        self._assert_matches_db()
+
+        self.assertEqual(feature_store.compact(self.company.id), 8)
+        self.assertEqual(os.path.getsize(feature_store.log_path(self.company.id)), 0)
+        self._assert_matches_db()
+
+    def test_no_log_without_snapshot(self):
+        with mock.patch("recommendations.feature_store.compact_in_background") as compact:
+            with self.settings(RECOMMENDATION_FEATURE_STORE_COMPACT_BYTES=1):
+                IncrementalTrainingTests._decide(self, 3)
+        self.assertFalse(os.path.exists(feature_store.log_path(self.company.id)))
+        compact.assert_not_called()
+
+    def test_compaction_error_goes_to_stderr(self):
+        with mock.patch("recommendations.feature_store.compact", side_effect=OSError("disk full")), \
+                mock.patch("sys.stderr", new_callable=StringIO) as stderr, \
+                mock.patch("sys.stdout", new_callable=StringIO) as stdout:
+            feature_store.compact_in_background(self.company.id)
+            deadline = time.monotonic() + 5
+            while self.company.id in feature_store._compacting and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertIn(f"compaction error (company {self.company.id})", stderr.getvalue())
+        self.assertIn("OSError: disk full", stderr.getvalue())
+        self.assertEqual(stdout.getvalue(), "")
+
+    def test_since_and_car_delete_invalidates(self):
+        IncrementalTrainingTests._decide(self, 6)
+        feature_store.rebuild(self.company)
+        cutoff = RentalDecision.objects.order_by("id")[2].decided_at
+        since = feature_store.load_columns(self.company, since=cutoff)
+        self.assertEqual(
+            since.arrays["decision_id"].tolist(),
+            list(RentalDecision.objects.filter(decided_at__gt=cutoff).order_by("id")
+                 .values_list("id", flat=True)),
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Car.objects.get(id=1).delete()
+        self.assertFalse(feature_store.exists(self.company.id))
+        self._assert_matches_db()
+
+    def test_request_edit_invalidates(self):
+        IncrementalTrainingTests._decide(self, 4)
+        feature_store.rebuild(self.company)
+        request = RentalRequest.objects.order_by("id").first()
+        with self.captureOnCommitCallbacks(execute=True):
+            RentalRequest.objects.create(company=self.company, days=1, total_price=10, requested_category="small")
+        self.assertTrue(feature_store.exists(self.company.id))  # νέο αίτημα: χωρίς απόφαση ακόμα
+
+        with self.captureOnCommitCallbacks(execute=True):
+            request.days, request.requested_category = 12, "compact"
+            request.save(update_fields=["days", "requested_category"])
+        self.assertFalse(feature_store.exists(self.company.id))
+        self._assert_matches_db()
+
+    def test_rebuild_waits_for_concurrent_compaction(self):
+        IncrementalTrainingTests._decide(self, 3)
+        feature_store.rebuild(self.company)
+        IncrementalTrainingTests._decide(self, 3, offset=3)
+        for decision in RentalDecision.objects.order_by("id")[3:]:
+            feature_store.append(self.company.id, feature_store.record(
+                decision.id, decision.decided_at, decision.request.days, decision.request.total_price,
+                decision.request.extra_insurance, decision.request.requested_category, decision.chosen_car_id,
+            ))
+
+        # Compaction ανάμεσα στο scan και στο γράψιμο του snapshot: με το lock
+        # περιμένει το rebuild και δεν χάνεται ούτε διπλασιάζεται εγγραφή.
+        scan = feature_store._decision_records
+
+        def scan_then_compact(*args):
+            records = scan(*args)
+            thread = threading.Thread(target=feature_store.compact, args=(self.company.id,))
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+            self._compaction = thread
+            return records
+
+        with mock.patch("recommendations.feature_store._decision_records", scan_then_compact):
+            self.assertEqual(feature_store.rebuild(self.company), 6)
+        self._compaction.join()
+        self._assert_matches_db()
+
+
+class EvaluationTests(FleetFixtureMixin, TestCase):
+    def test_rank_breaks_ties_like_argmax(self):
+        probas = np.array([[0.4, 0.4, 0.2], [0.1, 0.3, 0.6], [0.5, 0.5, 0.0]])
+        ranks = true_class_rank(probas, np.array([10, 20, 30]), [20, 10, 99])
+        self.assertEqual(ranks.tolist(), [1, 2, 3])
+
+    def test_matches_per_row_predictions(self):
+        model, encoder = train_model(_sample_df())
+        df = _sample_df().assign(decision_id=range(40))
+        df.loc[0, "requested_category"] = "luxury"
+        result = evaluate(model, encoder, df, ks=(1, 3))
+        self.assertEqual(result["skipped"], 1)
+
+        expected_top1 = []
+        for row in result["rows"].itertuples():
+            X = pd.DataFrame([[row.days, row.total_price, row.extra_insurance,
+                               encoder.transform([row.requested_category])[0]]], columns=FEATURES)
+            expected_top1.append(model.classes_[model.predict_proba(X)[0].argmax()])
+        self.assertEqual(result["rows"]["predicted_car_id"].tolist(), expected_top1)
+        self.assertAlmostEqual(result["top_k"][1], np.mean(np.array(expected_top1) == result["rows"]["car_id"]))
+        self.assertGreaterEqual(result["top_k"][3], result["top_k"][1])
+
+    def test_test_ai_fixed_queries(self):
+        IncrementalTrainingTests._decide(self, 20)
+        call_command("test_ai", "acme", stdout=StringIO())  # rebuild του feature store
+        for n in (0, 30):
+            IncrementalTrainingTests._decide(self, n, offset=20)
+            out = StringIO()
+            # user, company, οχήματα
+            with self.assertNumQueries(3):
+                call_command("test_ai", "acme", top_k=(1, 2), stdout=out)
+            self.assertIn("Top-2", out.getvalue())
+
+
+class BacktestTests(FleetFixtureMixin, TestCase):
+    def test_fleet_rank_matches_scorer(self):
+        scorer = FleetScorer.from_cars(Car.objects.filter(company=self.company))
+        probas = np.array([[0.1, 0.5, 0.4], [0.3, 0.3, 0.4], [0.0, 0.0, 1.0]])
+        class_ids = [2, 3, 5]
+        categories, chosen = ["small", "medium", "luxury"], np.array([3, 2, 6])
+        ranks = fleet_rank(scorer, categories, chosen, probas, class_ids)
+        for i in range(3):
+            ids = scorer.ranked_ids(categories[i], probas[i], class_ids)
+            self.assertEqual(ranks[i], ids.index(chosen[i]))
+        self.assertEqual(fleet_rank(scorer, ["small"], np.array([99]))[0], 6)
+
+    def test_command_reports_candidates(self):
+        IncrementalTrainingTests._decide(self, 40)
+        out = StringIO()
+        call_command(
+            "backtest_models", "acme", folds=2, top_k=(1, 3), stdout=out,
+            candidates=[("alphabetical", None), ("rf3", {"n_estimators": 3})],
+        )
+        lines = out.getvalue().splitlines()
+        self.assertTrue(any(line.startswith("alphabetical") for line in lines))
+        self.assertTrue(any(line.startswith("rf3") for line in lines))
+        self.assertIn("👉", lines[-1])
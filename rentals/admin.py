@@ -1,5 +1,9 @@
+import re
+
+from django import forms
 from django.contrib import admin, messages
-from .models import Car, Company, Booking
+from .models import ENV_PASSWORD_PREFIX, Car, Company, Booking, Mailbox, MailboxSyncState, PdfExtraction
+from .utils import suggest_cars
 
 @admin.register(Car)
 class CarAdmin(admin.ModelAdmin):
@@ -10,31 +14,97 @@ class CarAdmin(admin.ModelAdmin):
 
 @admin.register(Company)
 class CompanyAdmin(admin.ModelAdmin):
-    list_display = ('name', 'email', 'last_trained')
+    list_display = ('name', 'email', 'last_trained', 'last_full_trained', 'pending_samples')
     search_fields = ('name', 'email')
 
 @admin.action(description="Convert to RentalRequest (και σημαίνει Active)")
 def convert_bookings_to_rental_requests(modeladmin, request, queryset):
-    converted = 0
-    skipped = 0
-    for booking in queryset.order_by('id'):
-        if booking.status != "imported":
-            skipped += 1
-            continue
-        rr, dec = booking.to_rental_request()
-        # προαιρετικά: αλλάζουμε status σε active ώστε να μπει στο workflow
-        booking.status = "active"
-        booking.save(update_fields=["status"])
-        converted += 1
+    bookings = list(queryset.order_by('id'))
+    pending = [b for b in bookings if b.status == "imported"]
+    skipped = len(bookings) - len(pending)
+    Booking.to_rental_requests(pending)
+    # προαιρετικά: αλλάζουμε status σε active ώστε να μπει στο workflow
+    converted = Booking.objects.filter(pk__in=[b.pk for b in pending]).update(status="active")
     if converted:
         messages.success(request, f"✅ Δημιουργήθηκαν {converted} RentalRequest(s).")
     if skipped:
         messages.warning(request, f"⚠️ Παραλείφθηκαν {skipped} (status ≠ imported).")
 
+@admin.action(description="Ανάθεση προτεινόμενου οχήματος (AI)")
+def assign_suggested_cars(modeladmin, request, queryset):
+    """Ένα rank_cars_batch ανά εταιρεία· κάθε όχημα δίνεται σε μία μόνο κράτηση."""
+    pending = list(queryset.filter(chosen_car__isnull=True))
+    assigned = []
+    for booking, car in suggest_cars(pending):
+        booking.chosen_car = car
+        assigned.append(booking)
+    Booking.objects.bulk_update(assigned, ["chosen_car"])
+    skipped = len(pending) - len(assigned)
+
+    if assigned:
+        messages.success(request, f"✅ Ανατέθηκαν οχήματα σε {len(assigned)} κράτηση(εις).")
+    if skipped:
+        messages.warning(request, f"⚠️ Δεν βρέθηκε διαθέσιμο όχημα για {skipped} κράτηση(εις).")
+
 @admin.register(Booking)
 class BookingAdmin(admin.ModelAdmin):
     list_display = ('id', 'company', 'customer_name', 'start_date', 'end_date',
                     'status', 'requested_category', 'extra_insurance', 'total_price')
-    list_filter = ('company', 'status', 'requested_category', 'extra_insurance', 'start_date')
-    search_fields = ('customer_name', 'customer_email', 'customer_phone', 'source_email_uid', 'gm_msgid')
-    actions = [convert_bookings_to_rental_requests]
+    list_filter = ('company', 'mailbox', 'status', 'requested_category', 'extra_insurance', 'start_date', 'pdf_error')
+    search_fields = ('customer_name', 'customer_email', 'customer_phone', 'source_email_uid', 'gm_msgid',
+                     'content_hash')
+    actions = [convert_bookings_to_rental_requests, assign_suggested_cars]
+
+
+ENV_PASSWORD_RE = re.compile(re.escape(ENV_PASSWORD_PREFIX) + r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+class MailboxAdminForm(forms.ModelForm):
+    """
+    Ο κωδικός δεν αποθηκεύεται στη βάση: μόνο «env:ΜΕΤΑΒΛΗΤΗ», που διαβάζεται
+    από το περιβάλλον. Το πεδίο δεν εμφανίζεται ποτέ· κενό κρατά το αποθηκευμένο.
+    """
+    password = forms.CharField(
+        widget=forms.PasswordInput(render_value=False),
+        required=False,
+        help_text=f"«{ENV_PASSWORD_PREFIX}ΜΕΤΑΒΛΗΤΗ»: το app password διαβάζεται από αυτή τη μεταβλητή "
+                  "περιβάλλοντος. Αφήστε κενό για να μείνει η τρέχουσα τιμή.",
+    )
+
+    class Meta:
+        model = Mailbox
+        fields = '__all__'
+
+    def clean_password(self):
+        password = self.cleaned_data.get('password') or (self.instance.password if self.instance.pk else "")
+        if not password:
+            raise forms.ValidationError("Απαιτείται κωδικός.")
+        if not ENV_PASSWORD_RE.fullmatch(password):
+            # Και ένας παλιός, αποθηκευμένος σκέτος κωδικός πρέπει να αντικατασταθεί.
+            raise forms.ValidationError(
+                f"Δώστε «{ENV_PASSWORD_PREFIX}ΜΕΤΑΒΛΗΤΗ» αντί για τον κωδικό: "
+                "ο κωδικός δεν αποθηκεύεται στη βάση."
+            )
+        return password
+
+
+@admin.register(Mailbox)
+class MailboxAdmin(admin.ModelAdmin):
+    form = MailboxAdminForm
+    list_display = ('company', 'username', 'host', 'folder', 'enabled', 'use_idle', 'last_checked_at', 'last_error')
+    list_filter = ('enabled', 'use_idle', 'company')
+    search_fields = ('username', 'host', 'company__name')
+    readonly_fields = ('last_checked_at', 'last_error')
+
+
+@admin.register(MailboxSyncState)
+class MailboxSyncStateAdmin(admin.ModelAdmin):
+    list_display = ('company', 'mailbox', 'folder', 'uidvalidity', 'last_uid', 'highest_modseq', 'updated_at')
+    list_filter = ('company',)
+
+
+@admin.register(PdfExtraction)
+class PdfExtractionAdmin(admin.ModelAdmin):
+    list_display = ('content_hash', 'created_at')
+    search_fields = ('content_hash',)
+    readonly_fields = ('content_hash', 'text', 'parsed', 'created_at')
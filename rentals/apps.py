@@ -5,6 +5,8 @@ class RentalsConfig(AppConfig):
     name = 'rentals'
 
     def ready(self):  # pragma: no cover - called on app init
+        from . import signals  # noqa: F401 — σύνδεση receivers (ranking cache)
+
         # Ξεκινά background thread που φέρνει αυτόματα κρατήσεις από email
         from .email_auto_importer import start_email_importer
 
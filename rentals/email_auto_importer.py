@@ -1,31 +1,290 @@
+"""
+Background import κρατήσεων από email για όλα τα enabled Mailbox της βάσης
+(και για τον λογαριασμό του .env, IMAP_COMPANY/AUTO_IMPORT_COMPANY).
+
+Ένας supervisor κρατά πρόγραμμα ανά mailbox και τρέχει τα imports σε bounded
+thread pool: κάθε mailbox έχει το πολύ ένα import σε εξέλιξη και τα due
+mailboxes παίρνουν σειρά με βάση το πόσο περιμένουν, ώστε ένα αργό ή χαλασμένο
+mailbox να πιάνει το πολύ ένα worker. Τα mailboxes με IMAP IDLE έχουν δικό
+τους thread που απλώς ξυπνά τον supervisor σε κάθε EXISTS.
+"""
 import os
 import threading
 import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from django.core.management import call_command
+from django.db import close_old_connections
+from django.utils.timezone import now
 
 _started = False
+_stop = threading.Event()
 
+# Μέγιστο (και αρχικό) διάστημα του polling· μετά από νέες κρατήσεις πέφτει στο MIN
+# και διπλασιάζεται σε κάθε άδειο poll μέχρι να ξαναφτάσει το μέγιστο.
+EMAIL_IMPORT_INTERVAL = int(os.environ.get("EMAIL_IMPORT_INTERVAL", "300"))
+EMAIL_IMPORT_MIN_INTERVAL = int(os.environ.get("EMAIL_IMPORT_MIN_INTERVAL", "30"))
+# IMAP IDLE όπου το υποστηρίζει ο server· το IDLE ανανεώνεται πριν το όριο των 29' (RFC 2177).
+EMAIL_IMPORT_IDLE = os.environ.get("EMAIL_IMPORT_IDLE", "1") != "0"
+EMAIL_IDLE_TIMEOUT = int(os.environ.get("EMAIL_IDLE_TIMEOUT", str(25 * 60)))
+# Αναμονή πριν από νέα σύνδεση όταν πέσει η σύνδεση του IDLE
+EMAIL_IDLE_RETRY = int(os.environ.get("EMAIL_IDLE_RETRY", "30"))
+# Ταυτόχρονα imports (workers) και μέγιστες συνδέσεις σε IDLE (ένα thread η καθεμία)·
+# τα mailboxes πέρα από το όριο του IDLE εξυπηρετούνται με polling.
+EMAIL_IMPORT_WORKERS = int(os.environ.get("EMAIL_IMPORT_WORKERS", "8"))
+EMAIL_IDLE_MAX = int(os.environ.get("EMAIL_IDLE_MAX", "50"))
+# Κάθε πόσα δευτ. ξαναδιαβάζονται τα Mailbox της βάσης (νέα, απενεργοποιημένα, αλλαγές)
+EMAIL_MAILBOX_REFRESH = int(os.environ.get("EMAIL_MAILBOX_REFRESH", "60"))
+# Εξυπηρέτηση των Mailbox της βάσης (και του λογαριασμού του .env, βλ. load_targets).
+# Opt-in: ο importer ξεκινά από το AppConfig.ready() σε ΚΑΘΕ process του Django (κάθε
+# worker του web server, manage.py migrate/test/shell). Ενεργοποιείται μόνο στο process
+# που πρέπει να κάνει τα imports, αλλιώς κάθε process ανοίγει τις δικές του IMAP
+# συνδέσεις/IDLE στα ίδια mailboxes και τα imports τρέχουν παράλληλα πολλές φορές.
+EMAIL_IMPORT_MAILBOXES = os.environ.get("EMAIL_IMPORT_MAILBOXES", "0") != "0"
 
-def _run_loop():
-    company = (
-        os.environ.get("IMAP_COMPANY")
-        or os.environ.get("AUTO_IMPORT_COMPANY")
+
+class AdaptiveInterval:
+    """Διάστημα polling: minimum όσο έρχονται κρατήσεις, διπλάσιο σε κάθε άδειο poll μέχρι το maximum."""
+
+    def __init__(self, minimum, maximum):
+        self.minimum = min(minimum, maximum)
+        self.maximum = maximum
+        self.current = maximum
+
+    def next(self, imported):
+        if imported:
+            self.current = self.minimum
+        else:
+            self.current = min(self.current * 2, self.maximum)
+        return self.current
+
+
+# Ό,τι χρειάζεται ο supervisor για ένα mailbox· options = ορίσματα του import_bookings_from_email.
+MailboxTarget = namedtuple("MailboxTarget", "key label options account folder use_idle mailbox_id")
+
+
+def env_target(company):
+    """Ο λογαριασμός IMAP_USER/IMAP_PASS του .env για την εταιρεία company (όνομα)."""
+    from .management.commands.import_bookings_from_email import DEFAULT_FOLDER
+
+    return MailboxTarget(("env", company.lower()), company, {"company": company}, None, DEFAULT_FOLDER, True, None)
+
+
+def mailbox_target(mailbox):
+    return MailboxTarget(
+        ("mailbox", mailbox.pk), str(mailbox), {"mailbox": mailbox.pk},
+        mailbox.account(), mailbox.folder, mailbox.use_idle, mailbox.pk,
     )
-    if not company:
-        return
-    interval = int(os.environ.get("EMAIL_IMPORT_INTERVAL", "300"))
-    while True:
-        try:
-            call_command(
-                "import_bookings_from_email",
-                company=company,
-                mark_seen=True,
-                auto_convert=True,
+
+
+def _env_company():
+    return os.environ.get("IMAP_COMPANY") or os.environ.get("AUTO_IMPORT_COMPANY")
+
+
+def load_targets():
+    """Όλα τα enabled Mailbox, και ο λογαριασμός του .env αν η εταιρεία του δεν έχει Mailbox."""
+    from .models import Company, Mailbox
+
+    targets = [mailbox_target(m) for m in Mailbox.objects.filter(enabled=True).select_related("company")]
+    company = _env_company()
+    if company and not Company.objects.filter(name__iexact=company, mailboxes__isnull=False).exists():
+        targets.append(env_target(company))
+    return targets
+
+
+def _import(target):
+    """Ένα incremental import του mailbox· πόσες κρατήσεις μπήκαν."""
+    from .management.commands.import_bookings_from_email import Command
+
+    command = Command()
+    call_command(command, mark_seen=True, auto_convert=True, **target.options)
+    return command.stats["imported"]
+
+
+class _Schedule:
+    """Κατάσταση ενός mailbox στον supervisor."""
+
+    def __init__(self, target):
+        self.target = target
+        self.interval = AdaptiveInterval(EMAIL_IMPORT_MIN_INTERVAL, EMAIL_IMPORT_INTERVAL)
+        self.next_run = time.monotonic()  # το πρώτο import αμέσως
+        self.running = False
+        self.triggered = False  # EXISTS όσο έτρεχε import: ξανά μόλις τελειώσει
+        self.idle_supported = None
+        self.watcher = None
+        self.stop = threading.Event()  # σταματά το IDLE thread του mailbox
+
+
+class MailboxSupervisor:
+    def __init__(self, stop, load=load_targets, workers=None, idle=None):
+        self.stop = stop
+        self.load = load
+        self.workers = max(workers or EMAIL_IMPORT_WORKERS, 1)
+        self.idle = EMAIL_IMPORT_IDLE if idle is None else idle
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._schedules = {}  # target.key -> _Schedule
+        self._refreshed = None
+
+    # ---------- πρόγραμμα ----------
+
+    def refresh(self):
+        """Συγχρονίζει τα schedules με τα targets· όσα άλλαξαν ξεκινούν από την αρχή."""
+        targets = {t.key: t for t in self.load()}
+        with self._lock:
+            for key, schedule in list(self._schedules.items()):
+                if targets.get(key) != schedule.target:
+                    schedule.stop.set()
+                    del self._schedules[key]
+            for key, target in targets.items():
+                if key not in self._schedules:
+                    self._schedules[key] = _Schedule(target)
+            idle_slots = EMAIL_IDLE_MAX - sum(
+                1 for s in self._schedules.values() if s.watcher is not None and s.watcher.is_alive()
             )
-        except Exception as exc:  # pragma: no cover - non critical
-            print(f"email import error: {exc}")
-        time.sleep(interval)
+            for schedule in self._schedules.values():
+                if idle_slots > 0 and self._wants_watcher(schedule):
+                    schedule.watcher = threading.Thread(
+                        target=self._watch, args=(schedule,), name=f"email-idle-{schedule.target.label}", daemon=True
+                    )
+                    schedule.watcher.start()
+                    idle_slots -= 1
+        self._refreshed = time.monotonic()
+
+    def _wants_watcher(self, schedule):
+        return (
+            self.idle and schedule.target.use_idle and schedule.idle_supported is not False
+            and (schedule.watcher is None or not schedule.watcher.is_alive())
+        )
+
+    def trigger(self, key):
+        """Import το συντομότερο (π.χ. EXISTS από το IDLE)."""
+        with self._lock:
+            schedule = self._schedules.get(key)
+            if schedule is None:
+                return
+            if schedule.running:
+                schedule.triggered = True
+            else:
+                schedule.next_run = time.monotonic()
+        self._wake.set()
+
+    def _due(self, free):
+        """Έως free mailboxes που περιμένουν, τα παλαιότερα πρώτα."""
+        current = time.monotonic()
+        with self._lock:
+            due = sorted(
+                (s for s in self._schedules.values() if not s.running and s.next_run <= current),
+                key=lambda s: s.next_run,
+            )[:free]
+            for schedule in due:
+                schedule.running = True
+            upcoming = [s.next_run for s in self._schedules.values() if not s.running]
+        return due, (min(upcoming) - current if upcoming else None)
+
+    # ---------- εκτέλεση ----------
+
+    def run(self):
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="email-import")
+        running = set()
+        try:
+            while not self.stop.is_set():
+                if self._refreshed is None or time.monotonic() - self._refreshed >= EMAIL_MAILBOX_REFRESH:
+                    try:
+                        self.refresh()
+                    except Exception as exc:  # pragma: no cover - non critical
+                        print(f"email mailboxes error: {exc}")
+                        self._refreshed = time.monotonic()
+                    finally:
+                        close_old_connections()
+                self._wake.clear()
+                running = {f for f in running if not f.done()}
+                due, wait = self._due(self.workers - len(running))
+                for schedule in due:
+                    running.add(executor.submit(self._run_import, schedule))
+                # Ξυπνά με trigger/τέλος import (και όταν όλα τα workers είναι πιασμένα)·
+                # το πολύ κάθε 1" για το stop event.
+                self._wake.wait(min(wait, 1.0) if wait is not None and wait > 0 else 1.0)
+        finally:
+            with self._lock:
+                for schedule in self._schedules.values():
+                    schedule.stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _run_import(self, schedule):
+        target = schedule.target
+        imported, error = None, ""
+        try:
+            imported = _import(target)
+        except Exception as exc:
+            error = str(exc) or exc.__class__.__name__
+            print(f"email import error ({target.label}): {error}")
+        try:
+            if target.mailbox_id is not None:
+                from .models import Mailbox
+
+                Mailbox.objects.filter(pk=target.mailbox_id).update(last_checked_at=now(), last_error=error)
+        except Exception:  # pragma: no cover - non critical
+            pass
+        finally:
+            close_old_connections()
+
+        with self._lock:
+            schedule.running = False
+            delay = schedule.interval.next(imported)
+            if schedule.watcher is not None and schedule.watcher.is_alive():
+                delay = EMAIL_IMPORT_INTERVAL  # με IDLE το polling είναι μόνο δίχτυ ασφαλείας
+            schedule.next_run = time.monotonic() + (0 if schedule.triggered else delay)
+            schedule.triggered = False
+        self._wake.set()
+
+    def _watch(self, schedule):
+        """
+        Κρατά μία σύνδεση σε IDLE και ξυπνά τον supervisor σε κάθε EXISTS· το
+        import γίνεται στο pool. Αν ο server δεν υποστηρίζει IDLE, το mailbox
+        μένει σε polling.
+        """
+        from .imap_idle import IdleUnsupported, idle_wait, supports_idle
+        from .imap_sessions import session_manager
+
+        target, stop = schedule.target, schedule.stop
+        while not stop.is_set() and not self.stop.is_set():
+            session = None
+            try:
+                # Αποκλειστική σύνδεση (εκτός pool): όσο είναι σε IDLE δεν δέχεται άλλες εντολές.
+                session = session_manager.open(target.folder, target.account)
+                if not supports_idle(session.M):
+                    raise IdleUnsupported()
+                # Ό,τι ήρθε όσο δεν υπήρχε σύνδεση σε IDLE.
+                self.trigger(target.key)
+                while not stop.is_set() and not self.stop.is_set():
+                    if idle_wait(session.M, EMAIL_IDLE_TIMEOUT, stop):
+                        self.trigger(target.key)
+            except IdleUnsupported:
+                schedule.idle_supported = False
+                return
+            except Exception as exc:  # pragma: no cover - non critical
+                print(f"email idle error ({target.label}): {exc}")
+                stop.wait(EMAIL_IDLE_RETRY)
+            finally:
+                if session is not None:
+                    try:
+                        session.M.logout()
+                    except Exception:
+                        pass
+
+
+def run(company, stop, idle=None):
+    """Import μόνο για την εταιρεία company με τον λογαριασμό του .env."""
+    MailboxSupervisor(stop, load=lambda: [env_target(company)], idle=idle).run()
+
+
+def _run_loop():
+    if EMAIL_IMPORT_MAILBOXES:
+        MailboxSupervisor(_stop).run()
+    elif _env_company():
+        run(_env_company(), _stop)
 
 
 def start_email_importer():
@@ -34,4 +293,8 @@ def start_email_importer():
         return
     thread = threading.Thread(target=_run_loop, daemon=True)
     thread.start()
-    _started = True
\ No newline at end of file
+    _started = True
+
+
+def stop_email_importer():
+    _stop.set()
@@ -0,0 +1,232 @@
+"""
+Απαντήσεις FETCH με BODYSTRUCTURE/ENVELOPE (RFC 3501) και κατέβασμα μόνο
+του μέρους του μηνύματος που χρειάζεται το import (PDF ή κείμενο).
+
+Το imaplib δεν αναλύει τις απαντήσεις· το parse_fetch τις μετατρέπει σε
+dicts ({b"UID": b"5", b"BODYSTRUCTURE": [...], ...}) και το find_booking_part
+επιλέγει το section για το BODY.PEEK[section].
+"""
+import base64
+import binascii
+import quopri
+import re
+from collections import namedtuple
+
+# Ένα μέρος του μηνύματος όπως το περιγράφει το BODYSTRUCTURE· size = bytes πριν το decode.
+BodyPart = namedtuple("BodyPart", "section content_type encoding size charset filename")
+
+_LITERAL_RE = re.compile(rb"\{(\d+)\}$")
+_ATOM_END = b" ()\r\n"
+
+
+class _Literal(bytes):
+    """Literal ({n}) από το imaplib· δεν ξανασπάει σε tokens."""
+
+
+def _segments(item):
+    # Το imaplib δίνει (κείμενο που τελειώνει σε {n}, literal) ή σκέτο κείμενο.
+    if isinstance(item, tuple):
+        head, literal = item
+        yield _LITERAL_RE.sub(b"", head)
+        yield _Literal(literal or b"")
+    elif isinstance(item, (bytes, str)):
+        yield item.encode() if isinstance(item, str) else item
+
+
+def _tokens(data):
+    for item in data or []:
+        for segment in _segments(item):
+            if isinstance(segment, _Literal):
+                yield segment
+                continue
+            i, n = 0, len(segment)
+            while i < n:
+                c = segment[i:i + 1]
+                if c in b" \r\n":
+                    i += 1
+                elif c in b"()":
+                    yield c
+                    i += 1
+                elif c == b'"':
+                    j, out = i + 1, bytearray()
+                    while j < n and segment[j:j + 1] != b'"':
+                        if segment[j:j + 1] == b"\\":
+                            j += 1
+                        out += segment[j:j + 1]
+                        j += 1
+                    yield _Literal(bytes(out))
+                    i = j + 1
+                else:
+                    # Atom· το BODY[HEADER.FIELDS (FROM)]<0> περιέχει κενά και παρενθέσεις μέσα στα [].
+                    j, depth = i, 0
+                    while j < n and (depth or segment[j:j + 1] not in _ATOM_END):
+                        if segment[j:j + 1] == b"[":
+                            depth += 1
+                        elif segment[j:j + 1] == b"]":
+                            depth -= 1
+                        j += 1
+                    yield segment[i:j]
+                    i = j
+
+
+def parse_fetch(data):
+    """Λίστα από dicts (όνομα item → τιμή) για κάθε απάντηση ενός FETCH του imaplib."""
+    responses = []
+    stack = []
+    for token in _tokens(data):
+        if isinstance(token, _Literal):
+            value = bytes(token)
+        elif token == b"(":
+            stack.append([])
+            continue
+        elif token == b")":
+            if not stack:
+                continue
+            value = stack.pop()
+            if not stack:
+                # Τέλος απάντησης: "<seq> (ΟΝΟΜΑ τιμή ΟΝΟΜΑ τιμή ...)".
+                responses.append({
+                    (key.upper() if isinstance(key, bytes) else key): item
+                    for key, item in zip(value[::2], value[1::2])
+                })
+                continue
+        elif not stack:
+            continue  # sequence number
+        else:
+            value = None if token.upper() == b"NIL" else token
+        stack[-1].append(value)
+    return responses
+
+
+def _text(value):
+    if value is None:
+        return ""
+    return value.decode("utf-8", errors="replace") if isinstance(value, bytes) else str(value)
+
+
+def _params(value):
+    if not isinstance(value, list):
+        return {}
+    return {_text(k).lower(): _text(v) for k, v in zip(value[::2], value[1::2])}
+
+
+def _walk(node, section, nested=False):
+    """(BodyPart, disposition) για κάθε μέρος· section όπως στο BODY[section]."""
+    if not isinstance(node, list) or not node:
+        return
+    if isinstance(node[0], list):
+        # multipart: τα παιδιά, μετά το subtype και (προαιρετικά) extension data, που είναι κι αυτά λίστες.
+        for index, child in enumerate(node):
+            if not isinstance(child, list):
+                break
+            yield from _walk(child, f"{section}.{index + 1}" if section else str(index + 1))
+        return
+
+    # Σε μη-multipart μήνυμα (ή encapsulated message/rfc822) το σώμα είναι το ".1".
+    if not section:
+        section = "1"
+    elif nested:
+        section = f"{section}.1"
+    content_type = f"{_text(node[0])}/{_text(node[1])}".lower()
+    params = _params(node[2] if len(node) > 2 else None)
+    try:
+        size = int(node[6])
+    except (IndexError, TypeError, ValueError):
+        size = 0
+    # Extension data: μετά το lines για text/*, μετά τα envelope/body/lines για message/rfc822.
+    if content_type == "message/rfc822":
+        if len(node) > 8:
+            yield from _walk(node[8], section, nested=True)
+        return
+    disposition_at = 9 if content_type.startswith("text/") else 8
+    disposition = node[disposition_at] if len(node) > disposition_at else None
+    disposition_type, disposition_params = "", {}
+    if isinstance(disposition, list) and disposition:
+        disposition_type = _text(disposition[0]).lower()
+        disposition_params = _params(disposition[1] if len(disposition) > 1 else None)
+    part = BodyPart(
+        section=section,
+        content_type=content_type,
+        encoding=_text(node[5] if len(node) > 5 else None).lower() or "7bit",
+        size=size,
+        charset=params.get("charset", ""),
+        filename=disposition_params.get("filename") or params.get("name") or "",
+    )
+    yield part, disposition_type
+
+
+def is_pdf(part: BodyPart) -> bool:
+    return part.content_type == "application/pdf" or part.filename.lower().endswith(".pdf")
+
+
+def find_booking_part(structure):
+    """
+    Το μέρος με την κράτηση: το πρώτο PDF, αλλιώς το πρώτο text/plain ή
+    text/html που δεν είναι συνημμένο. None αν δεν υπάρχει κανένα.
+    """
+    parts = list(_walk(structure, ""))
+    for part, _ in parts:
+        if is_pdf(part):
+            return part
+    for part, disposition in parts:
+        if part.content_type in ("text/plain", "text/html") and disposition != "attachment":
+            return part
+    return None
+
+
+def envelope_from(envelope):
+    """Το From του ENVELOPE ως "Όνομα <user@host>" (το όνομα ίσως RFC 2047)."""
+    try:
+        name, _, mailbox, host = envelope[2][0]
+    except (IndexError, TypeError, ValueError):
+        return ""
+    address = f"{_text(mailbox)}@{_text(host)}" if host else _text(mailbox)
+    return f"{_text(name)} <{address}>" if name else address
+
+
+class PartDecoder:
+    """
+    Αποκωδικοποιεί σταδιακά (base64/quoted-printable) ένα μέρος που έρχεται σε
+    κομμάτια με BODY.PEEK[section]<offset.length> και το γράφει στο out.
+    """
+
+    def __init__(self, encoding, out):
+        self.encoding = (encoding or "7bit").lower()
+        self.out = out
+        self._pending = b""
+
+    def write(self, data):
+        data = self._pending + data
+        if self.encoding == "base64":
+            data = re.sub(rb"\s+", b"", data)
+            cut = len(data) // 4 * 4
+            self._pending = data[cut:]
+            self._emit(data[:cut])
+        elif self.encoding == "quoted-printable":
+            # Ένα soft line break ή ένα "=XX" μπορεί να σπάσει ανάμεσα σε κομμάτια: ως το τελευταίο \n.
+            cut = data.rfind(b"\n") + 1
+            self._pending = data[cut:]
+            self._emit(data[:cut])
+        else:
+            self._pending = b""
+            self.out.write(data)
+
+    def close(self):
+        data, self._pending = self._pending, b""
+        if self.encoding == "base64":
+            data += b"=" * (-len(data) % 4)
+        if data:
+            self._emit(data)
+
+    def _emit(self, data):
+        if not data:
+            return
+        if self.encoding == "base64":
+            try:
+                self.out.write(base64.b64decode(data))
+            except (binascii.Error, ValueError):
+                pass  # χαλασμένο base64: ό,τι αποκωδικοποιήθηκε ως εδώ
+        elif self.encoding == "quoted-printable":
+            self.out.write(quopri.decodestring(data))
+        else:
+            self.out.write(data)
@@ -0,0 +1,90 @@
+"""
+IMAP IDLE (RFC 2177) πάνω σε imaplib, που δεν το υποστηρίζει πριν την Python 3.14.
+
+Όλες οι γραμμές διαβάζονται από το M.readline() του imaplib, ώστε ό,τι
+έχει ήδη μπει στο buffer του (π.χ. ένα EXISTS μαζί με το "+ idling") να
+μη χάνεται. Η αναμονή γίνεται με select (σε μικρά διαστήματα, ώστε να
+σταματά γρήγορα) και όχι με timeout στο socket, γιατί ένα timeout μέσα
+στο file του imaplib αφήνει τη σύνδεση σε άκυρη κατάσταση· γι' αυτό το
+buffer ελέγχεται πριν από κάθε select.
+"""
+import itertools
+import re
+import select
+import ssl
+import time
+
+import imaplib
+
+EXISTS_RE = re.compile(rb"^\*\s+\d+\s+EXISTS", re.IGNORECASE)
+# Πόσο συχνά ελέγχεται το stop event όσο περιμένουμε.
+POLL_SLICE = 1.0
+
+_tags = itertools.count(1)
+
+
+class IdleUnsupported(Exception):
+    pass
+
+
+def supports_idle(M: imaplib.IMAP4) -> bool:
+    return "IDLE" in getattr(M, "capabilities", ())
+
+
+def _buffered(M: imaplib.IMAP4) -> bool:
+    """
+    Υπάρχουν ήδη bytes για το M.readline(), αόρατα στο select; (στο buffer του
+    M.file ή αποκρυπτογραφημένα στο SSL socket). Το peek διαβάζει από το socket
+    μόνο αν το buffer είναι άδειο, και τότε χωρίς να μπλοκάρει.
+    """
+    sock = M.socket()
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return bool(M.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+def idle_wait(M: imaplib.IMAP4, timeout: float, stop=None) -> bool:
+    """
+    Μπαίνει σε IDLE για το πολύ timeout δευτ. (ή μέχρι το stop event) και
+    επιστρέφει True αν ο server ανέφερε νέο μήνυμα (* N EXISTS).
+    Στο τέλος στέλνει DONE και διαβάζει την απάντηση, ώστε η σύνδεση να
+    μένει έτοιμη για επόμενη εντολή ή επόμενο idle_wait.
+    """
+    if not supports_idle(M):
+        raise IdleUnsupported("Ο IMAP server δεν υποστηρίζει IDLE.")
+
+    tag = f"IDLE{next(_tags)}".encode()
+    M.send(tag + b" IDLE\r\n")
+    line = M.readline()
+    if not line.startswith(b"+"):
+        raise IdleUnsupported(f"Ο server απέρριψε το IDLE: {line!r}")
+
+    sock = M.socket()
+    deadline = time.monotonic() + timeout
+    new_mail = False
+    while not new_mail and not (stop is not None and stop.is_set()) and time.monotonic() < deadline:
+        if not _buffered(M):
+            remaining = deadline - time.monotonic()
+            readable, _, _ = select.select([sock], [], [], min(max(remaining, 0.05), POLL_SLICE))
+            if not readable:
+                continue
+        # Οι servers στέλνουν ολόκληρες γραμμές, άρα το readline δεν περιμένει.
+        line = M.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("Ο server έκλεισε τη σύνδεση κατά το IDLE.")
+        new_mail = bool(EXISTS_RE.match(line))
+
+    M.send(b"DONE\r\n")
+    while True:
+        line = M.readline()
+        if not line:
+            raise imaplib.IMAP4.abort("Ο server έκλεισε τη σύνδεση μετά το IDLE.")
+        if line.startswith(tag):
+            break
+        new_mail = new_mail or bool(EXISTS_RE.match(line))
+    return new_mail
@@ -0,0 +1,212 @@
+"""
+Μακρόβιες IMAP συνδέσεις (authenticated + selected), κοινές για το
+import_bookings_from_email και το email_auto_importer, ώστε το steady-state
+polling να μην πληρώνει TLS handshake + LOGIN σε κάθε κύκλο.
+
+Μια σύνδεση του pool ξαναχρησιμοποιείται με ένα SELECT (φρέσκα UIDVALIDITY
+και HIGHESTMODSEQ, και έλεγχος ότι ζει)· αν αποτύχει ανοίγει νέα με backoff.
+Οι αδρανείς συνδέσεις κρατιούνται ζωντανές με NOOP από ένα daemon thread.
+"""
+import atexit
+import imaplib
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+IMAP_HOST = os.environ.get("IMAP_HOST", "imap.gmail.com")
+IMAP_USER = os.environ.get("IMAP_USER")
+IMAP_PASS = os.environ.get("IMAP_PASS")
+# NOOP σε αδρανείς συνδέσεις κάθε τόσα δευτ. (οι servers κόβουν μετά από ~30')
+IMAP_KEEPALIVE = float(os.environ.get("IMAP_KEEPALIVE", "240"))
+# Προσπάθειες σύνδεσης και μέγιστη αναμονή του exponential backoff ανάμεσά τους
+IMAP_RECONNECT_ATTEMPTS = int(os.environ.get("IMAP_RECONNECT_ATTEMPTS", "4"))
+IMAP_RECONNECT_MAX_DELAY = float(os.environ.get("IMAP_RECONNECT_MAX_DELAY", "60"))
+# Timeout (δευτ.) του socket, ώστε ένας server που δεν απαντά να μην κρατά για πάντα το thread του
+IMAP_TIMEOUT = float(os.environ.get("IMAP_TIMEOUT", "60"))
+
+
+def default_account():
+    """(host, user, password) από το περιβάλλον (.env)."""
+    return IMAP_HOST, IMAP_USER, IMAP_PASS
+
+
+def connect(account) -> imaplib.IMAP4:
+    host, user, password = account
+    M = imaplib.IMAP4_SSL(host, timeout=IMAP_TIMEOUT or None)
+    M.login(user, password)
+    return M
+
+
+def select_folder(M: imaplib.IMAP4, folder: str):
+    """SELECT· επιστρέφει (UIDVALIDITY, HIGHESTMODSEQ) όπως τα ανέφερε ο server (ή None)."""
+    typ, _ = M.select(folder, readonly=False)
+    if typ != "OK":
+        raise imaplib.IMAP4.error(f"Αδυναμία επιλογής φακέλου: {folder} ({typ})")
+    return response_int(M, "UIDVALIDITY"), response_int(M, "HIGHESTMODSEQ")
+
+
+def response_int(M: imaplib.IMAP4, code: str) -> Optional[int]:
+    """Ακέραιος ενός response code του SELECT (π.χ. "* OK [UIDVALIDITY 3]"), αν υπάρχει."""
+    try:
+        _, data = M.response(code)
+    except Exception:
+        return None
+    for item in data or []:
+        if isinstance(item, str):
+            item = item.encode()
+        m = re.match(rb"\s*(\d+)", item or b"")
+        if m:
+            return int(m.group(1))
+    return None
+
+
+def _logout(M):
+    if M is None:
+        return
+    try:
+        M.logout()
+    except Exception:
+        pass
+
+
+class ImapSession:
+    def __init__(self, M, key, uidvalidity, highest_modseq):
+        self.M = M
+        self.key = key  # (host, user, folder)
+        self.uidvalidity = uidvalidity
+        self.highest_modseq = highest_modseq
+        self.reused = False
+        self.last_used = time.monotonic()
+
+
+class ImapSessionManager:
+    def __init__(self, keepalive=None, attempts=None, max_delay=None, sleep=time.sleep):
+        self.keepalive = keepalive if keepalive is not None else IMAP_KEEPALIVE
+        self.attempts = attempts if attempts is not None else IMAP_RECONNECT_ATTEMPTS
+        self.max_delay = max_delay if max_delay is not None else IMAP_RECONNECT_MAX_DELAY
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._idle = {}  # key -> [ImapSession] έτοιμες για checkout
+        self._stats = {"connects": 0, "reuses": 0, "reconnects": 0, "failures": 0, "keepalives": 0}
+        self._keeper = None
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, idle=sum(len(sessions) for sessions in self._idle.values()))
+
+    # ---------- σύνδεση ----------
+
+    def open(self, folder, account=None) -> ImapSession:
+        """Νέα σύνδεση (εκτός pool) με exponential backoff· το IDLE του importer τη χρειάζεται αποκλειστικά."""
+        host, user, password = account or default_account()
+        if not user or not password:
+            raise ValueError("Λείπουν τα στοιχεία IMAP (IMAP_USER/IMAP_PASS του .env ή του Mailbox).")
+        delay = 1.0
+        for attempt in range(1, max(self.attempts, 1) + 1):
+            M = None
+            try:
+                M = connect((host, user, password))
+                uidvalidity, highest_modseq = select_folder(M, folder)
+            except Exception:
+                self._count("failures")
+                _logout(M)
+                if attempt >= self.attempts:
+                    raise
+                self.sleep(min(delay, self.max_delay))
+                delay *= 2
+                continue
+            self._count("connects")
+            return ImapSession(M, (host, user, folder), uidvalidity, highest_modseq)
+
+    def checkout(self, folder, account=None) -> ImapSession:
+        host, user, _ = account or default_account()
+        key = (host, user, folder)
+        while True:
+            with self._lock:
+                sessions = self._idle.get(key)
+                session = sessions.pop() if sessions else None
+            if session is None:
+                return self.open(folder, account)
+            try:
+                session.uidvalidity, session.highest_modseq = select_folder(session.M, folder)
+            except Exception:
+                # Η σύνδεση έπεσε όσο ήταν στο pool: νέα, διαφανώς για τον caller.
+                self._count("reconnects")
+                _logout(session.M)
+                continue
+            session.reused = True
+            self._count("reuses")
+            return session
+
+    def release(self, session, broken=False):
+        if broken:
+            _logout(session.M)
+            return
+        session.last_used = time.monotonic()
+        with self._lock:
+            self._idle.setdefault(session.key, []).append(session)
+        self._start_keeper()
+
+    @contextmanager
+    def session(self, folder, account=None):
+        """with session_manager.session(folder) as s: ... — σε exception η σύνδεση κλείνει."""
+        session = self.checkout(folder, account)
+        try:
+            yield session
+        except BaseException:
+            self.release(session, broken=True)
+            raise
+        self.release(session)
+
+    # ---------- keepalive ----------
+
+    def ping_idle(self):
+        """NOOP σε όσες αδρανείς συνδέσεις δεν χρησιμοποιήθηκαν για keepalive δευτ.· οι νεκρές φεύγουν."""
+        now = time.monotonic()
+        with self._lock:
+            stale = []
+            for key, sessions in self._idle.items():
+                keep = [s for s in sessions if now - s.last_used < self.keepalive]
+                stale.extend(s for s in sessions if now - s.last_used >= self.keepalive)
+                self._idle[key] = keep
+        for session in stale:
+            try:
+                typ, _ = session.M.noop()
+                alive = typ == "OK"
+            except Exception:
+                alive = False
+            if alive:
+                self._count("keepalives")
+                self.release(session)
+            else:
+                _logout(session.M)
+
+    def _start_keeper(self):
+        with self._lock:
+            if self._keeper is not None or self.keepalive <= 0:
+                return
+            self._keeper = threading.Thread(target=self._keep_forever, name="imap-keepalive", daemon=True)
+        self._keeper.start()
+
+    def _keep_forever(self):
+        while True:
+            time.sleep(self.keepalive / 2)
+            self.ping_idle()
+
+    def close_all(self):
+        with self._lock:
+            sessions = [s for sessions in self._idle.values() for s in sessions]
+            self._idle.clear()
+        for session in sessions:
+            _logout(session.M)
+
+
+session_manager = ImapSessionManager()
+atexit.register(session_manager.close_all)
@@ -1,8 +1,11 @@
 import email
+import hashlib
 import imaplib
 import os
 import re
+import shutil
 import sys
+import tempfile
 import traceback
 from email.header import decode_header, make_header
 from pathlib import Path
@@ -10,34 +13,30 @@ from typing import Optional
 
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
+from django.db import connection, transaction
 from django.utils.timezone import now
 
-from rentals.models import Company, Booking
+from rentals.imap_bodystructure import PartDecoder, envelope_from, find_booking_part, is_pdf, parse_fetch
+from rentals.imap_sessions import session_manager
+from rentals.models import BOOKING_CODE_PREFIX, Company, Booking, Mailbox, MailboxSyncState, PdfExtraction
+from rentals.pdf_extraction import pdf_extractor
 from rentals.utils_email import parse_booking_text
 
 DEFAULT_FOLDER = os.environ.get("IMAP_FOLDER", "[Gmail]/All Mail")
-IMAP_HOST = os.environ.get("IMAP_HOST", "imap.gmail.com")
-IMAP_USER = os.environ.get("IMAP_USER")
-IMAP_PASS = os.environ.get("IMAP_PASS")
 IMAP_SENDER_FILTER = os.environ.get("IMAP_SENDER_FILTER")  # optional
-
-
-def _ensure_imap_creds():
-    if not IMAP_USER or not IMAP_PASS:
-        raise CommandError("IMAP_USER/IMAP_PASS δεν έχουν οριστεί στο περιβάλλον (.env).")
-
-
-def _connect() -> imaplib.IMAP4_SSL:
-    _ensure_imap_creds()
-    M = imaplib.IMAP4_SSL(IMAP_HOST)
-    M.login(IMAP_USER, IMAP_PASS)
-    return M
-
-
-def _select_folder(M: imaplib.IMAP4_SSL, folder: str):
-    typ, _ = M.select(folder, readonly=False)
-    if typ != "OK":
-        raise CommandError(f"Αδυναμία επιλογής φακέλου: {folder} ({typ})")
+# Πόσα UIDs ανά UID FETCH: λίγα για τα σώματα (PDF στη μνήμη), πολλά για τα X-GM-MSGID.
+IMAP_FETCH_CHUNK = int(os.environ.get("IMAP_FETCH_CHUNK", "50"))
+IMAP_MSGID_CHUNK = int(os.environ.get("IMAP_MSGID_CHUNK", "5000"))
+# Μέγεθος (bytes) κάθε partial FETCH (BODY.PEEK[n]<offset.length>) όταν κατεβαίνει ένα συνημμένο,
+# πόσο από το κείμενο του σώματος αρκεί για το parsing, και πάνω από πόσα bytes το
+# αποκωδικοποιημένο μέρος γράφεται σε προσωρινό αρχείο αντί να μένει στη μνήμη.
+IMAP_PART_CHUNK = int(os.environ.get("IMAP_PART_CHUNK", str(1024 * 1024)))
+IMAP_TEXT_MAX = int(os.environ.get("IMAP_TEXT_MAX", str(256 * 1024)))
+IMAP_SPOOL_MEMORY = int(os.environ.get("IMAP_SPOOL_MEMORY", str(1024 * 1024)))
+# Κρατήσεις ανά transaction (bulk_create)· λίγες = νωρίτερα ορατές, πολλές = λιγότερα commits.
+BOOKING_WRITE_BATCH = int(os.environ.get("BOOKING_WRITE_BATCH", "100"))
+# Μετά από τόσες αποτυχίες ένα μήνυμα παραλείπεται, ώστε το watermark (last_uid) να προχωρήσει.
+IMAP_MAX_ATTEMPTS = int(os.environ.get("IMAP_MAX_ATTEMPTS", "5"))
 
 
 def _decode(s: str) -> str:
@@ -65,23 +64,213 @@ def _search_query(include_seen: bool, sender: Optional[str], raw_query: Optional
     return ("std", " ".join(parts) or "ALL")
 
 
-def _extract_x_gm_msgid(M: imaplib.IMAP4_SSL, uid: str) -> Optional[str]:
-    try:
-        typ, data = M.uid('fetch', uid, '(X-GM-MSGID)')
-        if typ == 'OK' and data and data[0]:
-            payload = data[0]
-            if isinstance(payload, tuple):
-                payload = payload[1]
-            if isinstance(payload, bytes):
-                payload = payload.decode(errors='ignore')
-            m = re.search(r'X-GM-MSGID\s+\((\d+)\)', payload) or re.search(r'X-GM-MSGID\s+(\d+)', payload)
-            if m:
-                return m.group(1)
-    except Exception:
-        pass
+UID_RE = re.compile(rb"\bUID\s+(\d+)")
+GM_MSGID_RE = re.compile(rb"X-GM-MSGID\s+\(?(\d+)")
+RESPONSE_START_RE = re.compile(rb"^\d+\s+\(")
+
+
+def _uid_set(uids) -> str:
+    """IMAP sequence set με ranges: ["1", "2", "3", "7"] -> "1:3,7"."""
+    nums = sorted({int(u) for u in uids})
+    ranges = []
+    for n in nums:
+        if ranges and n == ranges[-1][1] + 1:
+            ranges[-1][1] = n
+        else:
+            ranges.append([n, n])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), max(size, 1)):
+        yield items[start:start + size]
+
+
+def _fetch_responses(data):
+    """
+    (metadata, literal) για κάθε μήνυμα μιας απάντησης FETCH του imaplib.
+    Το imaplib δίνει tuple (header, literal) και μετά ένα b")" (ή b" UID 5)")
+    που κλείνει το μήνυμα· απαντήσεις χωρίς literal είναι σκέτα bytes.
+    """
+    responses = []
+    closed = True
+    for part in data or []:
+        if isinstance(part, tuple):
+            responses.append([part[0], part[1]])
+            closed = False
+        elif isinstance(part, bytes):
+            if not closed and not RESPONSE_START_RE.match(part):
+                responses[-1][0] += part
+            else:
+                responses.append([part, None])
+            closed = True
+    return responses
+
+
+def _fetch_gm_msgids(M: imaplib.IMAP4, uids) -> dict:
+    """
+    {uid: X-GM-MSGID} με ένα UID FETCH ανά IMAP_MSGID_CHUNK UIDs.
+    Σε servers χωρίς X-GM-MSGID (όχι Gmail) επιστρέφει {} και το dedupe γίνεται με UID.
+    """
+    result = {}
+    for chunk in _chunks(uids, IMAP_MSGID_CHUNK):
+        try:
+            typ, data = M.uid("fetch", _uid_set(chunk), "(X-GM-MSGID)")
+        except Exception:
+            return result
+        if typ != "OK":
+            return result
+        for meta, _ in _fetch_responses(data):
+            uid, gm = UID_RE.search(meta), GM_MSGID_RE.search(meta)
+            if uid and gm:
+                result[uid.group(1).decode()] = gm.group(1).decode()
+    return result
+
+
+def _fetch_structures(M: imaplib.IMAP4, uids) -> dict:
+    """
+    {uid: (From, BodyPart ή None)} με ένα UID FETCH (ENVELOPE BODYSTRUCTURE)·
+    μηνύματα χωρίς (αναγνώσιμο) BODYSTRUCTURE λείπουν από το αποτέλεσμα.
+    """
+    typ, data = M.uid("fetch", _uid_set(uids), "(UID ENVELOPE BODYSTRUCTURE)")
+    if typ != "OK":
+        raise imaplib.IMAP4.error(f"FETCH BODYSTRUCTURE: {typ}")
+    result = {}
+    for response in parse_fetch(data):
+        uid, structure = response.get(b"UID"), response.get(b"BODYSTRUCTURE")
+        if not uid or not isinstance(structure, list):
+            continue
+        try:
+            part = find_booking_part(structure)
+        except Exception:
+            continue
+        result[uid.decode()] = (_decode(envelope_from(response.get(b"ENVELOPE"))), part)
+    return result
+
+
+def _part_limit(part) -> int:
+    # Από το κείμενο αρκεί η αρχή του· το PDF κατεβαίνει ολόκληρο.
+    return part.size if is_pdf(part) else min(part.size, IMAP_TEXT_MAX)
+
+
+def _section_value(response, section):
+    # BODY[2] ή, σε partial fetch, BODY[2]<0>
+    prefix = f"BODY[{section}]".encode()
+    for key, value in response.items():
+        if isinstance(key, bytes) and key.startswith(prefix):
+            return value if isinstance(value, bytes) else b""
     return None
 
 
+def _download_parts(M: imaplib.IMAP4, wanted):
+    """
+    Κατεβάζει μόνο τα μέρη του wanted [(uid, BodyPart)] με BODY.PEEK[section]
+    και δίνει (uid, part, spool) με το spool (SpooledTemporaryFile) στην αρχή.
+    Τα μικρά μέρη του ίδιου section έρχονται μαζί σε ένα FETCH (έως
+    IMAP_PART_CHUNK bytes συνολικά)· τα μεγάλα σε κομμάτια των IMAP_PART_CHUNK,
+    ώστε στη μνήμη να μένει το πολύ ένα κομμάτι. spool = None αν ο server δεν
+    έδωσε το μέρος, ή το exception αν απέτυχε το FETCH.
+    """
+    groups, large = {}, []
+    for uid_str, part in wanted:
+        if _part_limit(part) > IMAP_PART_CHUNK:
+            large.append((uid_str, part))
+            continue
+        batches = groups.setdefault((part.section, is_pdf(part)), [[]])
+        if batches[-1] and sum(_part_limit(p) for _, p in batches[-1]) + _part_limit(part) > IMAP_PART_CHUNK:
+            batches.append([])
+        batches[-1].append((uid_str, part))
+
+    for (section, pdf), batches in groups.items():
+        item = f"BODY.PEEK[{section}]" if pdf else f"BODY.PEEK[{section}]<0.{IMAP_TEXT_MAX}>"
+        for batch in batches:
+            try:
+                typ, data = M.uid("fetch", _uid_set(uid for uid, _ in batch), f"(UID {item})")
+                if typ != "OK":
+                    raise imaplib.IMAP4.error(f"FETCH {item}: {typ}")
+                values = {}
+                for response in parse_fetch(data):
+                    uid = response.get(b"UID")
+                    if uid:
+                        values[uid.decode()] = _section_value(response, section)
+            except Exception as exc:
+                for uid_str, part in batch:
+                    yield uid_str, part, exc
+                continue
+            for uid_str, part in batch:
+                value = values.pop(uid_str, None)
+                yield uid_str, part, None if value is None else _spool(part, [value])
+
+    for uid_str, part in large:
+        try:
+            yield uid_str, part, _spool(part, _fetch_ranges(M, uid_str, part))
+        except Exception as exc:
+            yield uid_str, part, exc
+
+
+def _fetch_ranges(M: imaplib.IMAP4, uid_str, part):
+    """Το μέρος σε κομμάτια με BODY.PEEK[section]<offset.IMAP_PART_CHUNK>."""
+    offset = 0
+    while offset < _part_limit(part):
+        typ, data = M.uid("fetch", uid_str, f"(UID BODY.PEEK[{part.section}]<{offset}.{IMAP_PART_CHUNK}>)")
+        if typ != "OK":
+            raise imaplib.IMAP4.error(f"FETCH BODY[{part.section}]<{offset}>: {typ}")
+        chunk = next((_section_value(r, part.section) for r in parse_fetch(data)), None) or b""
+        yield chunk
+        if len(chunk) < IMAP_PART_CHUNK:
+            break  # το size του BODYSTRUCTURE είναι ενδεικτικό
+        offset += len(chunk)
+
+
+def _spool(part, chunks):
+    """Αποκωδικοποιεί (base64/quoted-printable) τα chunks σε SpooledTemporaryFile."""
+    spool = tempfile.SpooledTemporaryFile(max_size=IMAP_SPOOL_MEMORY)
+    try:
+        decoder = PartDecoder(part.encoding, spool)
+        for chunk in chunks:
+            decoder.write(chunk)
+        decoder.close()
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def _known_message_ids(company: Company, mailbox: Optional[Mailbox], folder: str):
+    """
+    (gm_msgids, uids, content_hashes) των κρατήσεων της εταιρείας, με ένα query.
+    Τα X-GM-MSGID και τα hashes ισχύουν για όλη την εταιρεία· τα UIDs μόνο για
+    το ίδιο mailbox και φάκελο (σε άλλον λογαριασμό το ίδιο UID είναι άλλο μήνυμα).
+    Hashes κρατήσεων με pdf_error (timeout/memory/error) δεν μετράνε: ένα νέο
+    αντίγραφο του ίδιου PDF ξαναδοκιμάζεται.
+    """
+    gm_msgids, uids, content_hashes = set(), set(), set()
+    rows = Booking.objects.filter(company=company).values_list(
+        "gm_msgid", "source_email_uid", "mailbox_id", "source_folder", "content_hash", "pdf_error"
+    )
+    mailbox_id = mailbox.pk if mailbox else None
+    for gm_msgid, uid, uid_mailbox_id, uid_folder, content_hash, pdf_error in rows:
+        if gm_msgid:
+            gm_msgids.add(gm_msgid)
+        if uid and uid_mailbox_id == mailbox_id and uid_folder == folder:
+            uids.add(uid)
+        if content_hash and not pdf_error:
+            content_hashes.add(content_hash)
+    return gm_msgids, uids, content_hashes
+
+
+def _sha256(content) -> str:
+    """SHA-256 (hex) ενός PDF σε bytes ή spool· το spool διαβάζεται σε κομμάτια και ξαναγυρίζει στην αρχή."""
+    if isinstance(content, bytes):
+        return hashlib.sha256(content).hexdigest()
+    digest = hashlib.sha256()
+    for block in iter(lambda: content.read(IMAP_PART_CHUNK), b""):
+        digest.update(block)
+    content.seek(0)
+    return digest.hexdigest()
+
+
 def _save_pdf(company: Company, filename: str, content: bytes) -> str:
     rel_dir = f"bookings/{company.id}/{now().strftime('%Y/%m/%d')}/"
     base_path = Path(settings.MEDIA_ROOT) / rel_dir
@@ -101,19 +290,16 @@ def _save_pdf(company: Company, filename: str, content: bytes) -> str:
         counter += 1
 
     with open(full_abs, "wb") as f:
-        f.write(content)
+        if isinstance(content, bytes):
+            f.write(content)
+        else:
+            shutil.copyfileobj(content, f)  # spool: χωρίς να φορτωθεί όλο στη μνήμη
     return full_rel
 
 
-def _parse_pdf_bytes(pdf_bytes: bytes) -> dict:
-    from io import BytesIO
+def _parse_text(text: str) -> dict:
     try:
-        try:
-            from pdfminer.high_level import extract_text
-            text = extract_text(BytesIO(pdf_bytes)) or ""
-        except Exception:
-            text = ""
-        return parse_booking_text(text)
+        return parse_booking_text(text or "")
     except Exception:
         return {}
 
@@ -122,156 +308,481 @@ class Command(BaseCommand):
     help = "Εισαγωγή κρατήσεων από email (IMAP) με parsing PDF, dedupe (X-GM-MSGID/UID) και προαιρετικό auto-convert."
 
     def add_arguments(self, parser):
-        parser.add_argument("--company", required=True, help="Όνομα εταιρείας (Company.name).")
-        parser.add_argument("--folder", default=DEFAULT_FOLDER, help="IMAP φάκελος (π.χ. [Gmail]/All Mail).")
+        parser.add_argument("--company", help="Όνομα εταιρείας (Company.name)· λογαριασμός IMAP από το .env.")
+        parser.add_argument("--mailbox", type=int, default=None,
+                            help="Id του Mailbox: εταιρεία, λογαριασμός, φάκελος και αποστολέας από τη βάση.")
+        parser.add_argument("--folder", default=None, help=f"IMAP φάκελος (default: {DEFAULT_FOLDER}).")
         parser.add_argument("--include-seen", action="store_true", help="Συμπερίληψη SEEN.")
         parser.add_argument("--no-include-seen", dest="include_seen", action="store_false")
         parser.set_defaults(include_seen=True)
 
-        parser.add_argument("--sender", default=IMAP_SENDER_FILTER, help="Φίλτρο αποστολέα (FROM:).")
+        parser.add_argument("--sender", default=None, help="Φίλτρο αποστολέα (FROM:).")
         parser.add_argument("--raw-query", default=None, help="Ωμή IMAP query (SEARCH).")
         parser.add_argument("--gm-raw", default=None, help="Gmail RAW (X-GM-RAW).")
         parser.add_argument("--mark-seen", action="store_true", help="Σημάδεψε ως SEEN αφού εισαχθούν.")
         parser.add_argument("--auto-convert", action="store_true",
                             help="Μετά το import, δημιουργεί αυτόματα RentalRequest & RentalDecision και αλλάζει status=active.")
+        parser.add_argument("--full-sync", action="store_true",
+                            help="Αγνοεί το αποθηκευμένο last UID και ψάχνει όλο τον φάκελο.")
 
     def handle(self, *args, **opts):
+        # Μένουν στο instance για όποιον καλεί το command με call_command(Command(), ...).
+        stats = self.stats = {"imported": 0, "skipped": 0, "converted": 0, "errors": 0, "duplicates": 0}
         company_name = opts["company"]
-        folder = opts["folder"]
         include_seen = opts["include_seen"]
-        sender = opts["sender"]
         raw_query = opts["raw_query"]
         gm_raw = opts["gm_raw"]
         mark_seen = opts["mark_seen"]
         auto_convert = opts["auto_convert"]
 
-        company = Company.objects.filter(name__iexact=company_name).first()
-        if not company:
-            raise CommandError(f"Δεν βρέθηκε Company με name='{company_name}'")
-
+        mailbox, account = None, None
+        if opts["mailbox"] is not None:
+            mailbox = Mailbox.objects.select_related("company").filter(pk=opts["mailbox"]).first()
+            if not mailbox:
+                raise CommandError(f"Δεν βρέθηκε Mailbox με id={opts['mailbox']}")
+            company, account = mailbox.company, mailbox.account()
+        elif company_name:
+            company = Company.objects.filter(name__iexact=company_name).first()
+            if not company:
+                raise CommandError(f"Δεν βρέθηκε Company με name='{company_name}'")
+        else:
+            raise CommandError("Δώσε --company ή --mailbox.")
+        folder = opts["folder"] or (mailbox.folder if mailbox else DEFAULT_FOLDER)
+        sender = opts["sender"] or (mailbox.sender_filter if mailbox else IMAP_SENDER_FILTER) or None
+
+        # Σύνδεση από το κοινό pool (χωρίς TLS/LOGIN αν υπάρχει ήδη ανοιχτή για τον φάκελο).
         try:
-            M = _connect()
+            session = session_manager.checkout(folder, account)
         except Exception as e:
             raise CommandError(f"IMAP σύνδεση απέτυχε: {e}")
-
+        # Από εδώ και πέρα κάθε έξοδος (return, CommandError, exception) περνά από το
+        # finally, ώστε η σύνδεση να επιστρέφει πάντα στο pool ή να κλείνει.
+        broken = True
         try:
-            _select_folder(M, folder)
-        except Exception:
-            M.logout()
-            raise
+            M = session.M
+            uidvalidity, highest_modseq = session.uidvalidity, session.highest_modseq
 
-        try:
             mode, query = _search_query(include_seen, sender, raw_query, gm_raw)
-            if mode == "gm":
-                typ, data = M.uid("search", "X-GM-RAW", query)
-            elif mode == "raw":
-                typ, data = M.search(None, *query.split())
-            else:
-                typ, data = M.search(None, *query.split())
-            if typ != "OK":
-                raise CommandError(f"IMAP search error: {typ}")
-            uids = data[0].split()
-        except Exception as e:
-            M.logout()
-            raise CommandError(f"Αποτυχία στο search: {e}")
 
-        imported, skipped, converted, errors = 0, 0, 0, 0
-
-        for uid in uids:
-            uid_str = uid.decode() if isinstance(uid, bytes) else str(uid)
+            # Incremental sync μόνο για το κανονικό search (όχι για ad-hoc --raw-query/--gm-raw):
+            # ψάχνει μόνο UID > last_uid, εκτός αν άλλαξε το UIDVALIDITY του φακέλου.
+            state, since_uid, failures = None, 0, {}
+            if mode == "std":
+                state, _ = MailboxSyncState.objects.get_or_create(company=company, mailbox=mailbox, folder=folder)
+                failures = dict(state.failures)
+                if state.uidvalidity is not None and state.uidvalidity != uidvalidity:
+                    failures = {}  # άλλα UIDs πια
+                    self.stdout.write(self.style.WARNING(
+                        f"🔄 Άλλαξε το UIDVALIDITY του {folder} ({state.uidvalidity} → {uidvalidity}): πλήρες sync."
+                    ))
+                elif not opts["full_sync"]:
+                    since_uid = state.last_uid
+                    # CONDSTORE: ίδιο HIGHESTMODSEQ = τίποτα δεν άλλαξε στον φάκελο, ούτε καν search.
+                    if since_uid and highest_modseq is not None and highest_modseq == state.highest_modseq:
+                        broken = False
+                        self.stdout.write(self.style.SUCCESS(f"✅ Καμία αλλαγή στο {folder} (UID {since_uid})."))
+                        return
 
             try:
-                gm_msgid = _extract_x_gm_msgid(M, uid_str)
-
-                qs = Booking.objects.filter(company=company)
+                # UID SEARCH: τα αποτελέσματα είναι UIDs (όχι sequence numbers) όπως περιμένουν τα UID FETCH.
+                since = ["UID", f"{since_uid + 1}:*"] if since_uid else []
+                if mode == "gm":
+                    typ, data = M.uid("search", "X-GM-RAW", query)
+                else:
+                    typ, data = M.uid("search", None, *since, *query.split())
+                if typ != "OK":
+                    raise CommandError(f"IMAP search error: {typ}")
+                # Το "N:*" επιστρέφει πάντα και το τελευταίο μήνυμα, ακόμα κι αν έχει UID < N.
+                uids = [u.decode() if isinstance(u, bytes) else str(u) for u in data[0].split()]
+                uids = [u for u in uids if int(u) > since_uid]
+            except Exception as e:
+                raise CommandError(f"Αποτυχία στο search: {e}")
+
+            failed = []  # UIDs που πρέπει να ξαναδοκιμαστούν (το watermark μένει πριν από αυτά)
+            seen_uids = []
+
+            # Κρατήσεις που περιμένουν να γραφτούν· ένα transaction ανά BOOKING_WRITE_BATCH.
+            buffered = []
+
+            # Νέες εγγραφές του cache εξαγωγής (PdfExtraction), γράφονται μαζί με το batch.
+            extractions = []
+
+            def store(uid_str, gm_msgid, parsed, pdf_rel_path="", pdf_error="", content_hash=""):
+                buffered.append(self._build_booking(
+                    company, parsed, uid_str, gm_msgid, pdf_rel_path, pdf_error, content_hash, mailbox, folder
+                ))
                 if gm_msgid:
-                    if qs.filter(gm_msgid=str(gm_msgid)).exists():
-                        skipped += 1
-                        continue
+                    known_gm_msgids.add(gm_msgid)
+                known_uids.add(uid_str)
+                if len(buffered) >= BOOKING_WRITE_BATCH:
+                    flush()
+
+            def flush():
+                if extractions:
+                    try:
+                        # ignore_conflicts: το ίδιο PDF μπορεί να το έβγαλε στο μεταξύ κι άλλο import.
+                        PdfExtraction.objects.bulk_create(extractions, ignore_conflicts=True)
+                    except Exception:
+                        traceback.print_exc(file=sys.stderr)  # το cache δεν ρίχνει το import
+                    extractions.clear()
+                bookings = buffered[:]
+                buffered.clear()
+                for booking, error, converted in self._write_bookings(bookings, auto_convert):
+                    uid_str = booking.source_email_uid
+                    if error:
+                        stats["errors"] += 1
+                        if booking.pk is None:
+                            failed.append(uid_str)
+                            continue
+                    stats["imported"] += 1
+                    stats["converted"] += converted
+                    seen_uids.append(uid_str)
+                    if booking.pdf_error:
+                        self.stdout.write(self.style.WARNING(
+                            f"⚠️ PDF του UID {uid_str}: {booking.pdf_error}· "
+                            f"η κράτηση #{booking.id} καταχωρήθηκε χωρίς στοιχεία."
+                        ))
+
+            # PDF σε εξέλιξη στο process pool: (job, uid, gm_msgid, pdf_rel_path, content_hash).
+            # Ολοκληρώνονται όσο γίνεται το επόμενο fetch (pipeline) και στο τέλος.
+            pdf_jobs = []
+
+            def finish_pdfs(wait):
+                # Όσα είναι έτοιμα· με wait όλα. Πάνω από pdf_extractor.capacity σε αναμονή
+                # περιμένει τα παλαιότερα, ώστε η ουρά του pool να μένει φραγμένη.
+                while pdf_jobs and (wait or pdf_jobs[0][0].done() or len(pdf_jobs) > pdf_extractor.capacity):
+                    job, uid_str, gm_msgid, pdf_rel_path, content_hash = pdf_jobs.pop(0)
+                    text, pdf_error = pdf_extractor.result(job)
+                    parsed = _parse_text(text)
+                    if not pdf_error:
+                        # Μόνο επιτυχείς εξαγωγές: ένα timeout ίσως περάσει την επόμενη φορά.
+                        extractions.append(PdfExtraction(content_hash=content_hash, text=text, parsed=parsed))
+                    store(uid_str, gm_msgid, parsed, pdf_rel_path, pdf_error, content_hash)
+
+            # Dedupe χωρίς round trip ανά μήνυμα: X-GM-MSGID όλων με λίγα UID FETCH,
+            # γνωστά ids της εταιρείας με ένα query, και μόνο τα νέα κατεβαίνουν.
+            gm_msgids = _fetch_gm_msgids(M, uids)
+            known_gm_msgids, known_uids, known_hashes = _known_message_ids(company, mailbox, folder)
+            pending = []
+            for uid_str in uids:
+                gm_msgid = gm_msgids.get(uid_str)
+                if (gm_msgid in known_gm_msgids) if gm_msgid else (uid_str in known_uids):
+                    stats["skipped"] += 1
+                elif failures.get(uid_str, 0) >= IMAP_MAX_ATTEMPTS:
+                    stats["skipped"] += 1  # εγκαταλείφθηκε σε προηγούμενο run
                 else:
-                    if qs.filter(source_email_uid=str(uid_str)).exists():
-                        skipped += 1
+                    pending.append(uid_str)
+
+            def handle_message(uid_str, gm_msgid, message):
+                if message is None:
+                    stats["skipped"] += 1
+                elif message["pdf"] is not None:
+                    job = pdf_extractor.submit(message["pdf"])
+                    pdf_jobs.append((job, uid_str, gm_msgid, message["pdf_path"], message["content_hash"]))
+                else:
+                    store(uid_str, gm_msgid, message["parsed"], message["pdf_path"], "", message["content_hash"])
+
+            def message_failed(uid_str):
+                stats["errors"] += 1
+                failed.append(uid_str)
+                traceback.print_exc(file=sys.stderr)
+
+            def import_whole(whole):
+                # Χωρίς (αναγνώσιμο) BODYSTRUCTURE: όλο το μήνυμα, όπως παλιά.
+                try:
+                    typ, fetched = M.uid("fetch", _uid_set(whole), "(UID BODY.PEEK[])")
+                except Exception:
+                    traceback.print_exc(file=sys.stderr)
+                    stats["errors"] += len(whole)
+                    failed.extend(whole)
+                    return
+                if typ != "OK":
+                    stats["skipped"] += len(whole)
+                    failed.extend(whole)
+                    return
+
+                responses = [(meta, raw) for meta, raw in _fetch_responses(fetched) if raw is not None]
+                stats["skipped"] += max(len(whole) - len(responses), 0)  # π.χ. διαγράφηκαν μετά το search
+                for meta, raw in responses:
+                    uid_match = UID_RE.search(meta)
+                    uid_str = uid_match.group(1).decode() if uid_match else ""
+                    gm_match = GM_MSGID_RE.search(meta)
+                    gm_msgid = gm_msgids.get(uid_str) or (gm_match.group(1).decode() if gm_match else "")
+                    try:
+                        message = self._read_message(company, raw, sender, known_hashes)
+                    except Exception:
+                        message_failed(uid_str)
                         continue
-
-                typ, fetched = M.uid("fetch", uid_str, "(BODY.PEEK[] UID X-GM-MSGID)")
-                if typ != "OK" or not fetched or not fetched[0]:
-                    skipped += 1
+                    handle_message(uid_str, gm_msgid, message)
+
+            for chunk in _chunks(pending, IMAP_FETCH_CHUNK):
+                # Τα PDF του προηγούμενου chunk δουλεύονται στο pool όσο γίνεται αυτό το fetch.
+                # Πρώτα ENVELOPE/BODYSTRUCTURE, ώστε να κατέβει μόνο το μέρος με την κράτηση
+                # (όχι εικόνες, zip κ.λπ.).
+                try:
+                    structures = _fetch_structures(M, chunk)
+                except Exception:
+                    traceback.print_exc(file=sys.stderr)
+                    stats["errors"] += len(chunk)
+                    failed.extend(chunk)
                     continue
 
-                raw = fetched[0][1] if isinstance(fetched[0], tuple) else fetched[0]
-                if isinstance(raw, bytes):
-                    msg = email.message_from_bytes(raw)
-                else:
-                    msg = email.message_from_string(raw)
-
-                from_hdr = _decode(msg.get("From", ""))
-                # extra έλεγχος αποστολέα, αν δόθηκε
-@@ -219,52 +219,53 @@ class Command(BaseCommand):
-                body_text = ""
-                parsed = {}
-                pdf_rel_path = ""
-                pdf_found = False
-                for part in msg.walk():
-                    if part.get_content_maintype() == "multipart":
+                wanted, whole = [], []
+                for uid_str in chunk:
+                    if uid_str not in structures:
+                        whole.append(uid_str)
                         continue
-                    cdisp = part.get("Content-Disposition", "")
-                    ctype = part.get_content_type()
-                    if "attachment" in cdisp or ctype == "application/pdf":
-                        filename = part.get_filename() or "attachment.pdf"
-                        filename = _decode(filename)
-                        payload = part.get_payload(decode=True) or b""
-                        if not payload:
-                            continue
-                        pdf_rel_path = _save_pdf(company, filename, payload)
-                        pdf_found = True
-                        parsed = _parse_pdf_bytes(payload)
-                        break
-                    elif ctype in ("text/plain", "text/html") and not body_text:
-                        payload = part.get_payload(decode=True) or b""
-                        try:
-                            body_text = payload.decode(part.get_content_charset() or "utf-8", errors="ignore")
-                        except Exception:
-                            body_text = payload.decode("utf-8", errors="ignore")
-                        if ctype == "text/html":
-                            body_text = re.sub(r"<[^>]+>", " ", body_text)
-
-                if not pdf_found:
-                    if body_text:
-                        parsed = parse_booking_text(body_text)
+                    from_hdr, part = structures[uid_str]
+                    # extra έλεγχος αποστολέα, αν δόθηκε
+                    if part is None or (sender and sender.lower() not in from_hdr.lower()):
+                        stats["skipped"] += 1
                     else:
-                        skipped += 1
-                        continue
+                        wanted.append((uid_str, part))
 
-                booking = Booking.objects.create(
-                    company=company,
-                    customer_name=parsed.get("customer_name", "") or "",
-                    customer_email=parsed.get("customer_email", "") or "",
-                    customer_phone=parsed.get("customer_phone", "") or "",
-                    booking_code=parsed.get("booking_code", "") or "",
-                    start_date=parsed.get("start_date"),
-                    end_date=parsed.get("end_date"),
-                    total_price=parsed.get("total_price"),
-                    requested_category=parsed.get("requested_category", "") or "",
-                    extra_insurance=bool(parsed.get("extra_insurance", False)),
-                    status="imported",
-                    source_email_uid=str(uid_str or ""),
-                    gm_msgid=str(gm_msgid or ""),
-                    raw_pdf_path=pdf_rel_path,
-                )
-                imported += 1
-
-                if auto_convert:
-                    # δημιουργία RentalRequest & RentalDecision, update status
+                for uid_str, part, spool in _download_parts(M, wanted):
+                    if spool is None:
+                        stats["skipped"] += 1  # π.χ. διαγράφηκε μετά το search
+                        continue
+                    if isinstance(spool, Exception):
+                        stats["errors"] += 1
+                        failed.append(uid_str)
+                        print(f"FETCH του UID {uid_str} απέτυχε: {spool}", file=sys.stderr)
+                        continue
                     try:
-                        rr, dec = booking.to_rental_request()
-                        booking.status = "active"
-                        booking.save(update_fields=["status"])
-                        converted += 1
+                        with spool:
+                            message = self._read_part(company, part, spool, known_hashes)
                     except Exception:
-                        errors += 1
-
-                if mark_seen:
+                        message_failed(uid_str)
+                        continue
+                    handle_message(uid_str, gm_msgids.get(uid_str, ""), message)
+
+                if whole:
+                    import_whole(whole)
+                finish_pdfs(wait=False)
+            finish_pdfs(wait=True)
+            flush()
+
+            if mark_seen and seen_uids:
+                try:
+                    M.uid("store", _uid_set(seen_uids), "+FLAGS", "(\\Seen)")
+                except Exception:
+                    pass
+            broken = False
+        finally:
+            # Αποτυχίες IMAP στα fetch πιάνονται παραπάνω· αν η σύνδεση έπεσε, το
+            # επόμενο checkout το βλέπει στο SELECT και ανοίγει νέα.
+            session_manager.release(session, broken=broken)
+
+        if state is not None:
+            for uid_str in seen_uids:
+                failures.pop(uid_str, None)
+            for uid_str in set(failed) - {""}:
+                failures[uid_str] = failures.get(uid_str, 0) + 1
+                if failures[uid_str] == IMAP_MAX_ATTEMPTS:
+                    self.stdout.write(self.style.WARNING(
+                        f"⛔ UID {uid_str}: {IMAP_MAX_ATTEMPTS} αποτυχημένες προσπάθειες, δεν ξαναδοκιμάζεται."
+                    ))
+            # Όσα εγκαταλείφθηκαν δεν κρατούν πίσω το watermark.
+            retry = [u for u in failed if failures.get(u, 0) < IMAP_MAX_ATTEMPTS]
+            last_uid = max([int(u) for u in uids] + [since_uid])
+            if retry:
+                # Χωρίς γνωστό UID δεν ξέρουμε μέχρι πού είναι ασφαλές να προχωρήσει.
+                last_uid = min(int(u) for u in retry) - 1 if all(retry) else since_uid
+            state.uidvalidity = uidvalidity
+            state.last_uid = max(last_uid, since_uid)
+            # Μετρητές μόνο για όσα θα ξαναβρεί το search (πάνω από το watermark).
+            state.failures = {u: n for u, n in failures.items() if int(u) > state.last_uid}
+            # Με αποτυχίες το επόμενο poll πρέπει να ψάξει ξανά, όποιο κι αν είναι το HIGHESTMODSEQ.
+            state.highest_modseq = None if retry else highest_modseq
+            state.save()
+            self.stdout.write(f"📬 {folder}: {len(uids)} νέα μηνύματα μετά το UID {since_uid}, last UID {state.last_uid}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Imported: {stats['imported']} | Skipped: {stats['skipped']} | "
+            f"Converted: {stats['converted']} | Errors: {stats['errors']}"
+        ))
+        if stats["duplicates"]:
+            self.stdout.write(f"♻️ Ίδιο PDF με υπάρχουσα κράτηση (μέσα στα Skipped): {stats['duplicates']}")
+        sessions = session_manager.stats()
+        self.stdout.write(
+            f"🔌 IMAP: {'επαναχρησιμοποίηση σύνδεσης' if session.reused else 'νέα σύνδεση'} "
+            f"(συνδέσεις {sessions['connects']}, επαναχρησιμοποιήσεις {sessions['reuses']}, "
+            f"επανασυνδέσεις {sessions['reconnects']})"
+        )
+
+    def _read_pdf(self, company, filename, content, known_hashes):
+        """
+        Dedupe με το SHA-256 του PDF: αν η εταιρεία έχει ήδη κράτηση με το ίδιο
+        PDF (forward, resend) δεν αποθηκεύεται ούτε γίνεται εξαγωγή (None). Αν
+        το PDF είναι στο cache (PdfExtraction, μόνο επιτυχημένες εξαγωγές), τα
+        πεδία έρχονται από εκεί και το "pdf" είναι None (χωρίς pdfminer).
+        """
+        content_hash = _sha256(content)
+        if content_hash in known_hashes:
+            self.stats["duplicates"] += 1
+            return None
+        known_hashes.add(content_hash)  # και για αντίγραφα στο ίδιο run
+        pdf_rel_path = _save_pdf(company, filename, content)
+        cached = PdfExtraction.objects.filter(content_hash=content_hash).first()
+        return {
+            "parsed": cached.fields() if cached else None,
+            "pdf": None if cached else str(Path(settings.MEDIA_ROOT) / pdf_rel_path),
+            "pdf_path": pdf_rel_path,
+            "content_hash": content_hash,
+        }
+
+    def _read_part(self, company, part, spool, known_hashes):
+        """Όπως το _read_message, για ένα μόνο μέρος (PDF ή κείμενο) που κατέβηκε στο spool."""
+        if is_pdf(part):
+            return self._read_pdf(company, _decode(part.filename) or "attachment.pdf", spool, known_hashes)
+
+        payload = spool.read()
+        try:
+            body_text = payload.decode(part.charset or "utf-8", errors="ignore")
+        except LookupError:
+            body_text = payload.decode("utf-8", errors="ignore")
+        if part.content_type == "text/html":
+            body_text = re.sub(r"<[^>]+>", " ", body_text)
+        if not body_text:
+            return None
+        return {"parsed": parse_booking_text(body_text), "pdf": None, "pdf_path": "", "content_hash": ""}
+
+    def _read_message(self, company, raw, sender, known_hashes):
+        """
+        {"parsed", "pdf", "pdf_path", "content_hash"} ενός μηνύματος· το "pdf"
+        (path του αρχείου) περιμένει εξαγωγή κειμένου στο pool. None αν δεν είναι
+        κράτηση (αποστολέας, χωρίς PDF/κείμενο) ή αν το PDF υπάρχει ήδη.
+        """
+        if isinstance(raw, bytes):
+            msg = email.message_from_bytes(raw)
+        else:
+            msg = email.message_from_string(raw)
+
+        from_hdr = _decode(msg.get("From", ""))
+        # extra έλεγχος αποστολέα, αν δόθηκε
+        if sender and sender.lower() not in from_hdr.lower():
+            return None
+
+        body_text = ""
+        for part in msg.walk():
+            if part.get_content_maintype() == "multipart":
+                continue
+            cdisp = part.get("Content-Disposition", "")
+            ctype = part.get_content_type()
+            if "attachment" in cdisp or ctype == "application/pdf":
+                filename = part.get_filename() or "attachment.pdf"
+                filename = _decode(filename)
+                payload = part.get_payload(decode=True) or b""
+                if not payload:
+                    continue
+                return self._read_pdf(company, filename, payload, known_hashes)
+            elif ctype in ("text/plain", "text/html") and not body_text:
+                payload = part.get_payload(decode=True) or b""
+                try:
+                    body_text = payload.decode(part.get_content_charset() or "utf-8", errors="ignore")
+                except Exception:
+                    body_text = payload.decode("utf-8", errors="ignore")
+                if ctype == "text/html":
+                    body_text = re.sub(r"<[^>]+>", " ", body_text)
+
+        if not body_text:
+            return None
+        return {"parsed": parse_booking_text(body_text), "pdf": None, "pdf_path": "", "content_hash": ""}
+
+    def _build_booking(self, company, parsed, uid_str, gm_msgid, pdf_rel_path, pdf_error, content_hash="",
+                       mailbox=None, folder=""):
+        return Booking(
+            company=company,
+            customer_name=parsed.get("customer_name", "") or "",
+            customer_email=parsed.get("customer_email", "") or "",
+            customer_phone=parsed.get("customer_phone", "") or "",
+            booking_code=parsed.get("booking_code", "") or "",
+            start_date=parsed.get("start_date"),
+            end_date=parsed.get("end_date"),
+            total_price=parsed.get("total_price"),
+            requested_category=parsed.get("requested_category", "") or "",
+            extra_insurance=bool(parsed.get("extra_insurance", False)),
+            status="imported",
+            source_email_uid=str(uid_str or ""),
+            mailbox=mailbox,
+            source_folder=folder,
+            gm_msgid=str(gm_msgid or ""),
+            raw_pdf_path=pdf_rel_path,
+            pdf_error=pdf_error,
+            content_hash=content_hash,
+        )
+
+    def _write_bookings(self, bookings, auto_convert):
+        """
+        Γράφει ένα batch κρατήσεων σε ένα transaction: bulk_create, ένα UPDATE
+        για τα booking_code και (με auto_convert) bulk_create των RentalRequest
+        και RentalDecision. Αν κάτι αποτύχει, το batch ξαναγράφεται με ένα
+        savepoint ανά μήνυμα, ώστε το χαλασμένο να μη ρίχνει τα υπόλοιπα (και
+        πάλι ένα INSERT ανά κράτηση και ένα UPDATE για όλα τα booking_code).
+        Επιστρέφει [(booking, error, converted)]· booking.pk None = δεν γράφτηκε.
+        """
+        from recommendations.models import RentalDecision
+
+        if not bookings:
+            return []
+        # Χωρίς ids από το bulk INSERT (π.χ. MySQL) δεν γίνεται το UPDATE των booking_code.
+        if connection.features.can_return_rows_from_bulk_insert:
+            originals = [(booking.booking_code, booking.status) for booking in bookings]
+            try:
+                with transaction.atomic():
+                    self._insert_bookings(bookings, auto_convert)
+                return [(booking, False, auto_convert) for booking in bookings]
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+                for booking, (booking_code, status) in zip(bookings, originals):
+                    booking.pk, booking.booking_code, booking.status = None, booking_code, status
+
+        results = []
+        inserted = []
+        with transaction.atomic():
+            for booking in bookings:
+                # Ένα INSERT ανά κράτηση (ήδη active αν μετατρέπεται)· τα booking_code όλων στο τέλος.
+                if auto_convert:
+                    booking.status = "active"
+                try:
+                    with transaction.atomic():
+                        booking.save(fill_code=False)
+                except Exception:
+                    booking.pk, booking.status = None, "imported"
+                    traceback.print_exc(file=sys.stderr)
+                    results.append((booking, True, False))
+                    continue
+                inserted.append(booking)
+                converted = False
+                if auto_convert:
                     try:
-                        M.uid("store", uid_str, "+FLAGS", "(\\Seen)")
+                        with transaction.atomic():
+                            rr = booking.build_rental_request()
+                            rr.save()
+                            RentalDecision.objects.create(request=rr)
+                        converted = True
                     except Exception:
-                        pass
\ No newline at end of file
+                        # Σπάνιο: η κράτηση μένει, ως imported, χωρίς RentalRequest.
+                        booking.status = "imported"
+                        Booking.objects.filter(pk=booking.pk).update(status="imported")
+                        traceback.print_exc(file=sys.stderr)
+                results.append((booking, auto_convert and not converted, converted))
+            Booking.objects.filter(pk__in=[b.pk for b in inserted]).fill_booking_codes()
+        for booking in inserted:
+            booking.booking_code = booking.booking_code or f"{BOOKING_CODE_PREFIX}{booking.pk}"
+        return results
+
+    def _insert_bookings(self, bookings, auto_convert):
+        from recommendations.models import RentalDecision, RentalRequest
+
+        if auto_convert:
+            for booking in bookings:
+                booking.status = "active"
+        Booking.objects.bulk_create(bookings)
+        Booking.objects.filter(pk__in=[b.pk for b in bookings]).fill_booking_codes()
+        for booking in bookings:
+            booking.booking_code = booking.booking_code or f"{BOOKING_CODE_PREFIX}{booking.pk}"
+        if auto_convert:
+            requests = RentalRequest.objects.bulk_create([booking.build_rental_request() for booking in bookings])
+            # Κενές αποφάσεις: το post_save του feature store δεν κάνει τίποτα γι' αυτές.
+            RentalDecision.objects.bulk_create([RentalDecision(request=rr) for rr in requests])
@@ -1,39 +1,106 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.core.management import call_command
-from recommendations.models import RentalRequest, RentalDecision
-from rentals.models import Company
-from django.utils import timezone
+from django.db import connections
+
+from recommendations.retraining import (
+    claim_retrain,
+    companies_with_new_samples,
+    init_worker,
+    release_retrain,
+    retrain_company,
+)
 
 
 class Command(BaseCommand):
     help = "Retrains AI model for each company only if new data exists."
 
-    def handle(self, *args, **options):
-        retrained = 0
-
-        for company in Company.objects.all():
-            last_trained = company.last_trained
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Πλήρες training για όλες (αλλιώς incremental, με πλήρες μόνο βάσει προγράμματος/drift).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=getattr(settings, "RECOMMENDATION_RETRAIN_WORKERS", 0),
+            help="Παράλληλα processes (0 = όσοι οι πυρήνες, 1 = σειριακά σε αυτή τη διεργασία).",
+        )
 
-            # Βρες rental requests με chosen_car που έγιναν μετά το last_trained (ή όλα αν είναι πρώτη φορά)
-            decisions_qs = RentalDecision.objects.filter(
-                request__company=company,
-                chosen_car__isnull=False,
-            )
-            if last_trained:
-                decisions_qs = decisions_qs.filter(request__created_at__gt=last_trained)
+    def handle(self, *args, **options):
+        incremental = not options["full"]
+        started = time.perf_counter()
 
-            decision_count = decisions_qs.count()
+        # Ένα query για όλες τις εταιρείες.
+        # Το last_trained το ενημερώνει το ίδιο το train_model (με την ώρα πριν το training).
+        # Το ίδιο claim (retrain_started_at) με το αυτόματο retrain: ποτέ δύο ταυτόχρονα για μία εταιρεία.
+        claims = {}  # username -> (company_id, ώρα του claim)
+        for company in companies_with_new_samples():
+            username = company.user.username
+            if company.new_samples < 1:
+                self.stdout.write(f"⏭️ Skip: {username} (no new data)")
+                continue
+            claimed_at = claim_retrain(company.id)
+            if claimed_at is None:
+                self.stdout.write(f"⏭️ Skip: {username} (retrain σε εξέλιξη)")
+                continue
+            self.stdout.write(f"📊 Retraining for: {username} ({company.new_samples} new samples)")
+            claims[username] = (company.id, claimed_at)
 
-            if decision_count >= 1:
-                self.stdout.write(f"📊 Retraining for: {company.user.username} ({decision_count} new samples)")
-                call_command("train_model", company.user.username)
+        if not claims:
+            self.stdout.write("\n✅ Ολοκληρώθηκε retrain για 0 εταιρείες.")
+            return
 
-                # ✅ Ενημερώνουμε το last_trained
-                company.last_trained = timezone.now()
-                company.save(update_fields=["last_trained"])
+        usernames = list(claims)
+        workers = min(options["workers"] or os.cpu_count() or 1, len(usernames))
+        try:
+            if workers <= 1:
+                results = [retrain_company(u, incremental) for u in usernames]
+            else:
+                results = self._run_pool(usernames, incremental, workers)
+        finally:
+            for company_id, claimed_at in claims.values():
+                release_retrain(company_id, claimed_at)
 
-                retrained += 1
+        failed = 0
+        for result in sorted(results, key=lambda r: r["username"]):
+            if options["verbosity"] > 1 and result["output"]:
+                self.stdout.write(result["output"].rstrip())
+            if result["ok"]:
+                self.stdout.write(self.style.SUCCESS(f"✅ {result['username']}: {result['seconds']:.1f}s"))
             else:
-                self.stdout.write(f"⏭️ Skip: {company.user.username} (no new data)")
+                failed += 1
+                self.stdout.write(self.style.ERROR(
+                    f"❌ {result['username']}: {result['seconds']:.1f}s\n{result['error']}"
+                ))
+
+        self.stdout.write(
+            f"\n✅ Ολοκληρώθηκε retrain για {len(results) - failed} εταιρείες"
+            f"{f', ❌ {failed} απέτυχαν' if failed else ''} "
+            f"({workers} workers, {time.perf_counter() - started:.1f}s)."
+        )
 
-        self.stdout.write(f"\n✅ Ολοκληρώθηκε retrain για {retrained} εταιρείες.")
+    def _run_pool(self, usernames, incremental, workers):
+        # Καμία ανοιχτή σύνδεση DB δεν πρέπει να περάσει στα child processes·
+        # με spawn κάθε worker κάνει δικό του django.setup().
+        connections.close_all()
+        results = []
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        ) as pool:
+            futures = {pool.submit(retrain_company, u, incremental): u for u in usernames}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:  # π.χ. ο worker σκοτώθηκε (OOM)
+                    results.append({
+                        "username": futures[future], "ok": False, "seconds": 0.0, "output": "", "error": str(e),
+                    })
+        return results
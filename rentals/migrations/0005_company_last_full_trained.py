@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rentals", "0004_alter_booking_dates"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="company",
+            name="last_full_trained",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.23 on 2026-10-17 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rentals", "0005_company_last_full_trained"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="company",
+            name="pending_samples",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="company",
+            name="pending_since",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="company",
+            name="retrain_started_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
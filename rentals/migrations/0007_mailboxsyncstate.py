@@ -0,0 +1,30 @@
+# Generated by Django 4.2.23 on 2026-10-17 12:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rentals", "0006_company_pending_retrain"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailboxSyncState",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("folder", models.CharField(max_length=255)),
+                ("uidvalidity", models.BigIntegerField(blank=True, null=True)),
+                ("last_uid", models.BigIntegerField(default=0)),
+                ("highest_modseq", models.BigIntegerField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("company", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="mailbox_sync_states", to="rentals.company")),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="mailboxsyncstate",
+            constraint=models.UniqueConstraint(fields=("company", "folder"), name="uniq_mailbox_sync_state"),
+        ),
+    ]
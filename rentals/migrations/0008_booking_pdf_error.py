@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-17 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rentals", "0007_mailboxsyncstate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="booking",
+            name="pdf_error",
+            field=models.CharField(blank=True, max_length=20),
+        ),
+    ]
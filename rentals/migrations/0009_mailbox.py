@@ -0,0 +1,68 @@
+# Generated by Django 4.2.23 on 2026-10-17 14:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rentals", "0008_booking_pdf_error"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Mailbox",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("host", models.CharField(default="imap.gmail.com", max_length=255)),
+                ("username", models.CharField(max_length=255)),
+                ("password", models.CharField(max_length=255)),
+                ("folder", models.CharField(default="[Gmail]/All Mail", max_length=255)),
+                ("sender_filter", models.CharField(blank=True, max_length=255)),
+                ("enabled", models.BooleanField(default=True)),
+                ("use_idle", models.BooleanField(default=True)),
+                ("last_checked_at", models.DateTimeField(blank=True, null=True)),
+                ("last_error", models.TextField(blank=True)),
+                (
+                    "company",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="mailboxes",
+                        to="rentals.company",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="mailboxsyncstate",
+            name="mailbox",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="sync_states",
+                to="rentals.mailbox",
+            ),
+        ),
+        migrations.RemoveConstraint(
+            model_name="mailboxsyncstate",
+            name="uniq_mailbox_sync_state",
+        ),
+        migrations.AddConstraint(
+            model_name="mailboxsyncstate",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("mailbox__isnull", True)),
+                fields=("company", "folder"),
+                name="uniq_mailbox_sync_state",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="mailboxsyncstate",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("mailbox__isnull", False)),
+                fields=("mailbox", "folder"),
+                name="uniq_mailbox_sync_state_mailbox",
+            ),
+        ),
+    ]
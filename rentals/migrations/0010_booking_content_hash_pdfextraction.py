@@ -0,0 +1,33 @@
+# Generated by Django 4.2.23
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rentals", "0009_mailbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="booking",
+            name="content_hash",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name="booking",
+            index=models.Index(fields=["company", "content_hash"], name="rentals_boo_company_1139dd_idx"),
+        ),
+        migrations.CreateModel(
+            name="PdfExtraction",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("content_hash", models.CharField(max_length=64, unique=True)),
+                ("text", models.TextField(blank=True)),
+                ("parsed", models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
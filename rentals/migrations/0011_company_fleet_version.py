@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rentals", "0010_booking_content_hash_pdfextraction"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="company",
+            name="fleet_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rentals", "0011_company_fleet_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="booking",
+            name="mailbox",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="bookings",
+                to="rentals.mailbox",
+            ),
+        ),
+        migrations.AddField(
+            model_name="booking",
+            name="source_folder",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
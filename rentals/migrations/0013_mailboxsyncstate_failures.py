@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rentals", "0012_booking_mailbox_source_folder"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mailboxsyncstate",
+            name="failures",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
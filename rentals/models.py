@@ -1,12 +1,21 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Cast, Concat
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from datetime import timedelta
+import os
 
 class Company(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
     email = models.EmailField(unique=True)
     last_trained = models.DateTimeField(null=True, blank=True)  # retrain bookkeeping
+    last_full_trained = models.DateTimeField(null=True, blank=True)  # τελευταίο πλήρες (μη incremental) training
+    # αυτόματο retrain (recommendations.retraining.RetrainScheduler)
+    pending_samples = models.PositiveIntegerField(default=0)  # αποφάσεις από το choose_car μετά το τελευταίο retrain
+    pending_since = models.DateTimeField(null=True, blank=True)  # πότε μπήκε η παλαιότερη από αυτές
+    retrain_started_at = models.DateTimeField(null=True, blank=True)  # retrain σε εξέλιξη (claim ανάμεσα σε processes)
+    fleet_version = models.PositiveIntegerField(default=0)  # +1 σε κάθε αλλαγή Car (ακυρώνει το ranking_cache)
 
     def __str__(self):
         return self.name
@@ -57,6 +66,17 @@ class Car(models.Model):
         ]
 
 
+BOOKING_CODE_PREFIX = "G5"
+
+
+class BookingQuerySet(models.QuerySet):
+    def fill_booking_codes(self):
+        """booking_code = "G5<id>" όπου λείπει, με ένα UPDATE για όλο το queryset (π.χ. μετά από bulk_create)."""
+        return self.filter(booking_code="").update(
+            booking_code=Concat(models.Value(BOOKING_CODE_PREFIX), Cast("id", output_field=models.CharField()))
+        )
+
+
 class Booking(models.Model):
     """
     Εισερχόμενες κρατήσεις που έρχονται με email (PDF).
@@ -85,23 +105,36 @@ class Booking(models.Model):
 
     # meta
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="imported")
-    source_email_uid = models.CharField(max_length=120, blank=True)   # IMAP UID (ανά φάκελο)
+    source_email_uid = models.CharField(max_length=120, blank=True)   # IMAP UID (ανά mailbox και φάκελο)
+    mailbox = models.ForeignKey('Mailbox', null=True, blank=True, on_delete=models.SET_NULL,
+                                related_name="bookings")                # None = λογαριασμός IMAP_USER του .env
+    source_folder = models.CharField(max_length=255, blank=True)      # IMAP φάκελος του source_email_uid
     gm_msgid = models.CharField(max_length=120, blank=True)           # X-GM-MSGID (global, ιδανικό για dedupe)
     raw_pdf_path = models.CharField(max_length=500, blank=True)       # path αποθήκευσης PDF
+    pdf_error = models.CharField(max_length=20, blank=True)           # timeout/memory/error στην εξαγωγή κειμένου
+    content_hash = models.CharField(max_length=64, blank=True)        # SHA-256 του PDF (dedupe αντιγράφων)
     created_at = models.DateTimeField(auto_now_add=True)
 
     # optional: link σε επιλεγμένο όχημα αργότερα
     chosen_car = models.ForeignKey('Car', null=True, blank=True, on_delete=models.SET_NULL)
 
+    objects = BookingQuerySet.as_manager()
+
     def __str__(self):
         return f"Booking #{self.id} ({self.status})"
 
-    def save(self, *args, **kwargs):
-        creating = self.pk is None
-        super().save(*args, **kwargs)
-        if creating and not self.booking_code:
-            self.booking_code = f"G5{self.id}"
-            super().save(update_fields=["booking_code"])
+    def save(self, *args, fill_code=True, **kwargs):
+        """
+        Νέα κράτηση χωρίς booking_code παίρνει "G5<id>": INSERT και UPDATE στο ίδιο
+        transaction. Με fill_code=False μόνο το INSERT· ο caller γράφει τα codes
+        όλων μαζί με ένα BookingQuerySet.fill_booking_codes() (όπως μετά από bulk_create).
+        """
+        if not fill_code or self.pk is not None or self.booking_code:
+            return super().save(*args, **kwargs)
+        with transaction.atomic(using=kwargs.get("using")):
+            super().save(*args, **kwargs)
+            self.booking_code = f"{BOOKING_CODE_PREFIX}{self.id}"
+            super().save(update_fields=["booking_code"], using=kwargs.get("using"))
 
     @property
     def days(self) -> int:
@@ -110,24 +143,143 @@ class Booking(models.Model):
             return d if d > 0 else 1
         return 1
 
+    def rental_filters(self) -> dict:
+        """Τα στοιχεία της κράτησης στη μορφή που δέχεται το rank_cars."""
+        return {
+            "category": self.requested_category or "",
+            "days": self.days,
+            "total_price": self.total_price or 0,
+            "extra_insurance": bool(self.extra_insurance),
+        }
+
     def to_rental_request(self):
         """
         Δημιουργεί RentalRequest & κενό RentalDecision από την κράτηση.
         Επιστρέφει (rental_request, rental_decision).
         """
-        from recommendations.models import RentalRequest, RentalDecision  # τοπικό import για να μην κάνουμε κυκλικό
-        rr = RentalRequest.objects.create(
-            company=self.company,
+        return Booking.to_rental_requests([self])[0]
+
+    @classmethod
+    def to_rental_requests(cls, bookings):
+        """
+        Όπως το to_rental_request για πολλές κρατήσεις, σε ένα transaction. Δεν
+        αναθέτει όχημα· αυτό γίνεται μόνο με το admin action assign_suggested_cars.
+        Επιστρέφει [(rental_request, rental_decision)].
+        """
+        from recommendations.models import RentalDecision  # τοπικό import για να μην κάνουμε κυκλικό
+
+        results = []
+        with transaction.atomic():
+            for booking in bookings:
+                rr = booking.build_rental_request()
+                rr.save()
+                results.append((rr, RentalDecision.objects.create(request=rr)))
+        return results
+
+    def build_rental_request(self):
+        """Το (μη αποθηκευμένο) RentalRequest της κράτησης· για bulk_create από το import."""
+        from recommendations.models import RentalRequest
+
+        return RentalRequest(
+            company_id=self.company_id,
             days=self.days,
             total_price=self.total_price or 0,
             extra_insurance=bool(self.extra_insurance),
             requested_category=(self.requested_category or ""),
         )
-        dec = RentalDecision.objects.create(request=rr)
-        return rr, dec
 
     class Meta:
         indexes = [
             models.Index(fields=["company", "status"]),
             models.Index(fields=["created_at"]),
+            models.Index(fields=["company", "content_hash"]),
+        ]
+
+
+class PdfExtraction(models.Model):
+    """
+    Cache του κειμένου και των πεδίων που βγήκαν από ένα PDF, ανά SHA-256 του
+    περιεχομένου: το ίδιο PDF (forward, resend) δεν ξαναπερνά από το pdfminer.
+    Κρατούνται μόνο επιτυχείς εξαγωγές.
+    """
+    content_hash = models.CharField(max_length=64, unique=True)
+    text = models.TextField(blank=True)
+    parsed = models.JSONField(default=dict, encoder=DjangoJSONEncoder)  # όπως το parse_booking_text
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.content_hash
+
+    def fields(self) -> dict:
+        """Τα parsed πεδία με τις ημερομηνίες ξανά ως date (στο JSON είναι ISO strings)."""
+        from .utils_email import parse_date_safe
+
+        fields = dict(self.parsed or {})
+        for name in ("start_date", "end_date"):
+            if isinstance(fields.get(name), str):
+                fields[name] = parse_date_safe(fields[name])
+        return fields
+
+
+# Mailbox.password της μορφής "env:IMAP_PASS_ACME": το password διαβάζεται από το περιβάλλον.
+ENV_PASSWORD_PREFIX = "env:"
+
+
+class Mailbox(models.Model):
+    """
+    IMAP λογαριασμός από τον οποίο μια εταιρεία παίρνει κρατήσεις. Ο
+    email_auto_importer εξυπηρετεί όλα τα enabled mailboxes ταυτόχρονα, στο
+    process με EMAIL_IMPORT_MAILBOXES=1.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name="mailboxes")
+    host = models.CharField(max_length=255, default="imap.gmail.com")
+    username = models.CharField(max_length=255)
+    # "env:ΜΕΤΑΒΛΗΤΗ": ο κωδικός διαβάζεται από το περιβάλλον και δεν μένει στη βάση
+    # (το admin δεν δέχεται σκέτο κωδικό· παλιές εγγραφές με σκέτο κωδικό δουλεύουν ακόμα).
+    password = models.CharField(max_length=255)
+    folder = models.CharField(max_length=255, default="[Gmail]/All Mail")
+    sender_filter = models.CharField(max_length=255, blank=True)  # όπως το IMAP_SENDER_FILTER
+    enabled = models.BooleanField(default=True)
+    use_idle = models.BooleanField(default=True)  # IMAP IDLE αν το υποστηρίζει ο server, αλλιώς polling
+    last_checked_at = models.DateTimeField(null=True, blank=True)  # τελευταίο import (επιτυχές ή όχι)
+    last_error = models.TextField(blank=True)                      # σφάλμα του τελευταίου import ("" = ΟΚ)
+
+    def account(self):
+        """(host, user, password) όπως τα περιμένει το rentals.imap_sessions."""
+        password = self.password
+        if password.startswith(ENV_PASSWORD_PREFIX):
+            # Λείπει η μεταβλητή → κενό password, και το imap_sessions αναφέρει ότι λείπουν στοιχεία.
+            password = os.environ.get(password[len(ENV_PASSWORD_PREFIX):], "")
+        return self.host, self.username, password
+
+    def __str__(self):
+        return f"{self.company} / {self.username}"
+
+
+class MailboxSyncState(models.Model):
+    """
+    Πού έμεινε το import_bookings_from_email ανά mailbox (ή εταιρεία, για τον
+    λογαριασμό του .env) και IMAP φάκελο.
+    Τα UIDs ισχύουν μόνο για το ίδιο UIDVALIDITY· αν αλλάξει, γίνεται πλήρες sync.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name="mailbox_sync_states")
+    mailbox = models.ForeignKey(Mailbox, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name="sync_states")  # None = λογαριασμός IMAP_USER του .env
+    folder = models.CharField(max_length=255)
+    uidvalidity = models.BigIntegerField(null=True, blank=True)
+    last_uid = models.BigIntegerField(default=0)                   # μεγαλύτερο UID που επεξεργάστηκε
+    highest_modseq = models.BigIntegerField(null=True, blank=True)  # CONDSTORE (αν το υποστηρίζει ο server)
+    # UID -> αποτυχημένες προσπάθειες, για όσα μηνύματα είναι ακόμα πάνω από το last_uid.
+    failures = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.company} / {self.folder} (UID {self.last_uid})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["company", "folder"], condition=models.Q(mailbox__isnull=True),
+                                    name="uniq_mailbox_sync_state"),
+            models.UniqueConstraint(fields=["mailbox", "folder"], condition=models.Q(mailbox__isnull=False),
+                                    name="uniq_mailbox_sync_state_mailbox"),
         ]
@@ -0,0 +1,237 @@
+"""
+Εξαγωγή κειμένου από PDF (pdfminer) σε process pool, ώστε ένα μεγάλο ή
+χαλασμένο PDF να μη σταματά το import των κρατήσεων.
+
+Κάθε έγγραφο έχει hard timeout (SIGALRM μέσα στο worker και, αν αυτό δεν
+φτάσει, τερματισμός του pool από τον γονέα) και όριο μνήμης (RLIMIT_AS).
+Το timeout μετράει από τη στιγμή που ένα worker ξεκινά το έγγραφο: το worker
+στέλνει την ώρα έναρξης στον γονέα, ώστε ό,τι περιμένει στην ουρά πίσω από
+αργά PDF να μη θεωρείται κολλημένο.
+Ένα worker που πεθαίνει (π.χ. OOM killer) χαλάει όλο το pool: μόνο το job
+εκείνου του worker χρεώνεται την επανάληψη· τα υπόλοιπα ξαναμπαίνουν σε νέο pool.
+Τα workers ξεκινούν με spawn και δεν φορτώνουν Django, μόνο pdfminer.
+"""
+import os
+import itertools
+import signal
+import threading
+import time
+import weakref
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from multiprocessing import get_context
+
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", "0"))  # 0 = όσοι οι πυρήνες
+PDF_EXTRACT_TIMEOUT = float(os.environ.get("PDF_EXTRACT_TIMEOUT", "30"))  # δευτ. ανά PDF
+PDF_EXTRACT_MEMORY_MB = int(os.environ.get("PDF_EXTRACT_MEMORY_MB", "512"))  # ανά worker (0 = χωρίς όριο)
+
+# Τιμές του Booking.pdf_error
+TIMEOUT = "timeout"
+MEMORY = "memory"
+ERROR = "error"
+
+# Περιθώριο του γονέα πάνω από το timeout του worker πριν τερματίσει το pool.
+KILL_GRACE = 5.0
+
+
+# Στο worker: η ουρά όπου στέλνει (job id, ώρα έναρξης, pid).
+_starts = None
+
+
+class ExtractionTimeout(BaseException):
+    """BaseException ώστε να μην το πιάσουν τα `except Exception` του pdfminer."""
+
+
+def _init_worker(memory_mb, starts=None):
+    global _starts
+    _starts = starts
+    if memory_mb:
+        try:
+            import resource
+
+            limit = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass  # π.χ. Windows ή όριο μικρότερο από όσο ήδη χρησιμοποιεί το process
+
+
+def _on_alarm(signum, frame):
+    raise ExtractionTimeout()
+
+
+def extract_text_worker(pdf, timeout, job_id=None):
+    """
+    Τρέχει στο worker· pdf = bytes ή path αρχείου (ώστε τα μεγάλα PDF να μην
+    περνούν από τη μνήμη του γονέα). Επιστρέφει (κείμενο, σφάλμα) με σφάλμα ""
+    ή TIMEOUT/MEMORY/ERROR.
+    """
+    if _starts is not None and job_id is not None:
+        _starts.put((job_id, time.time(), os.getpid()))
+    signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        from pdfminer.high_level import extract_text
+
+        return extract_text(BytesIO(pdf) if isinstance(pdf, bytes) else pdf) or "", ""
+    except ExtractionTimeout:
+        return "", TIMEOUT
+    except MemoryError:
+        return "", MEMORY
+    except Exception:
+        return "", ERROR
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class PdfJob:
+    _ids = itertools.count()
+
+    def __init__(self, pdf):
+        self.id = next(self._ids)
+        self.pdf = pdf
+        self.pool = None
+        self.starts = None  # η ουρά ωρών έναρξης του pool του
+        self.future = None
+        self.started = None  # time.time() όταν το ξεκίνησε ένα worker
+        self.worker = None  # το pid εκείνου του worker
+        self.retried = False
+
+    def done(self):
+        return self.future.done()
+
+
+class PdfExtractor:
+    """
+    Bounded pool: submit() δεν μπλοκάρει· result() περιμένει όσο το job είναι
+    στην ουρά και το πολύ timeout + KILL_GRACE από τη στιγμή που ξεκίνησε.
+    """
+
+    def __init__(self, workers=None, timeout=None, memory_mb=None):
+        self.workers = workers if workers is not None else PDF_EXTRACT_WORKERS
+        self.timeout = timeout if timeout is not None else PDF_EXTRACT_TIMEOUT
+        self.memory_mb = memory_mb if memory_mb is not None else PDF_EXTRACT_MEMORY_MB
+        self._lock = threading.Lock()
+        self._pool = None
+        self._starts = None
+        self._started = {}  # job id -> (ώρα έναρξης, pid), όσα ήρθαν από την ουρά αλλά δεν διαβάστηκαν
+        # pool που τερματίστηκε -> (job του timeout ή None, pids των workers που πέθαναν μόνα τους)
+        self._failures = weakref.WeakKeyDictionary()
+
+    @property
+    def capacity(self):
+        """Πόσα PDF αξίζει να περιμένουν ταυτόχρονα (δύο ανά worker)."""
+        return 2 * (self.workers or os.cpu_count() or 1)
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                context = get_context("spawn")
+                # SimpleQueue: το put γράφει κατευθείαν στο pipe (χωρίς feeder thread), άρα η
+                # ώρα έναρξης φτάνει ακόμα κι αν το worker κολλήσει αμέσως μετά. Νέα ουρά
+                # ανά pool, γιατί ένα worker που τερματίστηκε μπορεί να την άφησε κλειδωμένη.
+                self._starts = context.SimpleQueue()
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers or os.cpu_count() or 1,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self.memory_mb, self._starts),
+                )
+            return self._pool, self._starts
+
+    def submit(self, pdf) -> PdfJob:
+        job = PdfJob(pdf)
+        self._submit(job)
+        return job
+
+    def _submit(self, job):
+        job.pool, job.starts = self._get_pool()
+        job.started = job.worker = None
+        job.future = job.pool.submit(extract_text_worker, job.pdf, self.timeout, job.id)
+
+    def _collect_started(self, job):
+        """Διαβάζει τις ώρες έναρξης που έστειλαν τα workers και ενημερώνει το job."""
+        with self._lock:
+            while not job.starts.empty():
+                job_id, started, pid = job.starts.get()
+                self._started[job_id] = (started, pid)
+            job.started, job.worker = self._started.pop(job.id, (job.started, job.worker))
+
+    def result(self, job: PdfJob):
+        """(κείμενο, σφάλμα) του job."""
+        limit = self.timeout + KILL_GRACE
+        try:
+            while True:
+                # Πριν ξεκινήσει, η προθεσμία του είναι τουλάχιστον limit από τώρα.
+                wait = limit if job.started is None else max(job.started + limit - time.time(), 0)
+                try:
+                    return job.future.result(timeout=wait)
+                except FutureTimeoutError:
+                    self._collect_started(job)
+                    if job.started is None or time.time() < job.started + limit:
+                        continue  # ακόμα στην ουρά πίσω από άλλα PDF ή μέσα στο δικό του όριο
+                    # Το worker δεν απάντησε ούτε στο SIGALRM (π.χ. κολλημένο σε C κώδικα).
+                    self._kill_pool(job.pool, cause=job.id)
+                    return "", TIMEOUT
+                except CancelledError:
+                    # Ακυρώθηκε στην ουρά όταν τερματίστηκε το pool για άλλο job.
+                    self._submit(job)
+                except BrokenProcessPool:
+                    self._collect_started(job)
+                    self._kill_pool(job.pool)
+                    if not self._own_failure(job):
+                        # Τερματισμός για άλλο job ή πέθανε το worker άλλου PDF: χωρίς χρέωση.
+                        self._submit(job)
+                        continue
+                    # Πέθανε το δικό του worker (π.χ. OOM killer): μία ακόμα προσπάθεια σε νέο pool.
+                    if job.retried:
+                        return "", MEMORY
+                    job.retried = True
+                    self._submit(job)
+        finally:
+            with self._lock:
+                self._started.pop(job.id, None)
+
+    def _own_failure(self, job):
+        """True αν το pool του job χάλασε από το δικό του worker."""
+        with self._lock:
+            cause, died = self._failures.get(job.pool, (None, None))
+        if cause is not None:
+            return cause == job.id
+        if died is None:
+            return True  # άγνωστο: χρεώνεται, όπως πριν
+        return job.worker in died
+
+    def _kill_pool(self, pool, cause=None):
+        """
+        cause: το job για το οποίο τερματίζεται το pool (timeout)· None όταν
+        χάλασε μόνο του, οπότε καταγράφονται τα workers που πέθαναν.
+        """
+        # Όλο υπό το lock: ένα άλλο job του ίδιου pool βλέπει το _failures συμπληρωμένο.
+        with self._lock:
+            if pool is not self._pool:
+                return  # ήδη αντικαταστάθηκε
+            self._pool = None
+            processes = dict(getattr(pool, "_processes", None) or {})
+            for process in processes.values():
+                process.terminate()
+            died = set()
+            if cause is None:
+                # Όσα τερμάτισε το pool ή εμείς έχουν exitcode -SIGTERM· τα άλλα πέθαναν μόνα τους.
+                for pid, process in processes.items():
+                    process.join(KILL_GRACE)
+                    if process.exitcode != -signal.SIGTERM:
+                        died.add(pid)
+            self._failures[pool] = (cause, died)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+# Κοινό για όλες τις εκτελέσεις του import στο ίδιο process (π.χ. email_auto_importer).
+pdf_extractor = PdfExtractor()
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recommendations.ranking_cache import bump_fleet_version
+
+from .models import Car
+
+
+@receiver(post_save, sender=Car)
+@receiver(post_delete, sender=Car)
+def car_changed(sender, instance, **kwargs):
+    # Κάθε αλλαγή στόλου (νέο όχημα, ενοικίαση/επιστροφή, διαγραφή) ακυρώνει
+    # τις cached κατατάξεις της εταιρείας.
+    bump_fleet_version(instance.company_id)
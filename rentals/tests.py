@@ -1,12 +1,34 @@
+import email
+import hashlib
+import imaplib
+import os
+import re
+import signal
+import socketserver
+import tempfile
+import threading
+import time
 from urllib.parse import urlparse
 from datetime import date
+from decimal import Decimal
+from email.message import EmailMessage
+from email.utils import parseaddr
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
 from django.contrib.auth.models import User
 from django.core import mail
-from django.test import TestCase, override_settings
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from .models import Company, Booking
+from . import email_auto_importer, imap_sessions
+from .models import Car, Company, Booking, Mailbox, MailboxSyncState, PdfExtraction
+from .imap_idle import idle_wait
+from .pdf_extraction import PdfExtractor
 from .utils_email import parse_booking_text
 
 
@@ -91,3 +113,909 @@ class EmailParsingTests(TestCase):
         self.assertEqual(data["requested_category"], "ecmd")
         self.assertEqual(str(data["start_date"]), "2025-08-18")
         self.assertEqual(str(data["end_date"]), "2025-08-29")
+
+
+def _booking_email(name, sender="bookings@example.com", pdf=None, attachments=()):
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["Subject"] = f"Booking {name}"
+    msg.set_content(f"Name: {name}\nPhone Number: 2101234567\nVehicle Class: small\n")
+    if pdf is not None:
+        msg.add_attachment(pdf, maintype="application", subtype="pdf", filename="booking.pdf")
+    for content, maintype, subtype, filename in attachments:
+        msg.add_attachment(content, maintype=maintype, subtype=subtype, filename=filename)
+    return msg.as_bytes()
+
+
+def _pdf(text_ops):
+    """Ελάχιστο έγκυρο PDF· με πολλά text_ops το pdfminer θέλει πάνω από ένα δευτερόλεπτο."""
+    stream = b"BT /F1 12 Tf " + b" ".join(b"(x) Tj" for _ in range(text_ops)) + b" ET"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out, offsets = b"%PDF-1.4\n", []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    return out + b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+
+def _imap_quote(value):
+    if value is None:
+        return "NIL"
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _part_body(part):
+    # Το σώμα όπως είναι μέσα στο μήνυμα (πριν το base64/quoted-printable decode).
+    payload = part.get_payload()
+    return payload.encode() if isinstance(payload, str) else payload
+
+
+def _bodystructure(part):
+    if part.is_multipart():
+        children = "".join(_bodystructure(child) for child in part.get_payload())
+        return f"({children} {_imap_quote(part.get_content_subtype().upper())})"
+    params = " ".join(f"{_imap_quote(k.upper())} {_imap_quote(v)}" for k, v in (part.get_params() or [])[1:])
+    body = _part_body(part)
+    fields = " ".join([
+        _imap_quote(part.get_content_maintype().upper()), _imap_quote(part.get_content_subtype().upper()),
+        f"({params})" if params else "NIL", "NIL", "NIL",
+        _imap_quote(part.get("Content-Transfer-Encoding", "7bit").upper()), str(len(body)),
+    ])
+    if part.get_content_maintype() == "text":
+        fields += f" {len(body.splitlines())}"
+    disposition = part.get_content_disposition()
+    if disposition:
+        disposition = f"({_imap_quote(disposition.upper())} (\"FILENAME\" {_imap_quote(part.get_filename())}))"
+    return f"({fields} NIL {disposition or 'NIL'} NIL NIL)"
+
+
+def _envelope(msg):
+    name, address = parseaddr(msg.get("From", ""))
+    mailbox, _, host = address.partition("@")
+    sender = f"(({_imap_quote(name or None)} NIL {_imap_quote(mailbox)} {_imap_quote(host)}))"
+    return f"(NIL {_imap_quote(msg.get('Subject'))} {sender} NIL NIL NIL NIL NIL NIL NIL)"
+
+
+def _fetch_response(uid, gm_msgid, raw, items):
+    """Μια απάντηση FETCH όπως τη στέλνει ο server: (κείμενο, literal ή None)."""
+    if "X-GM-MSGID" in items:
+        return f"X-GM-MSGID {gm_msgid} UID {uid}", None
+    msg = email.message_from_bytes(raw)
+    if "BODYSTRUCTURE" in items:
+        return f"UID {uid} ENVELOPE {_envelope(msg)} BODYSTRUCTURE {_bodystructure(msg)}", None
+    section, start, length = re.search(r"BODY\.PEEK\[([^\]]*)\](?:<(\d+)\.(\d+)>)?", items).groups()
+    data, key = raw, f"BODY[{section}]"
+    if section:
+        part = msg
+        for index in section.split("."):
+            if part.is_multipart():
+                part = part.get_payload()[int(index) - 1]
+        data = _part_body(part)
+    if start is not None:
+        data, key = data[int(start):int(start) + int(length)], f"{key}<{start}>"
+    return f"UID {uid} {key} {{{len(data)}}}", data
+
+
+class FakeIMAP:
+    """Ελάχιστος IMAP server στη μνήμη με τις απαντήσεις όπως τις δίνει το imaplib."""
+
+    def __init__(self, messages, uidvalidity=1, modseq=None):
+        self.messages = dict(messages)  # uid -> (gm_msgid, raw)
+        self.flags = {uid: set() for uid in self.messages}
+        self.commands = []
+        self.uidvalidity = uidvalidity
+        self.modseq = modseq  # None = χωρίς CONDSTORE
+        self.dead = False  # True: η σύνδεση "έπεσε" (π.χ. timeout του server)
+        self.bodystructure = True  # False: server που δεν δίνει BODYSTRUCTURE
+        self.downloaded = 0  # bytes σε literals (σώματα μηνυμάτων)
+        self._untagged = {}
+
+    def add(self, uid, gm_msgid, raw):
+        self.messages[uid] = (gm_msgid, raw)
+        self.flags[uid] = set()
+        if self.modseq is not None:
+            self.modseq += 1
+
+    @staticmethod
+    def _expand(uid_set):
+        uids = []
+        for part in uid_set.split(","):
+            lo, _, hi = part.partition(":")
+            uids.extend(range(int(lo), int(hi or lo) + 1))
+        return uids
+
+    def select(self, folder, readonly=False):
+        if self.dead:
+            raise imaplib.IMAP4.abort("connection reset")
+        self._untagged = {"UIDVALIDITY": [str(self.uidvalidity).encode()]}
+        if self.modseq is not None:
+            self._untagged["HIGHESTMODSEQ"] = [str(self.modseq).encode()]
+        return "OK", [str(len(self.messages)).encode()]
+
+    def response(self, code):
+        return code, self._untagged.pop(code, [None])
+
+    def noop(self):
+        return "OK", []
+
+    def logout(self):
+        return "BYE", []
+
+    def uid(self, command, *args):
+        self.commands.append((command.upper(),) + args)
+        if command == "search":
+            uids = sorted(self.messages)
+            if "UID" in args:
+                # "N:*": το * είναι το μεγαλύτερο UID, άρα επιστρέφεται πάντα τουλάχιστον αυτό.
+                lo = int(args[args.index("UID") + 1].split(":")[0])
+                uids = [uid for uid in uids if uid >= lo] or uids[-1:]
+            return "OK", [b" ".join(str(uid).encode() for uid in uids)]
+        if command == "store":
+            for uid in self._expand(args[0]):
+                self.flags[uid].add("\\Seen")
+            return "OK", []
+        uids = [uid for uid in self._expand(args[0]) if uid in self.messages]
+        data = []
+        for seq, uid in enumerate(uids, 1):
+            gm_msgid, raw = self.messages[uid]
+            if "BODYSTRUCTURE" in args[1] and not self.bodystructure:
+                data.append(f"{seq} (UID {uid})".encode())
+                continue
+            text, literal = _fetch_response(uid, gm_msgid, raw, args[1])
+            if literal is None:
+                data.append(f"{seq} ({text})".encode())
+            else:
+                self.downloaded += len(literal)
+                data.append((f"{seq} ({text}".encode(), literal))
+                data.append(b")")
+        return "OK", data
+
+
+class LocalIMAPServer(socketserver.ThreadingTCPServer):
+    """
+    IMAP server στο 127.0.0.1 (χωρίς TLS) με ό,τι χρησιμοποιούν το import και το IDLE:
+    CAPABILITY, LOGIN, SELECT, UID SEARCH/FETCH/STORE, NOOP, IDLE, LOGOUT.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, messages=(), idle=True):
+        super().__init__(("127.0.0.1", 0), _IMAPHandler)
+        self.messages = dict(messages)  # uid -> (gm_msgid, raw)
+        self.idle = idle
+        self.uidvalidity = 1
+        self.commands = []
+        self.logins = 0
+        self.idling = set()
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def connect(self):
+        M = imaplib.IMAP4("127.0.0.1", self.port)
+        M.login("user", "pass")
+        return M
+
+    def add(self, uid, gm_msgid, raw):
+        with self.lock:
+            self.messages[uid] = (gm_msgid, raw)
+            for handler in list(self.idling):
+                handler.report_exists()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    reported = 0  # πλήθος μηνυμάτων που έχει ήδη μάθει ο client
+
+    def report_exists(self):
+        # Όπως οι πραγματικοί servers: ό,τι ήρθε ενώ ο client δεν ήταν σε IDLE αναφέρεται στο επόμενο.
+        if len(self.server.messages) > self.reported:
+            self.reported = len(self.server.messages)
+            self.send(f"* {self.reported} EXISTS")
+
+    def send(self, line, raw=None):
+        self.wfile.write(line.encode() + b"\r\n" if raw is None else line.encode() + b"\r\n" + raw)
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        self.send("* OK local IMAP ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, command, *args = line.decode().strip().split(" ")
+            command = command.upper()
+            if command == "UID":
+                command = "UID " + args.pop(0).upper()
+            server.commands.append(command)
+            if command == "CAPABILITY":
+                self.send("* CAPABILITY IMAP4rev1" + (" IDLE" if server.idle else ""))
+            elif command == "LOGIN":
+                server.logins += 1
+            elif command in ("SELECT", "EXAMINE"):
+                self.reported = len(server.messages)
+                self.send(f"* {self.reported} EXISTS")
+                self.send(f"* OK [UIDVALIDITY {server.uidvalidity}] UIDs valid")
+            elif command == "IDLE" and server.idle:
+                with server.lock:
+                    server.idling.add(self)
+                    # Όπως πολλοί servers: το continuation και ένα εκκρεμές EXISTS στο ίδιο πακέτο.
+                    exists = len(server.messages) > self.reported
+                    self.reported = len(server.messages)
+                    self.send("+ idling" + (f"\r\n* {self.reported} EXISTS" if exists else ""))
+                done = self.rfile.readline()
+                with server.lock:
+                    server.idling.discard(self)
+                if not done:
+                    return
+            elif command == "UID SEARCH":
+                uids = sorted(server.messages)
+                if "UID" in args:
+                    lo = int(args[args.index("UID") + 1].split(":")[0])
+                    uids = [uid for uid in uids if uid >= lo] or uids[-1:]
+                self.send("* SEARCH " + " ".join(map(str, uids)))
+            elif command == "UID FETCH":
+                wanted = set(FakeIMAP._expand(args[0]))
+                for seq, uid in enumerate(sorted(server.messages), 1):
+                    if uid not in wanted:
+                        continue
+                    text, literal = _fetch_response(uid, *server.messages[uid], " ".join(args[1:]))
+                    if literal is None:
+                        self.send(f"* {seq} FETCH ({text})")
+                    else:
+                        self.send(f"* {seq} FETCH ({text}", literal + b")\r\n")
+            elif command == "LOGOUT":
+                self.send("* BYE")
+                self.send(f"{tag} OK LOGOUT completed")
+                return
+            elif command not in ("NOOP", "UID STORE"):
+                self.send(f"{tag} BAD unknown command")
+                continue
+            self.send(f"{tag} OK {command} completed")
+
+
+class ImapSessionsMixin:
+    """Credentials για το session manager και άδειο pool πριν/μετά από κάθε test."""
+
+    def setUp(self):
+        super().setUp()
+        for name, value in (("IMAP_USER", "user"), ("IMAP_PASS", "pass")):
+            patcher = mock.patch.object(imap_sessions, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        imap_sessions.session_manager.close_all()
+        self.addCleanup(imap_sessions.session_manager.close_all)
+
+
+class ImportBookingsFromEmailTests(ImapSessionsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='mail', password='pass123')
+        self.company = Company.objects.create(user=self.user, name='Mail Co', email='mail@example.com')
+
+    def _run(self, imap, **options):
+        connect = imap if callable(imap) else (lambda account: imap)
+        with mock.patch("rentals.imap_sessions.connect", side_effect=connect):
+            out = StringIO()
+            call_command("import_bookings_from_email", company="Mail Co", stdout=out, **options)
+        return out.getvalue()
+
+    def test_batched_fetch_and_set_dedupe(self):
+        Booking.objects.create(company=self.company, gm_msgid="9001", source_email_uid="1")
+        imap = FakeIMAP({uid: (9000 + uid, _booking_email(f"Customer {chr(64 + uid)}")) for uid in range(1, 8)})
+
+        with mock.patch(
+            "rentals.management.commands.import_bookings_from_email.IMAP_FETCH_CHUNK", 4
+        ), self.assertNumQueries(1 + 4 + 1 + 4 + 1):
+            # company, νέο sync state (get_or_create), γνωστά ids,
+            # ένα batch (savepoint, bulk insert, update booking_code, release), watermark
+            out = self._run(imap, mark_seen=True)
+
+        self.assertIn("Imported: 6 | Skipped: 1", out)
+        # Ανά chunk: BODYSTRUCTURE και μετά μόνο το σώμα (section 1) όλων μαζί.
+        self.assertEqual(
+            [c[:3] for c in imap.commands],
+            [("SEARCH", None, "ALL"), ("FETCH", "1:7", "(X-GM-MSGID)"),
+             ("FETCH", "2:5", "(UID ENVELOPE BODYSTRUCTURE)"), ("FETCH", "2:5", "(UID BODY.PEEK[1]<0.262144>)"),
+             ("FETCH", "6:7", "(UID ENVELOPE BODYSTRUCTURE)"), ("FETCH", "6:7", "(UID BODY.PEEK[1]<0.262144>)"),
+             ("STORE", "2:7", "+FLAGS")],
+        )
+        self.assertEqual(
+            sorted(Booking.objects.values_list("gm_msgid", flat=True)), [str(9000 + uid) for uid in range(1, 8)]
+        )
+        self.assertEqual(Booking.objects.get(gm_msgid="9003").customer_name, "Customer C")
+        self.assertEqual(imap.flags[1], set())
+
+        # Πλήρες sync ξανά: ένα FETCH για τα X-GM-MSGID και κανένα σώμα.
+        imap.commands.clear()
+        self.assertIn("Imported: 0 | Skipped: 7", self._run(imap, full_sync=True))
+        self.assertEqual([c[0] for c in imap.commands], ["SEARCH", "FETCH"])
+
+    def test_incremental_sync_from_last_uid(self):
+        imap = FakeIMAP({uid: (9000 + uid, _booking_email(f"Customer {chr(64 + uid)}")) for uid in range(1, 4)})
+        self._run(imap)
+        state = MailboxSyncState.objects.get(company=self.company)
+        self.assertEqual((state.uidvalidity, state.last_uid, state.highest_modseq), (1, 3, None))
+
+        # Χωρίς νέα μηνύματα: μόνο το SEARCH.
+        imap.commands.clear()
+        self.assertIn("Imported: 0 | Skipped: 0", self._run(imap))
+        self.assertEqual(imap.commands, [("SEARCH", None, "UID", "4:*", "ALL")])
+
+        imap.add(4, 9004, _booking_email("Customer D"))
+        imap.commands.clear()
+        self.assertIn("Imported: 1 | Skipped: 0", self._run(imap))
+        self.assertEqual(
+            [c[:2] for c in imap.commands], [("SEARCH", None), ("FETCH", "4"), ("FETCH", "4"), ("FETCH", "4")]
+        )
+        self.assertEqual(MailboxSyncState.objects.get(pk=state.pk).last_uid, 4)
+
+        # Νέο UIDVALIDITY: πλήρες sync, το dedupe με X-GM-MSGID κρατά τις κρατήσεις μοναδικές.
+        imap.uidvalidity = 2
+        out = self._run(imap)
+        self.assertIn("UIDVALIDITY", out)
+        self.assertIn("Imported: 0 | Skipped: 4", out)
+        self.assertEqual(Booking.objects.count(), 4)
+
+    def test_downloads_only_the_booking_part(self):
+        pdf = _pdf(3000)
+        imap = FakeIMAP({
+            1: (9001, _booking_email(
+                "Customer A", sender="Bookings <bookings@example.com>",
+                attachments=[(b"\0" * 300_000, "application", "zip", "photos.zip")],
+            )),
+            2: (9002, _booking_email(
+                "Customer B", pdf=pdf, attachments=[(b"\0" * 300_000, "image", "jpeg", "car.jpg")],
+            )),
+            3: (9003, _booking_email("Customer C", sender="spam@example.org")),
+        })
+
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media), mock.patch.multiple(
+            "rentals.management.commands.import_bookings_from_email", IMAP_PART_CHUNK=4096, IMAP_SPOOL_MEMORY=1024,
+        ):
+            # Ο αποστολέας ελέγχεται από το ENVELOPE, χωρίς να κατέβει το μήνυμα.
+            out = self._run(imap, sender="bookings@example.com")
+            self.assertIn("Imported: 2 | Skipped: 1", out)
+            self.assertEqual(Booking.objects.get(gm_msgid="9001").customer_name, "Customer A")
+            booking = Booking.objects.get(gm_msgid="9002")
+            with open(f"{media}/{booking.raw_pdf_path}", "rb") as saved:
+                self.assertEqual(saved.read(), pdf)
+
+        # Κανένα ολόκληρο μήνυμα, κανένα zip/jpeg· το PDF (section 2) σε κομμάτια των 4096.
+        items = [c[2] for c in imap.commands if c[0] == "FETCH"]
+        self.assertNotIn("(UID BODY.PEEK[])", items)
+        self.assertEqual(items.count("(UID BODY.PEEK[2]<0.4096>)"), 1)
+        self.assertGreater(sum(item.startswith("(UID BODY.PEEK[2]<") for item in items), 1)
+        self.assertNotIn("(UID BODY.PEEK[3])", items)
+        self.assertLess(imap.downloaded, len(pdf) * 4 // 3 + 5000)
+
+    def test_whole_message_without_bodystructure(self):
+        imap = FakeIMAP({1: (9001, _booking_email("Customer A"))})
+        imap.bodystructure = False
+        self.assertIn("Imported: 1 | Skipped: 0", self._run(imap))
+        self.assertEqual(imap.commands[-1][:3], ("FETCH", "1", "(UID BODY.PEEK[])"))
+        self.assertEqual(Booking.objects.get().customer_name, "Customer A")
+
+    def test_pdf_timeout_is_recorded_and_not_retried(self):
+        extractor = PdfExtractor(workers=1, timeout=0.3)
+        self.addCleanup(extractor.shutdown)
+        imap = FakeIMAP({
+            1: (9001, _booking_email("Customer A", pdf=_pdf(40000))),
+            2: (9002, _booking_email("Customer B", pdf=_pdf(3))),
+        })
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media), mock.patch(
+            "rentals.management.commands.import_bookings_from_email.pdf_extractor", extractor
+        ):
+            out = self._run(imap)
+            self.assertIn("Imported: 2 | Skipped: 0", out)
+            self.assertIn("timeout", out)
+            slow = Booking.objects.get(gm_msgid="9001")
+            self.assertEqual(slow.pdf_error, "timeout")
+            self.assertTrue(slow.raw_pdf_path.endswith(".pdf"))
+            self.assertEqual(Booking.objects.get(gm_msgid="9002").pdf_error, "")
+
+            self.assertIn("Imported: 0 | Skipped: 2", self._run(imap, full_sync=True))
+            self.assertFalse(PdfExtraction.objects.filter(content_hash=slow.content_hash).exists())
+
+            # Το ίδιο PDF σε νέο μήνυμα ξαναδοκιμάζεται: η αποτυχία δεν μπλοκάρει το hash.
+            imap.add(3, 9003, _booking_email("Customer A (resend)", pdf=_pdf(40000)))
+            self.assertIn("Imported: 1 | Skipped: 0", self._run(imap))
+            self.assertEqual(Booking.objects.get(gm_msgid="9003").content_hash, slow.content_hash)
+
+    def test_duplicate_pdf_is_skipped_by_content_hash(self):
+        pdf = _pdf(3)
+        imap = FakeIMAP({
+            1: (9001, _booking_email("Customer A", pdf=pdf)),
+            2: (9002, _booking_email("Customer A (forward)", pdf=pdf)),
+        })
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            out = self._run(imap)
+            self.assertIn("Imported: 1 | Skipped: 1", out)
+            self.assertIn("♻️", out)
+            booking = Booking.objects.get()
+            self.assertEqual((booking.gm_msgid, booking.content_hash), ("9001", hashlib.sha256(pdf).hexdigest()))
+            # Το αντίγραφο δεν αποθηκεύτηκε· το κείμενο του πρώτου μπήκε στο cache.
+            self.assertEqual(len(list(Path(media).rglob("*.pdf"))), 1)
+            self.assertEqual(PdfExtraction.objects.get(content_hash=booking.content_hash).text.strip(), "xxx")
+
+            imap.add(3, 9003, _booking_email("Customer A (resend)", pdf=pdf))
+            self.assertIn("Imported: 0 | Skipped: 1", self._run(imap))
+
+    def test_cached_extraction_skips_pdfminer(self):
+        pdf = _pdf(3)
+        PdfExtraction.objects.create(
+            content_hash=hashlib.sha256(pdf).hexdigest(),
+            text="Name: Customer A",
+            parsed={"customer_name": "Customer A", "start_date": "2025-07-01", "total_price": 120.5},
+        )
+        extractor = mock.Mock()
+        imap = FakeIMAP({1: (9001, _booking_email("Customer A", pdf=pdf))})
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media), mock.patch(
+            "rentals.management.commands.import_bookings_from_email.pdf_extractor", extractor
+        ):
+            self.assertIn("Imported: 1 | Skipped: 0", self._run(imap))
+        extractor.submit.assert_not_called()
+        booking = Booking.objects.get()
+        self.assertEqual(
+            (booking.customer_name, booking.start_date, booking.total_price),
+            ("Customer A", date(2025, 7, 1), Decimal("120.50")),
+        )
+        self.assertTrue(booking.raw_pdf_path.endswith(".pdf"))
+
+    def test_unchanged_highestmodseq_skips_search(self):
+        imap = FakeIMAP({1: (9001, _booking_email("Customer A"))}, modseq=10)
+        self._run(imap)
+        self.assertEqual(MailboxSyncState.objects.get(company=self.company).highest_modseq, 10)
+
+        imap.commands.clear()
+        self.assertIn("Καμία αλλαγή", self._run(imap))
+        self.assertEqual(imap.commands, [])
+
+        imap.add(2, 9002, _booking_email("Customer B"))
+        self.assertIn("Imported: 1", self._run(imap))
+
+    def test_uid_dedupe_is_scoped_to_mailbox_and_folder(self):
+        # Όχι Gmail (χωρίς X-GM-MSGID): δύο λογαριασμοί με το ίδιο UID για διαφορετικά μηνύματα.
+        first = Mailbox.objects.create(company=self.company, host="mail.example.com", username="a", password="x")
+        second = Mailbox.objects.create(company=self.company, host="mail.example.com", username="b", password="x")
+        servers = {
+            "a": FakeIMAP({1: (None, _booking_email("Customer A"))}),
+            "b": FakeIMAP({1: (None, _booking_email("Customer B"))}),
+        }
+        for mailbox in (first, second):
+            self.assertIn("Imported: 1 | Skipped: 0", self._run(lambda account: servers[account[1]],
+                                                                mailbox=mailbox.pk, full_sync=True))
+        self.assertEqual(
+            sorted(Booking.objects.values_list("customer_name", "mailbox__username", "source_folder")),
+            [("Customer A", "a", first.folder), ("Customer B", "b", second.folder)],
+        )
+        self.assertIn("Imported: 0 | Skipped: 1", self._run(lambda account: servers[account[1]],
+                                                            mailbox=first.pk, full_sync=True))
+
+    def test_mailbox_password_from_environment(self):
+        mailbox = Mailbox(company=self.company, username="a", password="env:IMAP_PASS_ACME")
+        with mock.patch.dict("os.environ", {"IMAP_PASS_ACME": "secret"}):
+            self.assertEqual(mailbox.account(), ("imap.gmail.com", "a", "secret"))
+        with mock.patch.dict("os.environ", clear=True):
+            self.assertEqual(mailbox.account()[2], "")
+
+    def test_mailbox_admin_never_shows_the_password(self):
+        from .admin import MailboxAdminForm
+
+        mailbox = Mailbox.objects.create(company=self.company, username="a", password="env:IMAP_PASS_ACME")
+        form = MailboxAdminForm(instance=mailbox)
+        self.assertNotIn("IMAP_PASS_ACME", str(form["password"]))
+
+        data = {"company": self.company.pk, "host": "imap.example.com", "username": "a", "password": "",
+                "folder": "INBOX", "sender_filter": "", "enabled": "on", "use_idle": "on"}
+        form = MailboxAdminForm(data, instance=mailbox)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.save().password, "env:IMAP_PASS_ACME")  # κενό = η τρέχουσα τιμή
+        self.assertFalse(MailboxAdminForm(data).is_valid())  # νέο mailbox χωρίς κωδικό
+
+    def test_mailbox_admin_rejects_raw_passwords(self):
+        from .admin import MailboxAdminForm
+
+        data = {"company": self.company.pk, "host": "imap.example.com", "username": "a",
+                "folder": "INBOX", "sender_filter": "", "enabled": "on", "use_idle": "on"}
+        for password in ("secret", "env:", "env:NOT A NAME"):
+            form = MailboxAdminForm(dict(data, password=password))
+            self.assertFalse(form.is_valid())
+            self.assertIn("password", form.errors)
+        self.assertTrue(MailboxAdminForm(dict(data, password="env:IMAP_PASS_B")).is_valid())
+
+        # Παλιό mailbox με σκέτο κωδικό: το κενό πεδίο δεν τον κρατά, πρέπει να αντικατασταθεί.
+        legacy = Mailbox.objects.create(company=self.company, username="b", password="secret")
+        self.assertFalse(MailboxAdminForm(dict(data, password=""), instance=legacy).is_valid())
+
+    def test_session_is_released_when_setup_fails(self):
+        imap = FakeIMAP({1: (9001, _booking_email("Customer A"))}, modseq=10)
+        manager = imap_sessions.session_manager
+        with mock.patch.object(manager, "release", wraps=manager.release) as release, mock.patch(
+            "rentals.management.commands.import_bookings_from_email.MailboxSyncState.objects.get_or_create",
+            side_effect=OperationalError("database is locked"),
+        ), self.assertRaises(OperationalError):
+            self._run(imap)
+        release.assert_called_once()
+        self.assertTrue(release.call_args.kwargs["broken"])
+
+        # Και το "τίποτα δεν άλλαξε" επιστρέφει τη σύνδεση στο pool.
+        self._run(imap)
+        self.assertIn("Καμία αλλαγή", self._run(imap))
+        self.assertEqual(manager.stats()["idle"], 1)
+
+    def test_failed_booking_rolls_back_only_its_own_savepoint(self):
+        from recommendations.models import RentalDecision
+
+        from .management.commands.import_bookings_from_email import Command
+
+        imap = FakeIMAP({uid: (9000 + uid, _booking_email(f"Customer {chr(64 + uid)}")) for uid in range(1, 4)})
+        build = Command._build_booking
+
+        def build_booking(command, company, parsed, uid_str, *args):
+            booking = build(command, company, parsed, uid_str, *args)
+            if uid_str == "2":
+                booking.customer_name = None  # NOT NULL: το INSERT αποτυγχάνει
+            return booking
+
+        with mock.patch.object(Command, "_build_booking", build_booking), mock.patch("sys.stderr", StringIO()), \
+                CaptureQueriesContext(connection) as queries:
+            out = self._run(imap, auto_convert=True)
+        self.assertIn("Imported: 2 | Skipped: 0 | Converted: 2 | Errors: 1", out)
+        # Και στο savepoint ανά μήνυμα: ένα INSERT ανά κράτηση, ένα UPDATE για όλα τα booking_code.
+        updates = [q["sql"] for q in queries if q["sql"].startswith('UPDATE "rentals_booking"')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn("booking_code", updates[0])
+        self.assertEqual(
+            sorted(Booking.objects.values_list("gm_msgid", "status", "booking_code")),
+            [("9001", "active", f"G5{Booking.objects.get(gm_msgid='9001').pk}"),
+             ("9003", "active", f"G5{Booking.objects.get(gm_msgid='9003').pk}")],
+        )
+        self.assertEqual(RentalDecision.objects.filter(request__company=self.company).count(), 2)
+        # Το αποτυχημένο UID ξαναδοκιμάζεται στο επόμενο poll.
+        self.assertEqual(MailboxSyncState.objects.get(company=self.company).last_uid, 1)
+        self.assertIn("Imported: 1 | Skipped: 1", self._run(imap))
+
+    def test_watermark_moves_past_message_that_keeps_failing(self):
+        from .management.commands.import_bookings_from_email import Command
+
+        imap = FakeIMAP({uid: (9000 + uid, _booking_email(f"Customer {chr(64 + uid)}")) for uid in range(1, 4)},
+                        modseq=10)
+        build = Command._build_booking
+
+        def build_booking(command, company, parsed, uid_str, *args):
+            booking = build(command, company, parsed, uid_str, *args)
+            if uid_str == "2":
+                booking.customer_name = None  # αποτυγχάνει σε κάθε προσπάθεια
+            return booking
+
+        with mock.patch.object(Command, "_build_booking", build_booking), mock.patch("sys.stderr", StringIO()), \
+                mock.patch("rentals.management.commands.import_bookings_from_email.IMAP_MAX_ATTEMPTS", 2):
+            self._run(imap)
+            state = MailboxSyncState.objects.get(company=self.company)
+            self.assertEqual((state.last_uid, state.highest_modseq, state.failures), (1, None, {"2": 1}))
+
+            out = self._run(imap)
+            self.assertIn("⛔ UID 2: 2 αποτυχημένες προσπάθειες", out)
+            state.refresh_from_db()
+            self.assertEqual((state.last_uid, state.highest_modseq, state.failures), (3, 10, {}))
+            self.assertIn("Καμία αλλαγή", self._run(imap))
+        self.assertFalse(Booking.objects.filter(gm_msgid="9002").exists())
+
+    def test_batch_write_converts_with_one_transaction(self):
+        from recommendations.models import RentalRequest
+
+        imap = FakeIMAP({uid: (9000 + uid, _booking_email(f"Customer {chr(64 + uid)}")) for uid in range(1, 6)})
+        with mock.patch("rentals.management.commands.import_bookings_from_email.BOOKING_WRITE_BATCH", 2), \
+                CaptureQueriesContext(connection) as queries:
+            out = self._run(imap, auto_convert=True)
+        self.assertIn("Imported: 5 | Skipped: 0 | Converted: 5 | Errors: 0", out)
+        inserts = [q["sql"] for q in queries if q["sql"].startswith("INSERT INTO \"rentals_booking\"")]
+        self.assertEqual(len(inserts), 3)  # batches 2 + 2 + 1
+        self.assertEqual(sum(q["sql"].startswith("SAVEPOINT") for q in queries), 1 + 3)  # sync state + batches
+        for booking in Booking.objects.all():
+            self.assertEqual((booking.status, booking.booking_code), ("active", f"G5{booking.pk}"))
+        self.assertEqual(RentalRequest.objects.filter(company=self.company).count(), 5)
+
+    def test_session_is_reused_across_runs(self):
+        server = LocalIMAPServer({1: (9001, _booking_email("Customer A"))})
+        self.addCleanup(server.stop)
+        connect = lambda account: server.connect()  # noqa: E731
+
+        self.assertIn("νέα σύνδεση", self._run(connect))
+        server.add(2, 9002, _booking_email("Customer B"))
+        out = self._run(connect)
+        self.assertIn("Imported: 1", out)
+        self.assertIn("επαναχρησιμοποίηση σύνδεσης", out)
+        self.assertEqual(server.logins, 1)
+        self.assertEqual(server.commands.count("LOGOUT"), 0)
+        stats = imap_sessions.session_manager.stats()
+        self.assertEqual((stats["connects"] >= 1, stats["reuses"] >= 1, stats["idle"]), (True, True, 1))
+
+    def test_dead_pooled_session_reconnects_with_backoff(self):
+        dead = FakeIMAP({1: (9001, _booking_email("Customer A"))})
+        self._run(dead)
+        dead.dead = True
+        fresh = FakeIMAP(dead.messages)
+        manager = imap_sessions.session_manager
+        before = manager.stats()
+
+        # Ο server δεν απαντά μία φορά: backoff (χωρίς πραγματική αναμονή) και μετά νέα σύνδεση.
+        attempts = iter([OSError("refused"), fresh])
+
+        def connect(account):
+            result = next(attempts)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        with mock.patch.object(manager, "sleep") as sleep:
+            out = self._run(connect)
+        sleep.assert_called_once_with(1.0)
+        self.assertIn("Imported: 0 | Skipped: 0", out)
+        after = manager.stats()
+        self.assertEqual(after["reconnects"] - before["reconnects"], 1)
+        self.assertEqual(after["failures"] - before["failures"], 1)
+        self.assertEqual(after["connects"] - before["connects"], 1)
+
+    def test_keepalive_pings_idle_sessions(self):
+        manager = imap_sessions.ImapSessionManager(keepalive=60)
+        self.addCleanup(manager.close_all)
+        alive, dead = FakeIMAP({}), FakeIMAP({})
+        dead.noop = mock.Mock(side_effect=imaplib.IMAP4.abort("gone"))
+        with mock.patch("rentals.imap_sessions.connect", side_effect=[alive, dead]):
+            first, second = manager.checkout("INBOX"), manager.checkout("INBOX")
+        with mock.patch.object(manager, "_start_keeper"):
+            manager.release(first)
+            manager.release(second)
+        first.last_used = second.last_used = time.monotonic() - 61
+
+        manager.ping_idle()
+        self.assertEqual((manager.stats()["keepalives"], manager.stats()["idle"]), (1, 1))
+        self.assertIs(manager.checkout("INBOX"), first)
+
+
+class EmailAutoImporterTests(ImapSessionsMixin, TransactionTestCase):
+    # TransactionTestCase: το import τρέχει στο thread του importer.
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='mail', password='pass123')
+        self.company = Company.objects.create(user=self.user, name='Mail Co', email='mail@example.com')
+        self.stop = threading.Event()
+
+    def _start(self, server, idle=True):
+        patcher = mock.patch("rentals.imap_sessions.connect", side_effect=lambda account: server.connect())
+        patcher.start()
+        thread = threading.Thread(target=email_auto_importer.run, args=("Mail Co", self.stop, idle), daemon=True)
+        thread.start()
+
+        def cleanup():
+            self.stop.set()
+            thread.join(10)
+            patcher.stop()
+            server.stop()
+
+        self.addCleanup(cleanup)
+
+    def _wait_for(self, condition, message, timeout=10):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if condition():
+                    return
+            except OperationalError:
+                # In-memory SQLite του test (shared cache): "table is locked" όσο γράφει το importer.
+                pass
+            self.assertLess(time.monotonic(), deadline, message)
+            time.sleep(0.05)
+
+    def _wait_bookings(self, count):
+        self._wait_for(lambda: Booking.objects.count() >= count, f"δεν έφτασαν {count} κρατήσεις")
+
+    def _wait_last_uid(self, last_uid, **lookup):
+        # Το watermark γράφεται στο τέλος του import, λίγο μετά τις κρατήσεις.
+        self._wait_for(
+            lambda: MailboxSyncState.objects.filter(last_uid=last_uid, **lookup).exists(),
+            f"το last UID δεν έφτασε στο {last_uid}",
+        )
+
+    def test_idle_imports_new_mail_on_exists(self):
+        server = LocalIMAPServer({1: (9001, _booking_email("Customer A"))})
+        self._start(server)
+        self._wait_bookings(1)
+
+        started = time.monotonic()
+        server.add(2, 9002, _booking_email("Customer B"))
+        self._wait_bookings(2)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertIn("IDLE", server.commands)
+        # Το import μετά το EXISTS ψάχνει μόνο μετά το τελευταίο UID.
+        self._wait_last_uid(2, company=self.company)
+
+    def test_falls_back_to_adaptive_polling_without_idle(self):
+        server = LocalIMAPServer({1: (9001, _booking_email("Customer A"))}, idle=False)
+        with mock.patch.object(email_auto_importer, "EMAIL_IMPORT_MIN_INTERVAL", 0.1), \
+                mock.patch.object(email_auto_importer, "EMAIL_IMPORT_INTERVAL", 60):
+            self._start(server)
+            self._wait_bookings(1)
+            server.add(2, 9002, _booking_email("Customer B"))
+            self._wait_bookings(2)
+        self.assertNotIn("IDLE", server.commands)
+
+    def test_adaptive_interval(self):
+        interval = email_auto_importer.AdaptiveInterval(30, 300)
+        self.assertEqual([interval.next(n) for n in (0, 2, 0, 0, 0, 0, 1)], [300, 30, 60, 120, 240, 300, 30])
+
+    def test_supervisor_isolates_slow_and_broken_mailboxes(self):
+        other = Company.objects.create(
+            user=User.objects.create_user(username='other', password='pass123'), name='Other Co', email='o@example.com'
+        )
+        server = LocalIMAPServer({1: (9001, _booking_email("Customer A"))})
+        healthy = Mailbox.objects.create(company=self.company, host="healthy", username="a", password="x")
+        broken = Mailbox.objects.create(company=other, host="broken", username="b", password="x")
+        accounts = []
+
+        def connect(account):
+            accounts.append(account)
+            if account[0] == "broken":
+                time.sleep(1.5)  # σαν server που δεν απαντά μέχρι το timeout
+                raise OSError("timed out")
+            return server.connect()
+
+        supervisor = email_auto_importer.MailboxSupervisor(self.stop, workers=2)
+        for patcher in (
+            mock.patch("rentals.imap_sessions.connect", side_effect=connect),
+            mock.patch.object(imap_sessions.session_manager, "attempts", 1),
+            mock.patch.object(email_auto_importer, "EMAIL_IDLE_RETRY", 0.2),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        thread = threading.Thread(target=supervisor.run, daemon=True)
+        thread.start()
+        self.addCleanup(server.stop)
+        self.addCleanup(thread.join, 10)
+        self.addCleanup(self.stop.set)
+
+        started = time.monotonic()
+        self._wait_bookings(1)
+        server.add(2, 9002, _booking_email("Customer B"))
+        self._wait_bookings(2)
+        # Το χαλασμένο mailbox κρατά ένα worker (και το IDLE του) χωρίς να καθυστερεί το υγιές.
+        self.assertLess(time.monotonic() - started, 1.5)
+        self._wait_last_uid(2, mailbox=healthy)
+        self._wait_for(lambda: Mailbox.objects.get(pk=broken.pk).last_error, "δεν καταγράφηκε το σφάλμα")
+
+        self.stop.set()
+        thread.join(10)
+        self.assertEqual(set(Booking.objects.values_list("company_id", flat=True)), {self.company.id})
+        self.assertIn(("healthy", "a", "x"), accounts)
+        self.assertIn("timed out", Mailbox.objects.get(pk=broken.pk).last_error)
+        self.assertEqual(Mailbox.objects.get(pk=healthy.pk).last_error, "")
+
+    def test_supervisor_follows_mailbox_changes_and_orders_by_wait(self):
+        first = Mailbox.objects.create(company=self.company, username="a", password="x", use_idle=False)
+        second = Mailbox.objects.create(company=self.company, username="b", password="x", use_idle=False)
+        supervisor = email_auto_importer.MailboxSupervisor(self.stop, idle=False)
+        supervisor.refresh()
+        schedules = supervisor._schedules
+        schedules[("mailbox", second.pk)].next_run -= 10  # περιμένει περισσότερο
+
+        due, _ = supervisor._due(1)
+        self.assertEqual([s.target.mailbox_id for s in due], [second.pk])
+        due, _ = supervisor._due(5)
+        self.assertEqual([s.target.mailbox_id for s in due], [first.pk])  # το second τρέχει ήδη
+
+        Mailbox.objects.filter(pk=first.pk).update(enabled=False)
+        Mailbox.objects.filter(pk=second.pk).update(folder="INBOX")
+        supervisor.refresh()
+        self.assertEqual(list(schedules), [("mailbox", second.pk)])
+        self.assertEqual(schedules[("mailbox", second.pk)].target.folder, "INBOX")
+        self.assertFalse(schedules[("mailbox", second.pk)].running)
+
+
+class PdfExtractionTests(SimpleTestCase):
+    def test_timeout_and_errors_are_reported_per_document(self):
+        extractor = PdfExtractor(workers=2, timeout=0.3)
+        self.addCleanup(extractor.shutdown)
+        jobs = [extractor.submit(pdf) for pdf in (_pdf(40000), _pdf(3), b"not a pdf")]
+        slow, small, broken = [extractor.result(job) for job in jobs]
+        self.assertEqual(slow, ("", "timeout"))
+        self.assertEqual(small[0].strip(), "xxx")
+        self.assertEqual(small[1], "")
+        self.assertEqual(broken[1], "error")
+
+        # Το worker που έκανε timeout συνεχίζει να δουλεύει για τα επόμενα.
+        self.assertEqual(extractor.result(extractor.submit(_pdf(2)))[1], "")
+
+    def test_queued_job_is_timed_from_its_own_start(self):
+        extractor = PdfExtractor(workers=1, timeout=0.3)
+        self.addCleanup(extractor.shutdown)
+        # Με μικρό περιθώριο το small περιμένει στην ουρά πολύ περισσότερο από timeout + KILL_GRACE.
+        with mock.patch("rentals.pdf_extraction.KILL_GRACE", 0.1):
+            jobs = [extractor.submit(pdf) for pdf in (_pdf(40000), _pdf(40000), _pdf(3))]
+            text, error = extractor.result(jobs[-1])
+            self.assertEqual((text.strip(), error), ("xxx", ""))
+            self.assertEqual([extractor.result(job) for job in jobs[:2]], [("", "timeout")] * 2)
+
+    def test_dead_worker_charges_only_its_own_job(self):
+        extractor = PdfExtractor(workers=2, timeout=60)
+        self.addCleanup(extractor.shutdown)
+        jobs = [extractor.submit(_pdf(40000)) for _ in range(2)] + [extractor.submit(_pdf(3))]
+        victim, bystander, queued = jobs
+        deadline = time.monotonic() + 30
+        while victim.worker is None or bystander.worker is None:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+            extractor._collect_started(victim)
+            extractor._collect_started(bystander)
+        os.kill(victim.worker, signal.SIGKILL)  # σαν τον OOM killer
+
+        # Το bystander διαβάζεται πρώτο· ούτε αυτό ούτε το job της ουράς χρεώνονται.
+        self.assertEqual(extractor.result(bystander)[1], "")
+        self.assertEqual(extractor.result(queued)[0].strip(), "xxx")
+        self.assertFalse(bystander.retried or queued.retried)
+        self.assertEqual(extractor.result(victim)[1], "")
+        self.assertTrue(victim.retried)
+
+
+class ImapIdleTests(SimpleTestCase):
+    def test_exists_buffered_with_the_continuation_is_seen(self):
+        server = LocalIMAPServer({1: (9001, _booking_email("Customer A"))})
+        self.addCleanup(server.stop)
+        M = server.connect()
+        self.addCleanup(M.logout)
+        M.select("INBOX")
+        server.messages[2] = (9002, _booking_email("Customer B"))  # χωρίς EXISTS πριν το IDLE
+
+        started = time.monotonic()
+        self.assertTrue(idle_wait(M, 5))
+        self.assertLess(time.monotonic() - started, 2)
+        # Η σύνδεση μένει έτοιμη για την επόμενη εντολή.
+        self.assertEqual(M.noop()[0], "OK")
+
+
+class RecommendationsApiTests(TransactionTestCase):
+    # TransactionTestCase: το endpoint διαβάζει τη βάση από thread του executor.
+    def setUp(self):
+        self.user = User.objects.create_user(username='eve', password='pass123')
+        self.company = Company.objects.create(user=self.user, name='Eve Co', email='eve@example.com')
+        self.small = Car.objects.create(company=self.company, brand='Fiat', model='Panda', category='small')
+        self.medium = Car.objects.create(company=self.company, brand='Audi', model='A3', category='medium')
+        Car.objects.create(company=self.company, brand='Opel', model='Corsa', category='small', is_rented=True)
+
+    def test_requires_login(self):
+        resp = self.client.get(reverse('rentals:api_recommendations'))
+        self.assertEqual(resp.status_code, 401)
+
+    def test_ranked_available_cars(self):
+        self.client.login(username='eve', password='pass123')
+        resp = self.client.get(
+            reverse('rentals:api_recommendations'),
+            {'category': 'small', 'days': 3, 'total_price': 90},
+        )
+        self.assertEqual(resp.status_code, 200)
+        ids = [r['car_id'] for r in resp.json()['results']]
+        self.assertEqual(ids, [self.small.id, self.medium.id])
+
+    def test_invalid_parameters(self):
+        self.client.login(username='eve', password='pass123')
+        resp = self.client.get(reverse('rentals:api_recommendations'), {'days': 'abc'})
+        self.assertEqual(resp.status_code, 400)
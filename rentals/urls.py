@@ -15,6 +15,7 @@ from .views import (
     delete_cars_view,
     bookings_list,
     booking_set_status,
+    api_recommendations,
 )
 
 app_name = "rentals"
@@ -72,4 +73,7 @@ urlpatterns: list[path] = [
     # Bookings
     path("bookings/", bookings_list, name="bookings_list"),
     path("bookings/<int:booking_id>/<str:action>/", booking_set_status, name="booking_set_status"),
+
+    # JSON API (async, για το booking-desk frontend)
+    path("api/recommendations/", api_recommendations, name="api_recommendations"),
 ]
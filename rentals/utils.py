@@ -1,67 +1,243 @@
-import joblib
-import os
+from recommendations.fleet_scorer import VALUES_FIELDS, FleetScorer
+from recommendations.ranking_cache import fleet_version, ranking_cache
+from recommendations.registry import ARTIFACTS, model_registry
 
-MODEL_PATH = "model.joblib"
+from .models import Booking, Car
+
+
+def _request_features(request_filters):
+    return (
+        (request_filters.get("category") or "").lower(),
+        int(request_filters.get("days", 1)),
+        float(request_filters.get("total_price", 0)),
+        1 if request_filters.get("extra_insurance") else 0,
+    )
+
+
+def _exact_table(company_id):
+    """
+    Ο RankingTable της εταιρείας, μόνο αν είναι exact. Ένας approximate πίνακας
+    (thresholds πάνω από το RECOMMENDATION_TABLE_MAX_EDGES) θα έδινε άλλη
+    κατάταξη από το μοντέλο, οπότε τότε απαντά το FlatForest / sklearn.
+    """
+    try:
+        table = model_registry.get(company_id, "table")
+    except Exception:
+        return None
+    return table if table is not None and table.exact else None
 
-def rank_cars(request_filters, qs, company_id):
-    """AI προτάσεις ανά εταιρεία — με fallback σε default αν δεν υπάρχει μοντέλο."""
-    wanted_category = (request_filters.get("category") or "").lower()
-    days = int(request_filters.get("days", 1))
-    total_price = float(request_filters.get("total_price", 0))
-    extra_insurance = 1 if request_filters.get("extra_insurance") else 0
 
-    all_cars = list(qs)
-    target_cars = [c for c in all_cars if c.category.lower() == wanted_category]
-    other_cars = [c for c in all_cars if c not in target_cars]
+def _predict_many(company_id, features):
+    """
+    Για κάθε αίτημα (category, days, total_price, extra_insurance) επιστρέφει
+    (probas, class_ids), ή None αν δεν υπάρχει μοντέλο / άγνωστη κατηγορία
+    (→ default_ranking).
+    Πρώτα από τον προϋπολογισμένο RankingTable (μόνο αν είναι exact), και ό,τι μείνει με ΕΝΑ
+    predict_proba για όλα τα υπόλοιπα αιτήματα (FlatForest, ή sklearn για
+    παλιά artifacts).
+    """
+    results = [None] * len(features)
+    live = list(range(len(features)))
 
-    model_path = f"model_company_{company_id}.joblib"
-    if not os.path.exists(model_path):
-        return default_ranking(request_filters, qs)
+    table = _exact_table(company_id)
+    if table is not None:
+        # Άγνωστη κατηγορία: άγνωστη και στο μοντέλο (→ default_ranking).
+        from_table = [i for i in live if table.has_category(features[i][0])]
+        live = []
+        if from_table:
+            columns = list(zip(*(features[i] for i in from_table)))
+            rows = table.lookup_many(*columns)
+            class_ids = table.classes
+            for i, row in zip(from_table, rows):
+                results[i] = (row, class_ids)
+    if not live:
+        return results
+
+    try:
+        forest = model_registry.get(company_id, "forest")
+    except Exception:
+        forest = None
+    if forest is not None:
+        _predict_forest(forest, features, live, results)
+        return results
 
+    # Μοντέλα από παλιότερο training (χωρίς FlatForest): live inference με sklearn.
     try:
-        model, category_encoder = joblib.load(model_path)
+        loaded = model_registry.get(company_id)
     except Exception:
-        return default_ranking(request_filters, qs)
+        return results
+    if loaded is None:
+        return results
+    model, category_encoder = loaded
 
-    if wanted_category not in category_encoder.classes_:
-        return default_ranking(request_filters, qs)
+    live = [i for i in live if features[i][0] in category_encoder.classes_]
+    if not live:
+        return results
 
-    category_encoded = category_encoder.transform([wanted_category])[0]
-    scores = {}
+    categories_encoded = category_encoder.transform([features[i][0] for i in live])
     input_features = [
-        days,
-        total_price,
-        extra_insurance,
-        category_encoded,
+        [features[i][1], features[i][2], features[i][3], category_encoded]
+        for i, category_encoded in zip(live, categories_encoded)
     ]
-
     try:
-        probas = model.predict_proba([input_features])[0]
-        class_ids = model.classes_.tolist()
-        for car in target_cars:
-            prob = probas[class_ids.index(car.id)] if car.id in class_ids else 0.0
-            scores[car] = prob
-    except:
-        for car in target_cars:
-            scores[car] = 0.0
-
-    sorted_target = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    sorted_target = [car for car, _ in sorted_target]
-    sorted_others = sorted(other_cars, key=lambda c: (c.brand.lower(), c.model.lower()))
-    return sorted_target + sorted_others
+        probas = model.predict_proba(input_features)
+        class_ids = model.classes_
+        for i, row in zip(live, probas):
+            results[i] = (row, class_ids)
+    except Exception:
+        for i in live:
+            results[i] = ([], [])
+    return results
 
-def default_ranking(request_filters, qs):
-    wanted = (request_filters.get("category") or "").lower()
 
-    def alpha_sort(car):
-        return (car.brand.lower(), car.model.lower())
+def _predict_forest(forest, features, live, results):
+    rows, indices = [], []
+    for i in live:
+        category_encoded = forest.encode_category(features[i][0])
+        if category_encoded is not None:
+            indices.append(i)
+            rows.append([features[i][1], features[i][2], features[i][3], category_encoded])
+    if not rows:
+        return
+    if len(rows) == 1:
+        probas = [forest.predict_proba_one(rows[0])]
+    else:
+        probas = forest.predict_proba(rows)
+    for i, row in zip(indices, probas):
+        results[i] = (row, forest.classes)
+
+
+def rank_cars(request_filters, qs, company_id):
+    """AI προτάσεις ανά εταιρεία — με fallback σε default αν δεν υπάρχει μοντέλο."""
+    features = _request_features(request_filters)
+    scorer = FleetScorer.from_cars(qs)
 
-    cars = list(qs)
-    if wanted:
-        primary = [c for c in cars if c.category.lower() == wanted]
-        secondary = [c for c in cars if c.category.lower() != wanted]
-        return sorted(primary, key=alpha_sort) + sorted(secondary, key=alpha_sort)
-    return sorted(cars, key=alpha_sort)
+    predicted = _predict_many(company_id, [features])[0]
+    if predicted is None:
+        return scorer.ranked_items(features[0])
+    return scorer.ranked_items(features[0], *predicted)
+
+
+def rank_car_ids(request_filters, qs, company_id):
+    """
+    Όπως το rank_cars αλλά χωρίς Car instances: διαβάζει μόνο τα πεδία που
+    χρειάζεται η κατάταξη (``values()``) και επιστρέφει (car_ids, scores).
+    """
+    features = _request_features(request_filters)
+    if hasattr(qs, "values"):
+        qs = qs.values(*VALUES_FIELDS)
+    scorer = FleetScorer.from_values(qs)
+
+    predicted = _predict_many(company_id, [features])[0] or (None, None)
+    order = scorer.rank(features[0], *predicted)
+    if predicted[0] is None:
+        scores = [0.0] * len(order)
+    else:
+        scores = scorer.scores(*predicted)[order].tolist()
+    return scorer.ids[order].tolist(), scores
+
+
+def _cache_key(kind, company_id, features):
+    """
+    Key του ranking_cache. Όταν απαντά ο (exact) RankingTable, days/price μπαίνουν ως
+    κελιά του πίνακα (όλες οι τιμές ενός κελιού δίνουν ίδια κατάταξη)·
+    αλλιώς ως έχουν.
+    """
+    category, days, total_price, extra_insurance = features
+    table = _exact_table(company_id)
+    if table is not None and table.has_category(category):
+        buckets = ("cell",) + table.cell_key(days, total_price)
+    else:
+        buckets = ("value", days, round(total_price, 2))
+    model_version = tuple(model_registry.stamp(company_id, k) for k in ARTIFACTS)
+    return (kind, company_id, category) + buckets + (
+        extra_insurance, model_version, fleet_version(company_id),
+    )
+
+
+def _available_cars(company_id):
+    return Car.objects.filter(company_id=company_id, is_rented=False)
+
+
+def rank_available_cars(request_filters, company_id):
+    """
+    rank_cars πάνω στα διαθέσιμα οχήματα της εταιρείας, μέσω ranking_cache:
+    σε hit δεν τρέχει το μοντέλο· η cached σειρά (car ids) εφαρμόζεται στα
+    οχήματα που είναι ακόμα διαθέσιμα.
+    """
+    key = _cache_key("cars", company_id, _request_features(request_filters))
+    car_ids = ranking_cache.get(key)
+    if car_ids is None:
+        ranked = rank_cars(request_filters, _available_cars(company_id), company_id)
+        ranking_cache.set(key, [car.id for car in ranked])
+        return ranked
+    available = _available_cars(company_id).in_bulk()
+    return [available[car_id] for car_id in car_ids if car_id in available]
+
+
+def rank_available_car_ids(request_filters, company_id):
+    """Όπως το rank_available_cars, για το rank_car_ids (JSON API)."""
+    key = _cache_key("ids", company_id, _request_features(request_filters))
+    ranked = ranking_cache.get(key)
+    if ranked is None:
+        ranked = rank_car_ids(request_filters, _available_cars(company_id), company_id)
+        ranking_cache.set(key, ranked)
+        return ranked
+    available = set(_available_cars(company_id).values_list("id", flat=True))
+    kept = [(car_id, score) for car_id, score in zip(*ranked) if car_id in available]
+    return [car_id for car_id, _ in kept], [score for _, score in kept]
+
+
+def rank_cars_batch(company_id, requests, cars):
+    """
+    Όπως το rank_cars αλλά για πολλά αιτήματα μαζί πάνω στον ίδιο στόλο:
+    ένα predict_proba για όλα αντί για ένα ανά αίτημα.
+    Επιστρέφει μία κατάταξη (λίστα Car) ανά request_filters.
+    """
+    requests = list(requests)
+    scorer = FleetScorer.from_cars(cars)
+    features = [_request_features(r) for r in requests]
+    rankings = []
+    for feats, predicted in zip(features, _predict_many(company_id, features)):
+        rankings.append(scorer.ranked_items(feats[0], *(predicted or ())))
+    return rankings
+
+
+def suggest_cars(bookings):
+    """
+    Προτεινόμενο όχημα για όσες κρατήσεις δεν έχουν: το πρώτο της AI κατάταξης
+    που δεν έχει ήδη ανατεθεί ούτε προταθεί σε άλλη, με ένα rank_cars_batch ανά
+    εταιρεία. Δεν αλλάζει τις κρατήσεις· επιστρέφει [(booking, car)] για όσες
+    βρέθηκε όχημα.
+    """
+    pending = [b for b in bookings if b.chosen_car_id is None]
+    pending.sort(key=lambda b: (b.start_date is None, b.start_date or 0, b.pk or 0))
+    by_company = {}
+    for booking in pending:
+        by_company.setdefault(booking.company_id, []).append(booking)
+
+    suggestions = []
+    for company_id, company_bookings in by_company.items():
+        rankings = rank_cars_batch(
+            company_id, [b.rental_filters() for b in company_bookings], _available_cars(company_id),
+        )
+        taken = set(
+            Booking.objects.filter(
+                company_id=company_id, status__in=["imported", "active"], chosen_car__isnull=False,
+            ).values_list("chosen_car_id", flat=True)
+        )
+        for booking, ranking in zip(company_bookings, rankings):
+            car = next((c for c in ranking if c.id not in taken), None)
+            if car is None:
+                continue
+            taken.add(car.id)
+            suggestions.append((booking, car))
+    return suggestions
+
+
+def default_ranking(request_filters, qs):
+    """Η ζητούμενη κατηγορία πρώτη, όλα αλφαβητικά (brand, model)."""
+    return FleetScorer.from_cars(qs).ranked_items(request_filters.get("category"))
 
 def default_ranking_direct(car_list):
     def alpha_sort(car):
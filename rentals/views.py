@@ -1,10 +1,17 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404, redirect, render
-from django.http import HttpResponse, HttpResponseNotAllowed
+from django.db import close_old_connections, transaction
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
 from django.core.mail import send_mail
+from django.utils import timezone
 
 from .forms import (
     CarForm,
@@ -13,8 +20,9 @@ from .forms import (
     CompanyRegistrationForm,
 )
 from .models import Car, Company, Booking
-from .utils import rank_cars
+from .utils import rank_available_car_ids, rank_available_cars, suggest_cars
 from recommendations.models import RentalDecision, RentalRequest
+from recommendations.retraining import note_decision
 
 # ---------------- Υπάρχουσες Views ----------------
 
@@ -88,14 +96,13 @@ def select_car(request):
         RentalDecision.objects.create(request=rental_request)
         request_id = rental_request.id
 
-        available_cars = rank_cars(
+        available_cars = rank_available_cars(
             {
                 "category": chosen_category,
                 "days": days,
                 "total_price": total_price,
                 "extra_insurance": extra_insurance,
             },
-            list(available_qs),
             company.id
         )
     else:
@@ -191,7 +198,11 @@ def choose_car(request, request_id: int, car_id: int):
     chosen_car.save(update_fields=["is_rented"])
 
     decision.chosen_car = chosen_car
-    decision.save(update_fields=["chosen_car"])
+    decision.decided_at = timezone.now()
+    decision.save(update_fields=["chosen_car", "decided_at"])
+    # Μόνο ο μετρητής· το retrain (αν χρειάζεται) τρέχει στο background.
+    company_id = chosen_car.company_id
+    transaction.on_commit(lambda: note_decision(company_id))
 
     messages.success(
         request,
@@ -243,11 +254,19 @@ def test_email(request):
 @login_required
 def bookings_list(request):
     company = get_object_or_404(Company, user=request.user)
-    q = Booking.objects.filter(company=company).order_by("start_date")
+    q = Booking.objects.filter(company=company).select_related("chosen_car").order_by("start_date")
     status = request.GET.get("status")
     if status:
         q = q.filter(status=status)
-    return render(request, "rentals/bookings_list.html", {"bookings": q, "status": status})
+
+    # AI πρόταση οχήματος για όσες κρατήσεις δεν έχουν όχημα — ένα batch για όλες,
+    # διαφορετικό όχημα σε καθεμία (όπως το admin action, χωρίς αποθήκευση)
+    bookings = list(q)
+    pending = [b for b in bookings if b.status in ("imported", "active") and not b.chosen_car_id]
+    for booking, car in suggest_cars(pending):
+        booking.suggested_car = car
+
+    return render(request, "rentals/bookings_list.html", {"bookings": bookings, "status": status})
 
 
 @login_required
@@ -280,3 +299,73 @@ def booking_set_status(request, booking_id: int, action: str):
     if status_filter:
         return redirect(f"/rentals/bookings/?status={status_filter}")
     return redirect("rentals:bookings_list")
+
+
+# ---------------- JSON API (async) ----------------
+
+# Το ORM και το scoring τρέχουν εδώ, εκτός event loop, με όριο ταυτόχρονων εργασιών.
+_api_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "RECOMMENDATION_API_WORKERS", 8),
+    thread_name_prefix="recommendations-api",
+)
+
+
+def _api_filters(params):
+    """Τα query params → request_filters του rank_cars (ValueError για άκυρες τιμές)."""
+    days = int(params.get("days") or 1)
+    total_price = float(params.get("total_price") or 0)
+    if days < 1 or total_price < 0:
+        raise ValueError("days >= 1 και total_price >= 0")
+    return {
+        "category": params.get("category") or "",
+        "days": days,
+        "total_price": total_price,
+        "extra_insurance": params.get("extra_insurance", "").lower() in ("1", "true", "yes", "on"),
+    }
+
+
+def _recommendations_payload(user_id, request_filters):
+    close_old_connections()
+    try:
+        company = Company.objects.filter(user_id=user_id).first()
+        if company is None:
+            return None
+        car_ids, scores = rank_available_car_ids(request_filters, company.id)
+        return {
+            "company": company.id,
+            "category": request_filters["category"],
+            "results": [
+                {"car_id": car_id, "score": round(score, 6)}
+                for car_id, score in zip(car_ids, scores)
+            ],
+        }
+    finally:
+        close_old_connections()
+
+
+async def api_recommendations(request):
+    """
+    GET /rentals/api/recommendations/?category=&days=&total_price=&extra_insurance=
+    Επιστρέφει τα διαθέσιμα οχήματα σε σειρά κατάταξης (car_id + score).
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+
+    user_id = await sync_to_async(
+        lambda: request.user.id if request.user.is_authenticated else None
+    )()
+    if user_id is None:
+        return JsonResponse({"error": "authentication required"}, status=401)
+
+    try:
+        request_filters = _api_filters(request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": f"invalid parameters: {e}"}, status=400)
+
+    loop = asyncio.get_running_loop()
+    payload = await loop.run_in_executor(
+        _api_executor, _recommendations_payload, user_id, request_filters
+    )
+    if payload is None:
+        return JsonResponse({"error": "company not found"}, status=404)
+    return JsonResponse(payload)